@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from codespeed.models import Project, Revision, Executable, Benchmark, Result, Environment
 from django.contrib import admin
+from codespeed import cache
 
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ('name', 'repo_type', 'repo_path', 'track')
@@ -8,9 +9,14 @@ class ProjectAdmin(admin.ModelAdmin):
 admin.site.register(Project, ProjectAdmin)
 
 class RevisionAdmin(admin.ModelAdmin):
-    list_display = ('commitid', 'project', 'tag', 'date')
-    list_filter  = ('project', 'tag', 'date')
+    list_display = ('commitid', 'project', 'tag', 'date', 'pending', 'attempts', 'error')
+    list_filter  = ('project', 'tag', 'date', 'pending')
     search_fields = ['commitid']
+    actions = ['retry_vcs_info']
+    
+    def retry_vcs_info(self, request, queryset):
+        queryset.update(pending=True, attempts=0, error="")
+    retry_vcs_info.short_description = "Fetch the VCS info of the selected revisions again"
 
 admin.site.register(Revision, RevisionAdmin)
 
@@ -30,8 +36,33 @@ class EnvironmentAdmin(admin.ModelAdmin):
 
 admin.site.register(Environment, EnvironmentAdmin)
 
+def invalidating(view):
+    '''Makes stale the cached responses after a view that changes results
+    has committed its transaction
+    '''
+    def wrapper(self, request, *args, **kwargs):
+        response = view(self, request, *args, **kwargs)
+        if request.method == 'POST': cache.invalidate_all()
+        return response
+    return wrapper
+
 class ResultAdmin(admin.ModelAdmin):
     list_display = ('revision', 'benchmark', 'executable', 'environment', 'value', 'date', 'environment')
     list_filter  = ('date', 'executable', 'benchmark', 'environment')
+    
+    def queryset(self, request):
+        qs = super(ResultAdmin, self).queryset(request)
+        # The list and change pages don't show the samples, which can be
+        # large. Deletions and changes load the whole results, as they are
+        # listed and logged by their real model
+        if request.method == 'GET' and not request.path.endswith('/delete/'):
+            qs = qs.defer('samples')
+        return qs
+    
+    add_view = invalidating(admin.ModelAdmin.add_view)
+    change_view = invalidating(admin.ModelAdmin.change_view)
+    delete_view = invalidating(admin.ModelAdmin.delete_view)
+    # Actions, like deleting the selected results
+    changelist_view = invalidating(admin.ModelAdmin.changelist_view)
 
 admin.site.register(Result, ResultAdmin)
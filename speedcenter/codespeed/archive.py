@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''Columnar archive of the result series, for offline analysis
+
+Every (executable, benchmark, environment) series is stored in the directory
+"<executable id>-<benchmark id>-<environment id>" of settings.archivedir, with
+one .npy file per column (see COLUMNS), ordered by revision date, and a
+meta.json file with the names of the series and its length. The files can be
+loaded, or memory-mapped, with numpy.load(path, mmap_mode='r').
+
+The .npy headers have a fixed size, so that new results can be appended
+without rewriting the files. Series whose results are not newer than the
+archived ones are rewritten from the database.
+'''
+import os, re, json, struct, sys, calendar
+from array import array
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from codespeed import settings, metadata
+from codespeed.models import Result, Executable, Benchmark, Environment
+
+# Name and numpy type of the columns. Missing values are NaN
+COLUMNS = [
+    ('revision_date', '<M8[s]'), # seconds since the epoch
+    ('revision_id', '<i8'),
+    ('result_id', '<i8'),
+    ('value', '<f8'),
+    ('std_dev', '<f8'),
+    ('val_min', '<f8'),
+    ('val_max', '<f8'),
+]
+# Size of the .npy headers, room for the shape of any series included
+HEADERSIZE = 128
+MAGIC = "\x93NUMPY\x01\x00"
+
+
+def getarchivedir():
+    return getattr(settings, 'archivedir', None)
+
+def getseriesdir(key):
+    return os.path.join(getarchivedir(), "%d-%d-%d" % key)
+
+def npyheader(descr, length):
+    text = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, length)
+    text += " " * (HEADERSIZE - len(MAGIC) - 2 - len(text) - 1) + "\n"
+    return MAGIC + struct.pack('<H', len(text)) + text
+
+def readlength(f):
+    '''Returns the number of elements of an open .npy file of the archive'''
+    f.seek(0)
+    header = f.read(HEADERSIZE)
+    match = re.search(r"'shape': \((\d+),\)", header)
+    if not header.startswith(MAGIC) or match is None:
+        raise IOError("%s is not an archive column" % f.name)
+    return int(match.group(1))
+
+def pack(descr, values):
+    if descr == '<f8':
+        data = array('d', [v is None and float('nan') or v for v in values])
+        if sys.byteorder != 'little': data.byteswap()
+        return data.tostring()
+    return struct.pack('<%dq' % len(values), *values)
+
+def getrow(revision_date, revision_id, result_id, value, std_dev, val_min, val_max):
+    """Returns the archived columns of a result, in the order of COLUMNS.
+    Values may be strings when they come from the request data
+    """
+    date = Result._meta.get_field('revision_date').to_python(revision_date)
+    # Results saved before revision dates were copied to them have none
+    if date is None: date = 0
+    else: date = calendar.timegm(date.timetuple())
+    row = [date, int(revision_id), int(result_id)]
+    for value in [value, std_dev, val_min, val_max]:
+        if value is None or value == "": row.append(None)
+        else: row.append(float(value))
+    return row
+
+def readmeta(path):
+    try:
+        f = open(os.path.join(path, 'meta.json'))
+    except IOError:
+        return None
+    try:
+        return json.load(f)
+    except ValueError:
+        return None
+    finally:
+        f.close()
+
+def writemeta(path, key, length, last_date):
+    exe = metadata.get(Executable, id=key[0])
+    meta = {
+        'executable': exe.name,
+        'executable_id': exe.id,
+        'project': exe.project.name,
+        'benchmark': metadata.get(Benchmark, id=key[1]).name,
+        'environment': metadata.get(Environment, id=key[2]).name,
+        'length': length,
+        'last_date': last_date,
+        'columns': dict(COLUMNS),
+    }
+    name = os.path.join(path, 'meta.json')
+    f = open(name + '.tmp', 'w')
+    try:
+        json.dump(meta, f)
+    finally:
+        f.close()
+    os.rename(name + '.tmp', name)
+
+def lock(path):
+    '''Locks a series directory against other processes, creating it if needed'''
+    if not os.path.exists(path): os.makedirs(path)
+    f = open(os.path.join(path, 'lock'), 'w')
+    if fcntl is not None: fcntl.flock(f, fcntl.LOCK_EX)
+    return f
+
+def unlock(f):
+    if fcntl is not None: fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
+
+def writeseries(key, rows):
+    '''Rewrites the columns of a series with the given rows'''
+    path = getseriesdir(key)
+    for i, (name, descr) in enumerate(COLUMNS):
+        filename = os.path.join(path, name + '.npy')
+        f = open(filename + '.tmp', 'wb')
+        try:
+            f.write(npyheader(descr, len(rows)))
+            f.write(pack(descr, [row[i] for row in rows]))
+        finally:
+            f.close()
+        os.rename(filename + '.tmp', filename)
+    if rows: last_date = rows[-1][0]
+    else: last_date = None
+    writemeta(path, key, len(rows), last_date)
+
+def appendseries(key, rows, meta):
+    '''Appends rows that are newer than the archived ones to a series'''
+    path = getseriesdir(key)
+    length = meta['length'] + len(rows)
+    for i, (name, descr) in enumerate(COLUMNS):
+        f = open(os.path.join(path, name + '.npy'), 'r+b')
+        try:
+            if readlength(f) != meta['length']:
+                raise IOError("%s doesn't match the series length" % f.name)
+            # Data written before the header, so that an interrupted append
+            # leaves the file as it was
+            f.seek(HEADERSIZE + 8 * meta['length'])
+            f.write(pack(descr, [row[i] for row in rows]))
+            f.truncate()
+            f.seek(0)
+            f.write(npyheader(descr, length))
+        finally:
+            f.close()
+    writemeta(path, key, length, rows[-1][0])
+
+def rebuildseries(key):
+    '''Rewrites a series from the database'''
+    writeseries(key, [getrow(*row) for row in Result.objects.filter(
+        executable=key[0], benchmark=key[1], environment=key[2]
+    ).order_by('revision_date', 'id').values_list('revision_date', 'revision',
+        'id', 'value', 'std_dev', 'val_min', 'val_max')])
+
+def saferebuildseries(key):
+    '''Rewrites a series, or leaves it to be rewritten by the next update'''
+    try:
+        rebuildseries(key)
+    except EnvironmentError:
+        path = os.path.join(getseriesdir(key), 'meta.json')
+        if os.path.exists(path): os.remove(path)
+
+def updatearchive(results):
+    """Adds saved results to the archive, if it is enabled. Results newer
+    than their archived series are appended, other series are rewritten
+    """
+    if getarchivedir() is None: return
+    series = {}
+    for r in results:
+        key = (r.executable_id, r.benchmark_id, r.environment_id)
+        series.setdefault(key, []).append(getrow(r.revision_date, r.revision_id,
+            r.id, r.value, r.std_dev, r.val_min, r.val_max))
+    for key, rows in series.items():
+        rows.sort(key=lambda row: (row[0], row[2]))
+        path = getseriesdir(key)
+        f = lock(path)
+        try:
+            meta = readmeta(path)
+            if meta is not None and meta['last_date'] is not None and \
+                    rows[0][0] > meta['last_date']:
+                appendseries(key, rows, meta)
+            else:
+                rebuildseries(key)
+        except EnvironmentError:
+            # For example an interrupted append
+            saferebuildseries(key)
+        finally:
+            unlock(f)
+
+def updaterevision(revision):
+    """Rewrites the archived series that have results for a revision whose
+    date changed, if the archive is enabled
+    """
+    if getarchivedir() is None: return
+    for key in set(Result.objects.filter(revision=revision).values_list(
+            'executable', 'benchmark', 'environment')):
+        f = lock(getseriesdir(key))
+        try:
+            saferebuildseries(key)
+        finally:
+            unlock(f)
+
+def getindex():
+    '''Returns the meta data of the archived series'''
+    archivedir = getarchivedir()
+    index = []
+    if archivedir is None or not os.path.exists(archivedir): return index
+    for name in sorted(os.listdir(archivedir)):
+        meta = readmeta(os.path.join(archivedir, name))
+        if meta is not None:
+            meta['path'] = name
+            index.append(meta)
+    return index
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+'''Server-side cache for the JSON and table responses
+
+Cached responses are keyed on the view name, the normalized query
+parameters and the generation counters of the (project, environment) pairs
+the response depends on. Saving results bumps the generation of its pair,
+so stale responses are simply never looked up again and age out of the
+cache.
+'''
+from hashlib import md5
+from threading import Lock
+
+from django.core.signals import request_started
+from django.http import HttpResponse
+from codespeed import settings
+
+# Generation of responses that depend on the results of every project and
+# environment. It is bumped whenever any result is saved
+ALL = (None, None)
+# Generation that every response depends on. It is bumped when projects,
+# benchmarks, executables, environments or revisions change
+META = ('meta', None)
+
+
+class LocalBackend(object):
+    '''In-process LRU cache holding at most "size" responses.
+    Responses are kept in a circular doubly linked list, least recently used
+    first, so that looking them up, adding and evicting them doesn't depend
+    on the size of the cache.
+    Generations are kept in a separate dict so that they are never evicted.
+    Note that each process has its own cache and generations, which is fine
+    for a single process deployment (like runserver) only
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.lock = Lock()
+        self.generations = {}
+        self.clear()
+
+    # The list nodes are [previous, next, key, value] lists
+    def unlink(self, node):
+        node[0][1] = node[1]
+        node[1][0] = node[0]
+
+    def append(self, node):
+        last = self.root[0]
+        node[0], node[1] = last, self.root
+        last[1] = self.root[0] = node
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            node = self.data.get(key)
+            if node is None:
+                return None
+            self.unlink(node)
+            self.append(node)
+            return node[3]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            node = self.data.get(key)
+            if node is not None:
+                self.unlink(node)
+            elif len(self.data) >= self.size:
+                # Evict the least recently used response
+                oldest = self.root[1]
+                self.unlink(oldest)
+                del self.data[oldest[2]]
+            node = [None, None, key, value]
+            self.append(node)
+            self.data[key] = node
+        finally:
+            self.lock.release()
+
+    def getgenerations(self, keys):
+        return [self.generations.get(key, 0) for key in keys]
+
+    def bump(self, key):
+        self.lock.acquire()
+        try:
+            self.generations[key] = self.generations.get(key, 0) + 1
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data = {}
+            self.root = [None, None, None, None]
+            self.root[0] = self.root[1] = self.root
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.data)
+
+
+class DjangoBackend(object):
+    '''Stores responses and generations in the cache configured with the
+    CACHE_BACKEND Django setting (e.g. a local memcached), which is shared by
+    all processes
+    '''
+    prefix = 'codespeed:'
+
+    def __init__(self):
+        from django.core.cache import cache
+        self.cache = cache
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.cache.set(self.prefix + key, value)
+
+    def generationkey(self, key):
+        return self.prefix + 'generation:%s:%s' % key
+
+    def getgenerations(self, keys):
+        keys = [self.generationkey(key) for key in keys]
+        generations = self.cache.get_many(keys)
+        return [generations.get(key, 0) for key in keys]
+
+    def bump(self, key):
+        key = self.generationkey(key)
+        # add() does nothing if the key already exists
+        self.cache.add(key, 0)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # The key was evicted in the meantime
+            self.cache.set(key, 1)
+
+    def clear(self):
+        # Bumping the generation shared by all keys makes them stale
+        self.bump(META)
+
+    def __len__(self):
+        return 0
+
+
+backend = None
+# Number of cached responses served and of responses that were not cached,
+# updated under statslock
+hits = 0
+misses = 0
+statslock = Lock()
+# Local copy of the META generation, which is also kept without a backend
+metageneration = 0
+
+def getbackend():
+    global backend
+    if backend is None:
+        cachetype = getattr(settings, 'responsecache', None)
+        if cachetype == 'locmem':
+            backend = LocalBackend(getattr(settings, 'responsecache_size', 500))
+        elif cachetype == 'django':
+            backend = DjangoBackend()
+    return backend
+
+def isshared():
+    """Tells whether the backend is shared by all processes, so that its
+    generations also change with the data saved by the other processes
+    """
+    return isinstance(getbackend(), DjangoBackend)
+
+def startrequest(**kwargs):
+    """Without a shared backend, other processes can't make the memoized
+    values stale, so they are only kept during a request
+    """
+    global metageneration
+    if not isshared(): metageneration += 1
+
+request_started.connect(startrequest, dispatch_uid="codespeed.cache.startrequest")
+
+def invalidate(project_id, environment_id):
+    '''Makes stale all cached responses that depend on results of the given
+    project and environment
+    '''
+    if getbackend() is None: return
+    backend.bump((project_id, environment_id))
+    backend.bump(ALL)
+
+def invalidate_all(*args, **kwargs):
+    '''Makes stale all cached responses. Can be connected to model signals'''
+    global metageneration
+    metageneration += 1
+    if getbackend() is None: return
+    backend.bump(META)
+
+def count(hit):
+    global hits, misses
+    statslock.acquire()
+    try:
+        if hit: hits += 1
+        else: misses += 1
+    finally:
+        statslock.release()
+
+def stats():
+    '''Returns the number of hits, misses and cached responses'''
+    size = 0
+    if getbackend() is not None: size = len(backend)
+    return {'hits': hits, 'misses': misses, 'size': size}
+
+def cached(scope):
+    '''Decorator that caches the responses of a GET view.
+    scope is called with the request data and must return the list of
+    (project id, environment id) pairs the response depends on, or [ALL].
+    If scope raises an exception the view is called without caching, so
+    that it can handle the bad request as usual
+    '''
+    def decorator(view):
+        def cachedview(request):
+            if getbackend() is None or request.method != 'GET':
+                return view(request)
+            try:
+                generationkeys = scope(request.GET)
+            except Exception:
+                return view(request)
+            generationkeys = sorted(set([META] + list(generationkeys)))
+            generations = backend.getgenerations(generationkeys)
+            key = [view.__name__]
+            key += ['%s=%s' % item for item in sorted(request.GET.items())]
+            key += ['%s:%s=%s' % (k[0], k[1], g)
+                for k, g in zip(generationkeys, generations)]
+            key = md5('&'.join(key).encode('utf-8')).hexdigest()
+
+            content = backend.get(key)
+            if content is not None:
+                count(True)
+                return HttpResponse(content)
+            count(False)
+            response = view(request)
+            if response.status_code == 200:
+                backend.set(key, response.content)
+            return response
+        cachedview.__name__ = view.__name__
+        cachedview.__doc__ = view.__doc__
+        return cachedview
+    return decorator
+
+def memoize(func):
+    '''Decorator that keeps the return value of a function without
+    arguments until projects, benchmarks, executables, environments or
+    revisions change, or only during a request without a shared backend
+    (see startrequest). The returned value is shared, so it must not be
+    modified
+    '''
+    memo = {}
+    def memoized():
+        key = [metageneration]
+        if getbackend() is not None:
+            key += backend.getgenerations([META])
+        key = tuple(key)
+        if key not in memo:
+            value = func()
+            memo.clear()
+            memo[key] = value
+        return memo[key]
+    memoized.__name__ = func.__name__
+    memoized.__doc__ = func.__doc__
+    return memoized
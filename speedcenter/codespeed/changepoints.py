@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''Online change point detection of the result series
+
+Every (executable, benchmark, environment) series has a SeriesState with a
+two-sided CUSUM chart of the deviations of the new values from the mean of
+the values since the last change, measured in standard deviations. Each new
+value updates it in constant time, so no history is read when saving
+results. When one of the charts exceeds the threshold a ChangePoint is
+stored for the result where the chart started growing.
+'''
+from math import sqrt
+
+from codespeed import settings
+from codespeed.models import Result, SeriesState, ChangePoint, bulkinsert, bulkupdate
+
+THRESHOLD = getattr(settings, 'changepoint_threshold', 5)
+DRIFT = getattr(settings, 'changepoint_drift', 0.5)
+WARMUP = max(2, getattr(settings, 'changepoint_warmup', 5))
+# Minimum standard deviation, relative to the mean, so that very stable
+# series don't report changes in the noise
+MINDEVIATION = 0.001
+
+
+def resetcharts(state):
+    state.up, state.up_start, state.up_count, state.up_sum = 0.0, None, 0, 0.0
+    state.down, state.down_start, state.down_count, state.down_sum = 0.0, None, 0, 0.0
+
+def process(state, result_id, value):
+    """Updates the state of a series with its next value.
+    Returns a ChangePoint if a change was detected, None otherwise
+    """
+    if state.count >= WARMUP:
+        deviation = max(sqrt(state.m2 / (state.count - 1)),
+            abs(state.mean) * MINDEVIATION, 1e-12)
+        z = (value - state.mean) / deviation
+        for side, step in [('up', z - DRIFT), ('down', -z - DRIFT)]:
+            total = getattr(state, side) + step
+            if total > 0:
+                if getattr(state, side) == 0:
+                    # The chart starts growing: possible change point
+                    setattr(state, side + '_start', result_id)
+                    setattr(state, side + '_count', 0)
+                    setattr(state, side + '_sum', 0.0)
+                setattr(state, side + '_count', getattr(state, side + '_count') + 1)
+                setattr(state, side + '_sum', getattr(state, side + '_sum') + value)
+            setattr(state, side, max(0.0, total))
+        for side in ['up', 'down']:
+            if getattr(state, side) > THRESHOLD:
+                count = getattr(state, side + '_count')
+                after = getattr(state, side + '_sum') / count
+                change = None
+                if state.mean: change = (after - state.mean) * 100 / state.mean
+                point = ChangePoint(result_id=getattr(state, side + '_start'),
+                    before=state.mean, after=after, change=change)
+                # Start a new regime with the values since the change,
+                # keeping the previous variance as estimate
+                variance = state.m2 / (state.count - 1)
+                state.count, state.mean = count, after
+                state.m2 = variance * (count - 1)
+                resetcharts(state)
+                return point
+    # Welford's online mean and variance
+    state.count += 1
+    delta = value - state.mean
+    state.mean += delta / state.count
+    state.m2 += delta * (value - state.mean)
+    return None
+
+def updatechangepoints(results):
+    """Feeds the given saved results to the change point detection of their
+    series, in revision order. Results that are not newer than the last
+    processed result of their series are skipped
+    """
+    series = {}
+    for result in results:
+        key = (result.executable_id, result.benchmark_id, result.environment_id)
+        series.setdefault(key, []).append(result)
+    if not series: return
+    states = {}
+    for state in SeriesState.objects.filter(
+            executable__in=set([key[0] for key in series]),
+            benchmark__in=set([key[1] for key in series]),
+            environment__in=set([key[2] for key in series])):
+        states[(state.executable_id, state.benchmark_id, state.environment_id)] = state
+
+    datefield = Result._meta.get_field('revision_date')
+    new, changed, points = [], [], []
+    for key, results in series.items():
+        state = states.get(key)
+        if state is None:
+            state = SeriesState(executable_id=key[0], benchmark_id=key[1],
+                environment_id=key[2])
+            resetcharts(state)
+            new.append(state)
+        else:
+            changed.append(state)
+        results = [(datefield.to_python(result.revision_date), result)
+            for result in results]
+        results.sort(key=lambda item: item[0])
+        for date, result in results:
+            if state.last_date is not None and date <= state.last_date: continue
+            state.last_date = date
+            point = process(state, result.id, float(result.value))
+            if point is not None: points.append(point)
+    bulkupdate(SeriesState, changed)
+    bulkinsert(SeriesState, new)
+    bulkinsert(ChangePoint, points)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''Git commit logs support
+
+Commits are read through a persistent "git cat-file --batch" process per
+repository, so that no process needs to be forked for every commit or
+request
+'''
+import os
+from datetime import datetime
+from heapq import heappush, heappop
+from subprocess import Popen, PIPE
+from threading import Lock
+from speedcenter import settings
+from codespeed import profiling
+
+
+path = settings.BASEDIR + '/repos/'
+# Maximum number of commits returned by getlogs
+loglimit = 200
+
+def getrepodir(repo):
+    name = repo.rstrip('/').split('/')[-1]
+    if not name.endswith('.git'): name += '.git'
+    return path + name + "/"
+
+def run(cmd, cwd):
+    p = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        return [{'error': True, 'message': stderr}]
+    return [{'error': False}]
+
+@profiling.timed('vcs')
+def updaterepo(repo):
+    repodir = getrepodir(repo)
+    if os.path.exists(repodir):
+        resp = run(['git', 'fetch', '--quiet', 'origin'], repodir)
+    else:
+        if not os.path.exists(path): os.makedirs(path)
+        resp = run(['git', 'clone', '--quiet', '--mirror', repo, repodir], path)
+    # The running cat-file process may not see the new refs
+    closereader(repodir)
+    return resp
+
+
+class ObjectReader(object):
+    '''Reads objects from a repository through "git cat-file --batch".
+    Requests are written in batches before reading the answers, so that many
+    objects can be read with a single round trip
+    '''
+    # Object names written at once. They must fit in the pipe buffer
+    batchsize = 500
+
+    def __init__(self, repodir):
+        self.repodir = repodir
+        self.lock = Lock()
+        self.process = None
+
+    def start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = Popen(['git', 'cat-file', '--batch'],
+                stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=self.repodir)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process = None
+
+    def read(self, names):
+        '''Returns a dict that maps each of the given object names (sha1s,
+        abbreviated sha1s, refs...) that exist to a (sha1, type, content)
+        tuple
+        '''
+        objects = {}
+        self.lock.acquire()
+        try:
+            self.start()
+            for i in range(0, len(names), self.batchsize):
+                batch = names[i:i + self.batchsize]
+                try:
+                    self.process.stdin.write(
+                        "".join([str(name) + "\n" for name in batch]))
+                    self.process.stdin.flush()
+                    for name in batch:
+                        header = self.process.stdout.readline().split()
+                        if len(header) != 3:
+                            # "<name> missing" or "<name> ambiguous"
+                            continue
+                        sha1, objtype, size = header
+                        content = self.process.stdout.read(int(size) + 1)[:-1]
+                        objects[name] = (sha1, objtype, content)
+                except IOError:
+                    # The process died, restart it the next time
+                    self.close()
+                    raise
+        finally:
+            self.lock.release()
+        return objects
+
+
+readers = {}
+readerslock = Lock()
+
+def getreader(repodir):
+    readerslock.acquire()
+    try:
+        if repodir not in readers:
+            readers[repodir] = ObjectReader(repodir)
+        return readers[repodir]
+    finally:
+        readerslock.release()
+
+def closereader(repodir):
+    readerslock.acquire()
+    try:
+        reader = readers.pop(repodir, None)
+    finally:
+        readerslock.release()
+    if reader is not None: reader.close()
+
+def parsecommit(sha1, content):
+    '''Parses a raw commit object'''
+    headers, message = content, ""
+    if "\n\n" in content: headers, message = content.split("\n\n", 1)
+    commit = {'commitid': sha1, 'parents': [], 'author': "",
+        'timestamp': 0, 'message': message.decode('utf-8', 'replace').strip()}
+    for line in headers.split("\n"):
+        key, value = line.split(" ", 1)
+        if key == 'parent':
+            commit['parents'].append(value)
+        elif key in ('author', 'committer'):
+            # "Name <email> timestamp timezone"
+            name, rest = value.rsplit(" <", 1)
+            if key == 'author': commit['author'] = name.decode('utf-8', 'replace')
+            else: commit['timestamp'] = int(rest.split("> ", 1)[1].split()[0])
+    commit['date'] = datetime.fromtimestamp(commit['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
+    return commit
+
+def getlog(commit):
+    return {'date': commit['date'], 'author': commit['author'],
+        'message': commit['message'], 'commitid': commit['commitid']}
+
+@profiling.timed('vcs')
+def getcommits(repo, commitids):
+    '''Returns a dict that maps each given commitid that exists in the
+    repository to its parsed commit, reading all of them in one pass
+    '''
+    objects = getreader(getrepodir(repo)).read(
+        [str(commitid) + "^{commit}" for commitid in commitids])
+    commits = {}
+    for commitid in commitids:
+        obj = objects.get(str(commitid) + "^{commit}")
+        if obj is not None:
+            commits[commitid] = parsecommit(obj[0], obj[2])
+    return commits
+
+@profiling.timed('vcs')
+def getlogs(endrev, startrev):
+    repo = endrev.project.repo_path
+    if not os.path.exists(getrepodir(repo)):
+        updaterepo(repo)
+
+    commits = getcommits(repo, [endrev.commitid, startrev.commitid])
+    for rev in [endrev, startrev]:
+        if rev.commitid not in commits:
+            return [{'error': True, 'message':
+                "'%s' is not a commit of '%s'" % (rev.commitid, repo)}]
+    end, start = commits[endrev.commitid], commits[startrev.commitid]
+
+    if end['commitid'] == start['commitid']:
+        return [getlog(end)]
+
+    # Walk the history back from endrev, newest first, until the commits
+    # that are older than startrev (like "git log startrev..endrev")
+    logs = []
+    reader = getreader(getrepodir(repo))
+    queue, seen = [(-end['timestamp'], end['commitid'], end)], set([start['commitid']])
+    while queue and len(logs) < loglimit:
+        commit = heappop(queue)[2]
+        if commit['commitid'] in seen: continue
+        seen.add(commit['commitid'])
+        logs.append(getlog(commit))
+        parents = [p for p in commit['parents'] if p not in seen]
+        for sha1, objtype, content in reader.read(parents).values():
+            parent = parsecommit(sha1, content)
+            if parent['timestamp'] >= start['timestamp']:
+                heappush(queue, (-parent['timestamp'], sha1, parent))
+    return logs
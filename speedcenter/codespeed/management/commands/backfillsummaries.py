@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from codespeed.models import Project, Revision, Result
+from codespeed.summaries import WINDOW, summarize, savesummaries
+
+# Number of revisions whose summaries are computed at once
+CHUNK = 200
+
+class Command(NoArgsCommand):
+    help = "Computes the change and trend summaries of all existing results"
+    
+    def handle_noargs(self, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        for project in Project.objects.all():
+            revisions = list(Revision.objects.filter(
+                project=project
+            ).order_by('date', 'id').values_list('id', flat=True))
+            if verbose: print "Project %s: %d revisions" % (project, len(revisions))
+            for start in range(0, len(revisions), CHUNK):
+                first = max(0, start - WINDOW)
+                window = revisions[first:start + CHUNK]
+                rows = Result.objects.filter(revision__in=window).values_list(
+                    'id', 'revision', 'executable', 'environment', 'benchmark', 'value')
+                savesummaries(summarize(window, start - first, rows))
+                transaction.commit_unless_managed()
+                if verbose: print "  %d/%d revisions" % (min(start + CHUNK, len(revisions)), len(revisions))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os, re, shutil
+from django.core.management.base import NoArgsCommand, CommandError
+
+from codespeed import archive
+from codespeed.models import Result
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the columnar archive of the result series in the directory given by the archivedir setting"
+    
+    def handle_noargs(self, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        archivedir = archive.getarchivedir()
+        if archivedir is None:
+            raise CommandError("The archive is disabled: set archivedir in codespeed/settings.py")
+        if not os.path.exists(archivedir): os.makedirs(archivedir)
+        
+        written = set()
+        def write(key, rows):
+            written.add("%d-%d-%d" % key)
+            f = archive.lock(archive.getseriesdir(key))
+            try:
+                archive.writeseries(key, rows)
+            finally:
+                archive.unlock(f)
+        
+        key, rows = None, []
+        for row in Result.objects.order_by(
+                'executable', 'benchmark', 'environment', 'revision_date', 'id'
+            ).values_list('executable', 'benchmark', 'environment', 'revision_date',
+                'revision', 'id', 'value', 'std_dev', 'val_min', 'val_max').iterator():
+            if row[:3] != key:
+                if key is not None: write(key, rows)
+                key, rows = row[:3], []
+            rows.append(archive.getrow(*row[3:]))
+        if key is not None: write(key, rows)
+        
+        # Remove the series that have no results anymore
+        for name in os.listdir(archivedir):
+            if re.match(r'^\d+-\d+-\d+$', name) and name not in written:
+                shutil.rmtree(os.path.join(archivedir, name))
+        if verbose: print "%d series archived in %s" % (len(written), archivedir)
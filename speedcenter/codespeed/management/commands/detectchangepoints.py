@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from codespeed.models import Result, SeriesState, ChangePoint, bulkinsert
+from codespeed.changepoints import process, resetcharts
+
+# Number of change points inserted at once
+CHUNK = 1000
+
+class Command(NoArgsCommand):
+    help = "Runs the change point detection over all existing results, replacing the detected change points"
+    
+    def handle_noargs(self, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        ChangePoint.objects.all().delete()
+        SeriesState.objects.all().delete()
+        
+        states, points = [], []
+        state = None
+        for result_id, executable, benchmark, environment, date, value in \
+                Result.objects.order_by(
+                    'executable', 'benchmark', 'environment', 'revision_date', 'id'
+                ).values_list('id', 'executable', 'benchmark', 'environment',
+                    'revision_date', 'value').iterator():
+            key = (executable, benchmark, environment)
+            if state is None or key != (state.executable_id,
+                    state.benchmark_id, state.environment_id):
+                state = SeriesState(executable_id=executable,
+                    benchmark_id=benchmark, environment_id=environment)
+                resetcharts(state)
+                states.append(state)
+            if state.last_date is not None and date <= state.last_date: continue
+            state.last_date = date
+            point = process(state, result_id, value)
+            if point is not None: points.append(point)
+            if len(points) >= CHUNK:
+                bulkinsert(ChangePoint, points)
+                points = []
+        bulkinsert(ChangePoint, points)
+        bulkinsert(SeriesState, states)
+        transaction.commit_unless_managed()
+        if verbose:
+            print "%d series, %d change points" % (len(states), ChangePoint.objects.count())
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+
+from codespeed.models import Project, Revision
+from codespeed.views import saverevisioninfo
+
+
+class Command(NoArgsCommand):
+    help = "Fetches the author, date and message of the pending revisions from their VCS"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch', type='int', default=100,
+            help='Number of revisions fetched at once (default 100)'),
+        make_option('--attempts', type='int', default=5,
+            help='Number of times fetching a revision is tried (default 5)'),
+        make_option('--loop', type='int', default=0, metavar='SECONDS',
+            help='Keep running, looking for pending revisions every SECONDS'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        while True:
+            for project in Project.objects.all():
+                while True:
+                    revisions = list(Revision.objects.filter(
+                        project=project, pending=True,
+                        attempts__lt=options['attempts'],
+                    ).order_by('attempts', 'id')[:options['batch']])
+                    if not revisions: break
+                    updated = saverevisioninfo(project, revisions)
+                    if verbose:
+                        print "Project %s: %d of %d revisions updated" % (
+                            project, updated, len(revisions))
+                    if updated < len(revisions):
+                        # Retry the failed ones on the next run
+                        break
+            if not options['loop']: break
+            time.sleep(options['loop'])
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import os, re, sys, time, json, urllib2
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+from codespeed.views import saveresults
+
+
+def isurl(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+def sortkey(source):
+    '''Orders files named after their revision number numerically'''
+    name = source.rstrip('/').split('/')[-1].replace('.json', '')
+    if name.isdigit(): return (0, int(name), source)
+    return (1, 0, source)
+
+def listsources(source, timeout):
+    """Returns the result files of a source: a JSON file, a local directory,
+    or the URL of a file or of a directory listing
+    """
+    if isurl(source):
+        if not source.endswith('/'): return [source]
+        f = urllib2.urlopen(source, timeout=timeout)
+        try:
+            listing = f.read()
+        finally:
+            f.close()
+        names = set(re.findall(r'href="([^"/?]+\.json)"', listing))
+        return [source + name for name in names]
+    elif os.path.isdir(source):
+        return [os.path.join(source, name) for name in os.listdir(source)
+            if name.endswith('.json')]
+    return [source]
+
+def parseresults(data, project, executable, environment, base=False):
+    """Returns the result data dicts of a perf.py result file, as the tools
+    in tools/pypy send them. base selects the results of the base
+    interpreter instead of the changed one
+    """
+    side = base and 'base' or 'changed'
+    items = []
+    for bench_name, res_type, results in data['results']:
+        item = {
+            'commitid': data['revision'],
+            'project': project,
+            'executable': executable,
+            'benchmark': bench_name,
+            'environment': environment,
+        }
+        if res_type == "SimpleComparisonResult":
+            item['result_value'] = results[side + '_time']
+        elif res_type == "ComparisonResult":
+            item['result_value'] = results['avg_' + side]
+            item['std_dev'] = results['std_' + side]
+        elif res_type == "RawResult":
+            times = results[side + '_times']
+            item['result_value'] = sum(times) / len(times)
+        else:
+            raise ValueError("unknown result type " + res_type)
+        if results.get(side + '_times'):
+            item['samples'] = results[side + '_times']
+        items.append(item)
+    return items
+
+
+class Command(BaseCommand):
+    help = "Imports perf.py JSON result files from local files and directories, or from URLs of files and directory listings. Files are fetched in parallel and saved in bulk transactions, and the imported files are recorded in a checkpoint file so that an interrupted import can be resumed"
+    args = '<file, directory or URL ...>'
+    option_list = BaseCommand.option_list + (
+        make_option('--project', default='PyPy',
+            help='Project of the results (default PyPy)'),
+        make_option('--executable',
+            help='Executable of the results'),
+        make_option('--environment',
+            help='Environment of the results'),
+        make_option('--base', action='store_true', default=False,
+            help='Import the results of the base interpreter instead of the changed one'),
+        make_option('--list', metavar='FILE',
+            help='File with more files, directories or URLs to import, one per line'),
+        make_option('--workers', type='int', default=8,
+            help='Number of files fetched and parsed in parallel (default 8)'),
+        make_option('--batch', type='int', default=50,
+            help='Number of files saved in each transaction (default 50)'),
+        make_option('--checkpoint', default='importresults.checkpoint', metavar='FILE',
+            help='File recording the imported files (default importresults.checkpoint)'),
+        make_option('--timeout', type='int', default=60,
+            help='Timeout of the HTTP requests in seconds (default 60)'),
+    )
+
+    def handle(self, *sources, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        if not options.get('executable') or not options.get('environment'):
+            raise CommandError("--executable and --environment are required")
+        sources = list(sources)
+        if options.get('list'):
+            f = open(options.get('list'))
+            try:
+                sources += [line.strip() for line in f
+                    if line.strip() and not line.startswith('#')]
+            finally:
+                f.close()
+        if not sources:
+            raise CommandError("Enter at least one file, directory or URL")
+
+        done = set()
+        checkpoint = options['checkpoint']
+        if checkpoint and os.path.exists(checkpoint):
+            f = open(checkpoint)
+            try:
+                done = set([line.rstrip('\n') for line in f])
+            finally:
+                f.close()
+
+        files = []
+        for source in sources:
+            try:
+                files.extend(listsources(source, options['timeout']))
+            except (IOError, urllib2.URLError), e:
+                raise CommandError("Could not list %s: %s" % (source, e))
+        # Save the revisions in order
+        files = [name for name in sorted(set(files), key=sortkey) if name not in done]
+        if verbose:
+            print "%d files to import, %d already imported" % (len(files), len(done))
+
+        def load(name):
+            """Fetches and parses a file. Runs in the worker threads"""
+            try:
+                if isurl(name): f = urllib2.urlopen(name, timeout=options['timeout'])
+                else: f = open(name)
+                try:
+                    data = json.load(f)
+                finally:
+                    f.close()
+                return name, parseresults(data, options['project'],
+                    options.get('executable'), options.get('environment'), options['base'])
+            except Exception, e:
+                return name, "%s: %s" % (e.__class__.__name__, e)
+
+        pool = ThreadPool(max(1, options['workers']))
+        batches = [files[i:i + options['batch']]
+            for i in range(0, len(files), options['batch'])]
+        start = time.time()
+        imported = saved = failed = 0
+        try:
+            # The next batch is fetched while the current one is saved
+            pending = batches and pool.map_async(load, batches[0])
+            for i in range(len(batches)):
+                loaded = pending.get()
+                if i + 1 < len(batches):
+                    pending = pool.map_async(load, batches[i + 1])
+
+                items, owners = [], []
+                for name, result in loaded:
+                    if isinstance(result, basestring):
+                        if verbose:
+                            print >>sys.stderr, "  Error reading %s: %s" % (name, result)
+                        failed += 1
+                    else:
+                        items += result
+                        owners += [name] * len(result)
+                # One transaction per batch
+                statuses = saveresults(items)
+                complete = set([name for name, result in loaded
+                    if not isinstance(result, basestring)])
+                for name, item, status in zip(owners, items, statuses):
+                    if status['status'] == 'saved':
+                        saved += 1
+                    else:
+                        if verbose:
+                            print >>sys.stderr, "  Error saving %s (%s): %s" % (name,
+                                item.get('benchmark'), status['message'])
+                        complete.discard(name)
+                failed += len([name for name, result in loaded
+                    if not isinstance(result, basestring) and name not in complete])
+                imported += len(complete)
+
+                if checkpoint and complete:
+                    f = open(checkpoint, 'a')
+                    try:
+                        f.write("".join([name + "\n" for name, result in loaded
+                            if name in complete]))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    finally:
+                        f.close()
+                if verbose:
+                    elapsed = max(time.time() - start, 1e-6)
+                    print "%d/%d files, %d results saved (%.1f files/s, %.1f results/s)" % (
+                        imported + failed, len(files), saved,
+                        (imported + failed) / elapsed, saved / elapsed)
+        finally:
+            pool.terminate()
+
+        elapsed = max(time.time() - start, 1e-6)
+        if verbose:
+            print "Imported %d files with %d results in %.1fs (%.1f results/s), %d files failed" % (
+                imported, saved, elapsed, saved / elapsed, failed)
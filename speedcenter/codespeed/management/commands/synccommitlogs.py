@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_right
+from django.core.management.base import NoArgsCommand
+
+from codespeed.models import Project, Revision, CommitLog
+from codespeed.views import savecommitlogs
+
+
+class Command(NoArgsCommand):
+    help = "Fetches and stores the commit logs of the revisions whose logs are not stored yet, so that the changes view can show them"
+    
+    def handle_noargs(self, **options):
+        verbose = int(options.get('verbosity', 1)) > 0
+        for project in Project.objects.exclude(repo_type='N').exclude(repo_path=""):
+            revisions = list(Revision.objects.filter(
+                project=project, date__isnull=False).order_by('date'))
+            dates = list(CommitLog.objects.filter(
+                project=project).order_by('date').values_list('date', flat=True))
+            if verbose: print "Project %s: %d revisions" % (project, len(revisions))
+            update = True
+            saved = 0
+            for i, rev in enumerate(revisions):
+                startrev = i and revisions[i - 1] or rev
+                # Skip revisions that already have logs since the previous revision
+                index = bisect_right(dates, rev.date)
+                if index and (startrev == rev or dates[index - 1] > startrev.date):
+                    continue
+                # Update the repository only once per project
+                try:
+                    result = savecommitlogs(rev, startrev, update)
+                except Exception, e:
+                    print "  Error fetching the logs of project %s: %s" % (project, e)
+                    break
+                update = False
+                if isinstance(result, basestring):
+                    print "  Error fetching the logs of revision %s: %s" % (rev.commitid, result)
+                else:
+                    saved += result
+            if verbose: print "  %d commit logs stored" % saved
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection, transaction
+
+from codespeed.models import Result, Revision
+
+
+# Columns added to existing tables since the first Codespeed version
+NEWCOLUMNS = [
+    (Result, 'revision_date'),
+    (Revision, 'pending'),
+    (Revision, 'attempts'),
+    (Revision, 'error'),
+    (Result, 'samples'),
+]
+
+def sqldefault(field):
+    """Returns the SQL literal of the default value of a field"""
+    default = field.get_default()
+    if isinstance(default, bool):
+        # Only PostgreSQL has boolean literals in every supported version
+        if settings.DATABASE_ENGINE.startswith('postgresql'):
+            return default and "TRUE" or "FALSE"
+        return default and "1" or "0"
+    elif isinstance(default, (int, long, float)):
+        return str(default)
+    return "'%s'" % unicode(default).replace("'", "''")
+
+def addcolumn(cursor, table, field):
+    """Adds the column of a field to an existing table, filling it with the
+    default value of the field
+    """
+    qn = connection.ops.quote_name
+    table, column, dbtype = qn(table), qn(field.column), field.db_type()
+    if field.null:
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s NULL" % (table, column, dbtype))
+    elif settings.DATABASE_ENGINE == 'mysql' and dbtype.endswith(('text', 'blob')):
+        # MySQL doesn't allow defaults for TEXT and BLOB columns
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s NULL" % (table, column, dbtype))
+        cursor.execute("UPDATE %s SET %s = %s" % (table, column, sqldefault(field)))
+        cursor.execute("ALTER TABLE %s MODIFY %s %s NOT NULL" % (table, column, dbtype))
+    else:
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s NOT NULL DEFAULT %s" % (
+            table, column, dbtype, sqldefault(field)))
+
+def getindexes(cursor, tables):
+    """Returns the names of the existing indexes of the given tables"""
+    engine = settings.DATABASE_ENGINE
+    if engine == 'sqlite3':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return set([row[0] for row in cursor.fetchall()])
+    elif engine.startswith('postgresql'):
+        cursor.execute("SELECT indexname FROM pg_indexes")
+        return set([row[0] for row in cursor.fetchall()])
+    elif engine == 'mysql':
+        indexes = set()
+        for table in tables:
+            cursor.execute("SHOW INDEX FROM %s" % connection.ops.quote_name(table))
+            indexes.update([row[2] for row in cursor.fetchall()])
+        return indexes
+    return set()
+
+class Command(NoArgsCommand):
+    help = "Upgrades a database created with an older Codespeed version: adds the new columns, copies the revision dates to the results and creates the composite indexes"
+    
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        result_table = Result._meta.db_table
+        revision_table = Revision._meta.db_table
+        
+        for model, name in NEWCOLUMNS:
+            table = model._meta.db_table
+            field = model._meta.get_field(name)
+            columns = [row[0] for row in
+                connection.introspection.get_table_description(cursor, table)]
+            if field.column in columns: continue
+            print "Adding column %s.%s" % (table, field.column)
+            addcolumn(cursor, table, field)
+        
+        field = Result._meta.get_field('revision_date')
+        print "Copying revision dates to results..."
+        cursor.execute(
+            "UPDATE %(result)s SET %(revision_date)s = (SELECT %(date)s FROM"
+            " %(revision)s WHERE %(revision)s.%(id)s = %(result)s.%(revision_id)s)"
+            " WHERE %(revision_date)s IS NULL" % {
+                'result': qn(result_table), 'revision': qn(revision_table),
+                'revision_date': qn(field.column), 'date': qn('date'),
+                'id': qn('id'), 'revision_id': qn('revision_id'),
+            })
+        
+        indexes = getindexes(cursor, [result_table, revision_table])
+        for model in [Result, Revision]:
+            for sql in custom_sql_for_model(model, no_style()):
+                # Statements have the form "CREATE INDEX name ON ..."
+                name = sql.split()[2]
+                if name in indexes: continue
+                print "Creating index %s" % name
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+        print "Database upgraded"
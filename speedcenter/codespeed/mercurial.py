@@ -1,64 +1,214 @@
-import os, datetime
+import os, datetime, struct
 from subprocess import Popen, PIPE
+from threading import Condition, Lock
 from speedcenter import settings
+from codespeed import profiling
 
 
 path = settings.BASEDIR + '/repos/'
-    
+# Maximum number of command servers running for each repository
+poolsize = 2
+
+def getrepodir(repo):
+    return path + repo.split('/')[-1] + "/"
+
+
+class CommandServer(object):
+    '''A long-lived "hg serve --cmdserver pipe" process, which runs hg
+    commands without paying Mercurial's startup time for each of them
+    '''
+    def __init__(self, repodir):
+        env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+        self.process = Popen(['hg', 'serve', '--cmdserver', 'pipe'],
+            stdin=PIPE, stdout=PIPE, stderr=PIPE, cwd=repodir, env=env)
+        # The server starts with a hello message on the output channel
+        channel, hello = self.readchannel()
+        if channel != 'o' or 'runcommand' not in hello:
+            self.close()
+            raise IOError("Unexpected hg command server hello: %r" % hello)
+
+    def readchannel(self):
+        header = self.process.stdout.read(5)
+        if len(header) < 5:
+            raise IOError("The hg command server exited")
+        channel, length = struct.unpack('>cI', header)
+        if channel in 'IL':
+            # Input requests only send the maximum length to read
+            return channel, length
+        return channel, self.process.stdout.read(length)
+
+    def runcommand(self, args, output):
+        '''Runs an hg command, passing its output to the output function as
+        it arrives. Returns the return code and the error output
+        '''
+        data = "\0".join(args)
+        self.process.stdin.write('runcommand\n' + struct.pack('>I', len(data)) + data)
+        self.process.stdin.flush()
+        errors = []
+        while True:
+            channel, data = self.readchannel()
+            if channel == 'o':
+                output(data)
+            elif channel == 'e':
+                errors.append(data)
+            elif channel == 'r':
+                return struct.unpack('>i', data)[0], "".join(errors)
+            elif channel in 'IL':
+                # Don't answer prompts (e.g. for a password)
+                self.process.stdin.write(struct.pack('>I', 0))
+                self.process.stdin.flush()
+            elif channel.isupper():
+                raise IOError("Unexpected hg command server channel %r" % channel)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+class ServerPool(object):
+    '''Command servers of a repository. At most poolsize servers are
+    started, and callers wait for a free one
+    '''
+    def __init__(self, repodir):
+        self.repodir = repodir
+        self.condition = Condition()
+        self.idle = []
+        self.running = 0
+
+    def acquire(self):
+        self.condition.acquire()
+        try:
+            while not self.idle and self.running >= poolsize:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.running += 1
+        finally:
+            self.condition.release()
+        try:
+            return CommandServer(self.repodir)
+        except Exception:
+            self.release(None)
+            raise
+
+    def release(self, server):
+        '''Returns a server to the pool. None means that it was discarded'''
+        self.condition.acquire()
+        try:
+            if server is None: self.running -= 1
+            else: self.idle.append(server)
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def runcommand(self, args, output):
+        server = self.acquire()
+        try:
+            result = server.runcommand(args, output)
+        except Exception:
+            # The server is in an unknown state
+            server.close()
+            self.release(None)
+            raise
+        self.release(server)
+        return result
+
+
+pools = {}
+poolslock = Lock()
+
+def getpool(repodir):
+    poolslock.acquire()
+    try:
+        if repodir not in pools:
+            pools[repodir] = ServerPool(repodir)
+        return pools[repodir]
+    finally:
+        poolslock.release()
+
+def runcommand(repodir, args, output=None):
+    '''Runs an hg command in a command server of the repository.
+    Returns the output (unless an output function is given), and the errors
+    '''
+    chunks = []
+    returncode, errors = getpool(repodir).runcommand(args, output or chunks.append)
+    if returncode != 0 and not errors:
+        errors = "hg %s failed with return code %d" % (args[0], returncode)
+    return "".join(chunks), errors
+
+@profiling.timed('vcs')
 def updaterepo(repo):
-    repodir = path + repo.split('/')[-1] + "/"
+    repodir = getrepodir(repo)
     if os.path.exists(repodir):
         # Update repo
-        cmd = "hg pull -u"
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, cwd=repodir)
-        stdout, stderr = p.communicate()
+        stdout, stderr = runcommand(repodir, ['pull', '-u'])
         if stderr:
             return [{'error': True, 'message': stderr}]
         else:
             return [{'error': False}]
     else:
         # Clone repo
-        cmd = "hg clone %s" % repo
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, cwd=path)
+        if not os.path.exists(path): os.makedirs(path)
+        cmd = ['hg', 'clone', repo, repodir]
+        p = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=path)
         stdout, stderr = p.communicate()
         if stderr:
             return [{'error': True, 'message': stderr}]
         else:
             return [{'error': False}]
 
+
+class LogParser(object):
+    '''Parses the output of the log template as it arrives'''
+    template = '{rev}:{node|short}\n{author|person} / {author|user}\n{date|hgdate}\n{desc}\n=newlog=\n'
+    separator = "=newlog=\n"
+
+    def __init__(self):
+        self.buffer = ""
+        self.logs = []
+
+    def feed(self, data):
+        self.buffer += data
+        if self.separator not in self.buffer: return
+        logs = self.buffer.split(self.separator)
+        # The last part is an incomplete log (or empty)
+        self.buffer = logs.pop()
+        for log in logs:
+            self.parse(log)
+
+    def parse(self, log):
+        elements = log.split('\n')[:-1]
+        if len(elements) < 4:
+            # Don't save "malformed" log
+            return
+        commitid = elements.pop(0)
+        author = elements.pop(0)
+        date = elements.pop(0)
+        # All other newlines should belong to the description text. Join.
+        message = '\n'.join(elements)
+
+        # Parse date: "<timestamp> <timezone offset>"
+        date = date.split()[0]
+        date = datetime.datetime.fromtimestamp(float(date)).strftime("%Y-%m-%d %H:%M:%S")
+
+        # Add changeset info
+        self.logs.append({'date': date, 'author': author, 'message': message,
+        'commitid': commitid})
+
+@profiling.timed('vcs')
 def getlogs(endrev, startrev):
-    repodir = path + endrev.project.repo_path.split('/')[-1] + "/"
+    repodir = getrepodir(endrev.project.repo_path)
     if not os.path.exists(repodir):
         updaterepo(endrev.project.repo_path)
-    
-    cmd = "hg log -r %s:%s -b default --template '{rev}:{node|short}\n{author|person} / {author|user}\n{date}\n{desc}\n=newlog=\n'" % (endrev.commitid, startrev.commitid)
-    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, cwd=repodir)
-    stdout, stderr = p.communicate()
+
+    parser = LogParser()
+    stdout, stderr = runcommand(repodir, ['log',
+        '-r', "%s:%s" % (endrev.commitid, startrev.commitid),
+        '-b', 'default', '--template', parser.template], parser.feed)
     if stderr:
         return [{'error': True, 'message': stderr}]
-    else:
-        logs = []
-        for log in stdout.split("=newlog=\n"):
-            commitid, author, date, message = ("","","","")
-            elements = []
-            elements = log.split('\n')[:-1]
-            if len(elements) < 4:
-                # Don't save "malformed" log
-                continue
-            else:
-                commitid = elements.pop(0)
-                author = elements.pop(0)
-                date = elements.pop(0)
-                # All other newlines should belong to the description text. Join.
-                message = '\n'.join(elements)
-                
-                # Parse date
-                date = date.split('-')[0]
-                date = datetime.datetime.fromtimestamp(float(date)).strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Add changeset info
-                logs.append({'date': date, 'author': author, 'message': message,
-                'commitid': commitid})
+    logs = parser.logs
     # Remove last log because the startrev log shouldn't be shown
     if len(logs) > 1:
         logs.pop()
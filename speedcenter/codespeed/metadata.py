@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''Identity map of the small metadata tables: projects, benchmarks,
+executables and environments
+
+Each table is loaded with a single query the first time it is needed, and
+kept until any of its objects is saved or deleted. The cached objects are
+shared, so they must not be modified.
+When the response cache is shared by several processes, its generation
+counters are used to notice changes made by the other processes too.
+Otherwise the tables are only kept during a request, as the changes made by
+other processes (like the admin) can't be noticed. Objects created in the
+meantime are still found by reloading the tables when a lookup misses.
+'''
+from threading import Lock
+
+from django.core.signals import request_started
+from codespeed import cache
+
+# Generation of the metadata tables in the response cache backend
+GENERATION = ('metadata', None)
+
+
+class Table(object):
+    def __init__(self, model):
+        self.objects = list(model.objects.all().order_by('id'))
+        self.byid = dict([(obj.id, obj) for obj in self.objects])
+        self.byname = dict([(obj.name, obj) for obj in self.objects])
+
+
+tables = {}
+generation = None
+lock = Lock()
+
+def clear():
+    '''Drops the tables cached by this process'''
+    global tables
+    lock.acquire()
+    try:
+        tables = {}
+    finally:
+        lock.release()
+
+def invalidate(*args, **kwargs):
+    '''Drops the cached tables. Can be connected to model signals'''
+    clear()
+    if cache.getbackend() is not None:
+        cache.getbackend().bump(GENERATION)
+
+def startrequest(**kwargs):
+    '''Drops the tables loaded by the previous requests without a shared backend'''
+    if not cache.isshared(): clear()
+
+request_started.connect(startrequest, dispatch_uid="codespeed.metadata.startrequest")
+
+def load(model):
+    """Returns the table of the model, loading it if needed.
+    Must be called with the lock held
+    """
+    # Imported here because the models module connects the signals
+    from codespeed.models import Project, Executable
+    if model not in tables:
+        table = Table(model)
+        if model is Executable:
+            # Avoid a query when accessing executable.project
+            projects = load(Project).byid
+            for exe in table.objects:
+                exe._project_cache = projects[exe.project_id]
+        tables[model] = table
+    return tables[model]
+
+def gettable(model):
+    global tables, generation
+    current = None
+    if cache.getbackend() is not None:
+        current = cache.getbackend().getgenerations([GENERATION])[0]
+    lock.acquire()
+    try:
+        if current != generation:
+            # Changed by another process
+            tables = {}
+            generation = current
+        return load(model)
+    finally:
+        lock.release()
+
+def getall(model):
+    '''Returns the list of all objects of the model, ordered by id'''
+    return list(gettable(model).objects)
+
+def get(model, id=None, name=None):
+    '''Returns the object with the given id or name.
+    Raises model.DoesNotExist like model.objects.get()
+    '''
+    obj = find(gettable(model), id, name)
+    if obj is None:
+        # It may have been created by another process since the tables
+        # were loaded. Executables need their projects reloaded too
+        clear()
+        obj = find(gettable(model), id, name)
+    if obj is None:
+        raise model.DoesNotExist(
+            "%s matching query does not exist." % model._meta.object_name)
+    return obj
+
+def find(table, id, name):
+    if id is not None: return table.byid.get(int(id))
+    return table.byname.get(name)
+
+def get_or_create(model, **kwargs):
+    '''Like model.objects.get_or_create(), for lookups that include the name'''
+    obj = gettable(model).byname.get(kwargs['name'])
+    if obj is not None and matches(obj, kwargs):
+        return obj, False
+    # The signals invalidate the cached tables if it is created
+    return model.objects.get_or_create(**kwargs)
+
+def matches(obj, kwargs):
+    for key, value in kwargs.items():
+        if hasattr(value, 'pk'):
+            key, value = key + '_id', value.pk
+        if getattr(obj, key) != value:
+            return False
+    return True
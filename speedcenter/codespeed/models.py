@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, transaction
 
 class Project(models.Model):
     REPO_TYPES = (
@@ -27,6 +28,10 @@ class Revision(models.Model):
     date = models.DateTimeField(null=True)
     message = models.TextField(blank=True)
     author = models.CharField(max_length=30, blank=True)
+    # The author, date and message have not been fetched from the VCS yet
+    pending = models.BooleanField("Pending VCS info", default=False)
+    attempts = models.IntegerField(default=0, editable=False)
+    error = models.TextField(blank=True, editable=False)
 
     def _short_commitid(self):
         return self.commitid[:10]
@@ -76,6 +81,37 @@ class Environment(models.Model):
         return str(self.name)
 
 
+class SamplesField(models.Field):
+    """Binary column holding packed samples (see codespeed.samples).
+    The value is the byte string as stored
+    """
+    __metaclass__ = models.SubfieldBase
+    
+    def db_type(self):
+        if settings.DATABASE_ENGINE.startswith('postgresql'): return 'bytea'
+        elif settings.DATABASE_ENGINE == 'mysql': return 'longblob'
+        return 'blob'
+    
+    def to_python(self, value):
+        if isinstance(value, unicode):
+            # Serialized with value_to_string
+            return value.decode('base64')
+        elif value is not None:
+            return str(value)
+        return value
+    
+    def get_db_prep_value(self, value):
+        if value is None or settings.DATABASE_ENGINE == 'mysql':
+            return value
+        # Stored as a blob, not as text
+        return buffer(value)
+    
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        if value is None: return None
+        return value.encode('base64')
+
+
 class Result(models.Model):
     value = models.FloatField()
     std_dev = models.FloatField(blank=True, null=True)
@@ -83,12 +119,154 @@ class Result(models.Model):
     val_max = models.FloatField(blank=True, null=True)
     date = models.DateTimeField(blank=True, null=True)
     revision = models.ForeignKey(Revision)
+    # Copy of revision.date, so that results can be ordered without a join
+    revision_date = models.DateTimeField(null=True, editable=False)
     executable = models.ForeignKey(Executable)
     benchmark = models.ForeignKey(Benchmark)
     environment = models.ForeignKey(Environment)
+    # Raw per-iteration samples, packed by codespeed.samples
+    samples = SamplesField(null=True, editable=False)
     
     def __unicode__(self):
         return str(self.benchmark.name) + " " + str(self.value)
     
     class Meta:
         unique_together = ("revision", "executable", "benchmark", "environment")
+
+
+class ResultSummary(models.Model):
+    """Change and trends of a result as shown in the changes view,
+    precomputed for every trend setting (see summaries.TRENDS)
+    """
+    result = models.ForeignKey(Result, unique=True)
+    previous = models.FloatField(null=True) # result of the previous revision
+    change = models.FloatField(null=True) # in percent
+    # Average of the trend revisions of each trend setting, None when the
+    # trend can't be calculated
+    average5 = models.FloatField(null=True)
+    average10 = models.FloatField(null=True)
+    average20 = models.FloatField(null=True)
+    average50 = models.FloatField(null=True)
+    average100 = models.FloatField(null=True)
+    
+    def __unicode__(self):
+        return str(self.result)
+
+
+class CommitLog(models.Model):
+    """Commit of a project's repository, stored so that the changes view
+    does not need to query the VCS
+    """
+    project = models.ForeignKey(Project)
+    commitid = models.CharField(max_length=42)
+    author = models.CharField(max_length=100, blank=True)
+    date = models.DateTimeField()
+    message = models.TextField(blank=True)
+    
+    def __unicode__(self):
+        return self.date.strftime("%h %d, %H:%M") + " - " + self.commitid
+    
+    class Meta:
+        unique_together = ("commitid", "project")
+
+
+class SeriesState(models.Model):
+    """State of the online change point detection of a result series.
+    It has the statistics of the values since the last change, and the
+    upper and lower CUSUM charts with the first result, number and sum of
+    the values since they were last zero
+    """
+    executable = models.ForeignKey(Executable)
+    benchmark = models.ForeignKey(Benchmark)
+    environment = models.ForeignKey(Environment)
+    last_date = models.DateTimeField(null=True) # of the last processed result
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0) # sum of squared differences from the mean
+    up = models.FloatField(default=0)
+    up_start = models.IntegerField(null=True)
+    up_count = models.IntegerField(default=0)
+    up_sum = models.FloatField(default=0)
+    down = models.FloatField(default=0)
+    down_start = models.IntegerField(null=True)
+    down_count = models.IntegerField(default=0)
+    down_sum = models.FloatField(default=0)
+    
+    class Meta:
+        unique_together = ("executable", "benchmark", "environment")
+
+
+class ChangePoint(models.Model):
+    """Change in the mean of a result series, found when saving results"""
+    result = models.ForeignKey(Result) # first result after the change
+    before = models.FloatField() # mean of the values before the change
+    after = models.FloatField() # mean of the values after the change
+    change = models.FloatField(null=True) # in percent
+    
+    def __unicode__(self):
+        return str(self.result) + " (" + str(self.change) + "%)"
+
+
+def bulkinsert(model, objects):
+    """Inserts model instances with one statement executed for many rows.
+    Their primary keys are not set, and no signals are sent
+    """
+    if not objects: return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.fields if f != model._meta.pk]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ", ".join([qn(f.column) for f in fields]),
+        ", ".join(["%s"] * len(fields)))
+    connection.cursor().executemany(sql, [
+        [f.get_db_prep_save(f.pre_save(obj, True)) for f in fields]
+        for obj in objects])
+    transaction.commit_unless_managed()
+
+def bulkupdate(model, objects):
+    """Updates model instances with one statement executed for many rows.
+    No signals are sent
+    """
+    if not objects: return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.fields if f != model._meta.pk]
+    sql = "UPDATE %s SET %s WHERE %s = %%s" % (
+        qn(model._meta.db_table),
+        ", ".join(["%s = %%s" % qn(f.column) for f in fields]),
+        qn(model._meta.pk.column))
+    connection.cursor().executemany(sql, [
+        [f.get_db_prep_save(f.pre_save(obj, False)) for f in fields] + [obj.pk]
+        for obj in objects])
+    transaction.commit_unless_managed()
+
+
+from django.db.models import signals
+from codespeed import cache
+
+# Invalidate cached responses when data is changed, for example through the admin.
+# Saved results invalidate them once their transaction is committed (see
+# views.addresult and views.saveresults)
+for model in [Project, Revision, Executable, Benchmark, Environment]:
+    signals.post_save.connect(cache.invalidate_all, sender=model)
+    signals.post_delete.connect(cache.invalidate_all, sender=model)
+
+# Drop the cached metadata tables when any of their objects changes
+from codespeed import metadata
+for model in [Project, Executable, Benchmark, Environment]:
+    signals.post_save.connect(metadata.invalidate, sender=model,
+        dispatch_uid="codespeed.metadata.invalidate.post_save.%s" % model.__name__)
+    signals.post_delete.connect(metadata.invalidate, sender=model,
+        dispatch_uid="codespeed.metadata.invalidate.post_delete.%s" % model.__name__)
+
+# Keep the denormalized Result.revision_date in sync
+def set_revision_date(sender, instance, **kwargs):
+    instance.revision_date = instance.revision.date
+
+def update_revision_date(sender, instance, created, **kwargs):
+    if not created:
+        Result.objects.filter(revision=instance).update(revision_date=instance.date)
+
+signals.pre_save.connect(set_revision_date, sender=Result,
+    dispatch_uid="codespeed.models.set_revision_date")
+signals.post_save.connect(update_revision_date, sender=Revision,
+    dispatch_uid="codespeed.models.update_revision_date")
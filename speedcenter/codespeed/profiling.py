@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''Per-request profiling
+
+When settings.profiling is enabled, ProfilingMiddleware measures for every
+request the number and time of its SQL queries, the time spent in the VCS
+modules and the template rendering time. They are sent in a Server-Timing
+header, and the most recent requests are kept in memory to be listed,
+slowest first, at /profiling/.
+
+When profiling is disabled the middleware removes itself, so the only
+overhead left is the check for a current profile in the timed VCS functions.
+'''
+import time
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from threading import local
+
+from django.core.exceptions import MiddlewareNotUsed
+from codespeed import settings
+
+# Profile of the request being served by each thread
+current = local()
+# Most recent profiles, created when the middleware is first used
+requests = None
+installed = False
+
+# Timers, in the order they are sent in the Server-Timing header
+TIMERS = [
+    ('sql', 'queries'),
+    ('vcs', 'calls'),
+    ('template', 'renders'),
+]
+
+
+class Profile(object):
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.get_full_path()
+        self.date = datetime.today()
+        self.start = time.time()
+        self.total = None
+        self.status = None
+        # Number of calls and seconds spent for each timer
+        self.timers = dict([(name, [0, 0.0]) for name, unit in TIMERS])
+        self.running = set()
+
+    def add(self, name, elapsed):
+        timer = self.timers[name]
+        timer[0] += 1
+        timer[1] += elapsed
+
+    def finish(self, status):
+        self.total = time.time() - self.start
+        self.status = status
+
+    def servertiming(self):
+        metrics = ['%s;dur=%.1f;desc="%d %s"' % (name, self.timers[name][1] * 1000,
+            self.timers[name][0], unit) for name, unit in TIMERS]
+        return ", ".join(metrics + ['total;dur=%.1f' % (self.total * 1000)])
+
+    def todict(self):
+        data = {
+            'method': self.method,
+            'path': self.path,
+            'date': self.date.strftime("%Y-%m-%d %H:%M:%S"),
+            'status': self.status,
+            'total': round(self.total * 1000, 1),
+        }
+        for name, unit in TIMERS:
+            data[name] = round(self.timers[name][1] * 1000, 1)
+            data[name + '_' + unit] = self.timers[name][0]
+        return data
+
+
+def getprofile():
+    return getattr(current, 'profile', None)
+
+def timed(name):
+    """Decorator that adds the time spent in the function to the given timer
+    of the current profile. Nested timed calls are only counted once
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = getattr(current, 'profile', None)
+            if profile is None or name in profile.running:
+                return func(*args, **kwargs)
+            profile.running.add(name)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.running.discard(name)
+                profile.add(name, time.time() - start)
+        return wrapper
+    return decorator
+
+
+class ProfilingCursor(object):
+    '''Database cursor that adds the time of every query to the profile'''
+    def __init__(self, cursor, profile):
+        self.cursor = cursor
+        self.profile = profile
+
+    def execute(self, sql, params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.profile.add('sql', time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.profile.add('sql', time.time() - start)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def install():
+    """Wraps the database cursors and the template rendering, the first time
+    the middleware is used. They are left untouched when profiling is disabled
+    """
+    global requests, installed
+    if installed: return
+    from django.db.backends import BaseDatabaseWrapper
+    from django.template import Template
+    cursor = BaseDatabaseWrapper.cursor
+    def profilingcursor(self):
+        profile = getattr(current, 'profile', None)
+        if profile is None: return cursor(self)
+        return ProfilingCursor(cursor(self), profile)
+    BaseDatabaseWrapper.cursor = profilingcursor
+    Template.render = timed('template')(Template.render)
+    requests = deque(maxlen=getattr(settings, 'profiling_requests', 200))
+    installed = True
+
+def getslowest():
+    '''Returns the recorded requests, slowest first'''
+    if requests is None: return []
+    return [profile.todict() for profile in
+        sorted(list(requests), key=lambda profile: profile.total, reverse=True)]
+
+
+class ProfilingMiddleware(object):
+    def __init__(self):
+        if not getattr(settings, 'profiling', False):
+            raise MiddlewareNotUsed
+        install()
+
+    def process_request(self, request):
+        current.profile = Profile(request)
+
+    def process_response(self, request, response):
+        profile = getattr(current, 'profile', None)
+        if profile is None: return response
+        current.profile = None
+        profile.finish(response.status_code)
+        response['Server-Timing'] = profile.servertiming()
+        requests.append(profile)
+        return response
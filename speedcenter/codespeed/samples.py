@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''Raw per-iteration samples of a result
+
+The samples are stored in the Result.samples column as a packed array of
+little-endian float64 values, 8 bytes per sample, so that they take no more
+space than needed and can be sent to clients as they are stored.
+'''
+import sys
+import json
+from array import array
+from math import sqrt
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maximum number of samples stored for a result
+maxsamples = 100000
+# Percentiles included in the statistics
+PERCENTILES = [5, 25, 75, 95]
+# Two-sided 95% quantiles of Student's t distribution, by degrees of freedom.
+# The normal quantile is used for more than 30 degrees of freedom
+TQUANTILES = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306,
+    2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+    2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048,
+    2.045, 2.042]
+
+
+def parse(value):
+    """Returns the list of samples given as a list of numbers, or as a string
+    with a JSON array or comma separated numbers.
+    Raises ValueError if they are not valid
+    """
+    if isinstance(value, basestring):
+        value = value.strip()
+        if value.startswith('['): value = json.loads(value)
+        else: value = [v for v in value.split(',') if v.strip()]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("Samples must be a list of numbers")
+    if not value:
+        raise ValueError("Samples must not be empty")
+    if len(value) > maxsamples:
+        raise ValueError("More than %d samples" % maxsamples)
+    try:
+        samples = [float(v) for v in value]
+    except TypeError:
+        raise ValueError("Samples must be a list of numbers")
+    for v in samples:
+        if v != v or v in (float('inf'), float('-inf')):
+            raise ValueError("Samples must be finite numbers")
+    return samples
+
+def pack(samples):
+    '''Returns the packed bytes of a list of samples'''
+    data = array('d', samples)
+    if sys.byteorder != 'little': data.byteswap()
+    return data.tostring()
+
+def unpack(data):
+    '''Returns the samples of packed bytes, as a numpy array if available'''
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype='<f8')
+    samples = array('d')
+    samples.fromstring(str(data))
+    if sys.byteorder != 'little': samples.byteswap()
+    return samples.tolist()
+
+def percentile(ordered, p):
+    """Percentile of an ordered list, interpolated linearly between the
+    closest ranks like numpy.percentile
+    """
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def getstats(samples):
+    """Returns a dict with the statistics of a list or array of samples:
+    count, mean, median, std_dev (of the sample), min, max, the percentiles
+    and the 95% confidence interval of the mean
+    """
+    n = len(samples)
+    if numpy is not None:
+        values = numpy.asarray(samples, dtype=float)
+        mean = float(values.mean())
+        std_dev = n > 1 and float(values.std(ddof=1)) or 0.0
+        stats = {'min': float(values.min()), 'max': float(values.max()),
+            'median': float(numpy.median(values))}
+        for p, value in zip(PERCENTILES, numpy.percentile(values, PERCENTILES)):
+            stats['p%d' % p] = float(value)
+    else:
+        ordered = sorted(samples)
+        mean = sum(ordered) / n
+        std_dev = 0.0
+        if n > 1:
+            std_dev = sqrt(sum([(v - mean) ** 2 for v in ordered]) / (n - 1))
+        stats = {'min': ordered[0], 'max': ordered[-1],
+            'median': percentile(ordered, 50)}
+        for p in PERCENTILES:
+            stats['p%d' % p] = percentile(ordered, p)
+    stats.update({'count': n, 'mean': mean, 'std_dev': std_dev})
+    if n > 1:
+        if n - 1 < len(TQUANTILES): t = TQUANTILES[n - 1]
+        else: t = 1.96
+        margin = t * std_dev / sqrt(n)
+        stats['ci95'] = [mean - margin, mean + margin]
+    else:
+        stats['ci95'] = None
+    return stats
@@ -18,4 +18,42 @@ normalization = False # True will enable normalization as the default selection
                       # chosen in the defaultbaseline setting
 
 chartorientation = 'vertical' # 'vertical' or 'horizontal can be chosen as
-                              # default chart orientation
\ No newline at end of file
+                              # default chart orientation
+
+## Caching options ##
+responsecache = None # Cache for the timeline, comparison and changes table data.
+                     # 'locmem' keeps an in-process LRU cache. Use it only when a
+                     # single process serves Codespeed (like runserver): every
+                     # process has its own cache, and doesn't see the results
+                     # saved through the others. 'django' uses the cache configured
+                     # with the CACHE_BACKEND Django setting (e.g. memcached), which
+                     # is shared by all processes; it is required when running
+                     # several processes (e.g. mod_wsgi or gunicorn workers).
+                     # None disables caching
+
+responsecache_size = 500 # Maximum number of responses kept by the 'locmem' cache
+
+## Regression detection options ##
+changepoint_threshold = 5 # A change point is detected when the cumulative sum of
+                          # the deviations from the mean (in standard deviations)
+                          # exceeds this value. Higher values find fewer changes
+
+changepoint_drift = 0.5 # Deviations smaller than this (in standard deviations)
+                        # are not accumulated
+
+changepoint_warmup = 5 # Number of values of a series before detection starts
+
+## Archive options ##
+archivedir = None # Directory of the columnar archive of the result series
+                  # (e.g. '/var/lib/codespeed/archive'), updated when results
+                  # are saved and rebuilt with "manage.py buildarchive".
+                  # None disables it
+
+## Profiling options ##
+profiling = False # Records the SQL query, VCS and template rendering time of
+                  # every request, sends them in a Server-Timing header and
+                  # lists the slowest recent requests at /profiling/ (staff
+                  # users only). Needs codespeed.profiling.ProfilingMiddleware
+                  # in the MIDDLEWARE_CLASSES, which does nothing when disabled
+
+profiling_requests = 200 # Number of recent requests kept for /profiling/
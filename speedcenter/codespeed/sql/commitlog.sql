@@ -0,0 +1,3 @@
+-- Composite index for the commit logs between two revisions of a project.
+-- It is created by syncdb together with the table
+CREATE INDEX codespeed_commitlog_project_date ON codespeed_commitlog (project_id, date);
@@ -0,0 +1,4 @@
+-- Composite index for the timeline, which fetches the results of a benchmark,
+-- environment and executable ordered by revision date and revision id.
+-- It is created by syncdb, and by the upgradedb command on existing databases
+CREATE INDEX codespeed_result_timeline ON codespeed_result (benchmark_id, environment_id, executable_id, revision_date, revision_id);
@@ -0,0 +1,3 @@
+-- Composite index for the latest revisions of a project.
+-- It is created by syncdb, and by the upgradedb command on existing databases
+CREATE INDEX codespeed_revision_project_date ON codespeed_revision (project_id, date);
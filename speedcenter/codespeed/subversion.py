@@ -1,62 +1,172 @@
 # -*- coding: utf-8 -*-
 '''Subversion commit logs support'''
 from datetime import datetime
+from threading import Lock
+from codespeed import profiling
 
+# Maximum number of commit logs returned by getlogs
+loglimit = 200
+# Maximum number of memoized log queries
+memosize = 1000
 
-def updaterepo():
+
+def updaterepo(repo=None):
     '''Not needed for a remote subversion repo'''
     return [{'error': False}]
 
-def getlogs(newrev, startrev):
+
+clients = {}
+clientslock = Lock()
+
+def getclient(project):
+    '''Returns an idle pysvn client for the project's repository and user,
+    creating it if needed. pysvn clients are not thread safe, so each one is
+    used by one thread at a time and returned with releaseclient
+    '''
     import pysvn
-    
-    logs = []
-    log_messages = []
-    loglimit = 200
-    
+    key = (project.repo_path, project.repo_user, project.repo_pass)
+    clientslock.acquire()
+    try:
+        idle = clients.setdefault(key, [])
+        if idle: return idle.pop()
+    finally:
+        clientslock.release()
+
     def get_login(realm, username, may_save):
-        return True, newrev.project.repo_user, newrev.project.repo_pass, False
-    
+        return True, project.repo_user, project.repo_pass, False
+
     client = pysvn.Client()
-    if newrev.project.repo_user != "":
+    if project.repo_user != "":
         client.callback_get_login = get_login
-    
+    return client
+
+def releaseclient(project, client):
+    key = (project.repo_path, project.repo_user, project.repo_pass)
+    clientslock.acquire()
     try:
-        log_messages = \
-            client.log(
-                newrev.project.repo_path,
-                revision_start=pysvn.Revision(
-                        pysvn.opt_revision_kind.number, startrev.commitid
-                ),
-                revision_end=pysvn.Revision(
-                    pysvn.opt_revision_kind.number, newrev.commitid
-                )
-            )
-    except pysvn.ClientError:
-        return [
-            {'error': True,
-            'message': "Could not resolve '" + newrev.project.repo_path + "'"}]
+        clients.setdefault(key, []).append(client)
+    finally:
+        clientslock.release()
+
+
+# The logs of committed revisions never change, so queries are memoized.
+# Maps (repo, start, end) to the node of the query in a circular doubly
+# linked list, least recently used first, like cache.LocalBackend. The nodes
+# are [previous, next, key, revision numbers returned by the query] lists.
+# Also maps (repo, revision number) to its log, and to the number of
+# memoized queries that return it
+memo = {}
+logs = {}
+uses = {}
+memolock = Lock()
+
+def clearmemo():
+    global root
+    memo.clear()
+    logs.clear()
+    uses.clear()
+    root = []
+    root[:] = [root, root, None, None]
+
+clearmemo()
+
+def unlink(node):
+    node[0][1] = node[1]
+    node[1][0] = node[0]
+
+def append(node):
+    last = root[0]
+    node[0], node[1] = last, root
+    last[1] = root[0] = node
+
+def release(repo, revisions):
+    '''Drops the logs that are not used by other queries anymore'''
+    for number in revisions:
+        uses[(repo, number)] -= 1
+        if not uses[(repo, number)]:
+            del uses[(repo, number)]
+            del logs[(repo, number)]
+
+def getmemo(key):
+    memolock.acquire()
+    try:
+        node = memo.get(key)
+        if node is None: return None
+        # Mark as recently used
+        unlink(node)
+        append(node)
+        return [logs[(key[0], number)] for number in node[3]]
+    finally:
+        memolock.release()
+
+def setmemo(key, entries):
+    memolock.acquire()
+    try:
+        revisions = [entry['commitid'] for entry in entries]
+        for entry in entries:
+            log = (key[0], entry['commitid'])
+            logs[log] = entry
+            uses[log] = uses.get(log, 0) + 1
+        node = memo.get(key)
+        if node is not None:
+            unlink(node)
+            release(key[0], node[3])
+        node = [None, None, key, revisions]
+        append(node)
+        memo[key] = node
+        while len(memo) > memosize:
+            oldest = root[1]
+            unlink(oldest)
+            del memo[oldest[2]]
+            release(oldest[2][0], oldest[3])
+    finally:
+        memolock.release()
+
+@profiling.timed('vcs')
+def getlogs(newrev, startrev):
+    import pysvn
+
+    repo = newrev.project.repo_path
+    try:
+        end, start = int(newrev.commitid), int(startrev.commitid)
     except ValueError:
         return [{
             'error': True,
             'message': "'%s' is an invalid subversion revision number" % newrev.commitid
         }]
-    log_messages.reverse()
-    s = len(log_messages)
-    while s > loglimit:
-        log_messages = log_messages[:s]
-        s = len(log_messages) - 1
-    
-    for log in log_messages:
+
+    key = (repo, start, end)
+    entries = getmemo(key)
+    if entries is None:
+        client = getclient(newrev.project)
         try:
-            author = log.author
-        except AttributeError:
-            author = ""
-        date = datetime.fromtimestamp(log.date).strftime("%Y-%m-%d %H:%M:%S")
-        message = log.message
-        # Add log unless it is the last commit log, which has already been tested
-        if not (startrev != newrev and log.revision.number == int(startrev.commitid)):
-            logs.append(
-                {'date': date, 'author': author, 'message': message,
+            # Newest first, so that the server only sends the last logs.
+            # The startrev log is fetched too, but not shown
+            log_messages = client.log(
+                repo,
+                revision_start=pysvn.Revision(pysvn.opt_revision_kind.number, end),
+                revision_end=pysvn.Revision(pysvn.opt_revision_kind.number, start),
+                limit=loglimit + 1,
+            )
+        except pysvn.ClientError:
+            # The client may be left in a bad state, so it is not reused
+            return [
+                {'error': True,
+                'message': "Could not resolve '" + repo + "'"}]
+        releaseclient(newrev.project, client)
+
+        entries = []
+        for log in log_messages:
+            try:
+                author = log.author
+            except AttributeError:
+                author = ""
+            date = datetime.fromtimestamp(log.date).strftime("%Y-%m-%d %H:%M:%S")
+            entries.append(
+                {'date': date, 'author': author, 'message': log.message,
                 'commitid': log.revision.number})
-    return logs
+        setmemo(key, entries)
+
+    # Add logs unless it is the startrev log, which has already been tested
+    return [dict(entry) for entry in entries
+        if start == end or entry['commitid'] != start][:loglimit]
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+'''Precomputed changes and trends for the changes view
+
+For every result a ResultSummary is stored, holding the result of the
+previous revision, the change percentage and the average of the trend
+revisions of every trend setting. They are updated when results are saved,
+so that the changes table does not need to look at past results.
+'''
+from codespeed.models import Revision, Result, ResultSummary, bulkinsert
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Trend settings offered by the changes view
+TRENDS = [5, 10, 20, 50, 100]
+# Number of previous revisions a summary depends on
+WINDOW = max(TRENDS)
+# Distances to the following revisions whose summaries depend on a result:
+# the next one, for the change, and the trend revisions of every setting
+DEPENDENTS = sorted(set([1] + [d for trend in TRENDS for d in range(trend - 2, trend + 1)]))
+
+
+def calculatechanges(results, previous, past):
+    """Calculates the percentage change of each result relative to the
+    previous one, and its trend relative to the average of past results.
+    results is a list of values, previous a list of values or None and past
+    a list of lists of values or None, all in the same order.
+    Returns the list of changes and the list of trends. Every element is
+    either a (percentage, ratio) tuple or None if it could not be calculated
+    """
+    if numpy is not None and len(results):
+        nan = float('nan')
+        current = numpy.array(results, dtype=float)
+        prev = numpy.array(
+            [v is None and nan or v for v in previous], dtype=float)
+        past = numpy.array(
+            [[v is None and nan or v for v in row] for row in past], dtype=float
+        ).reshape(len(results), -1)
+        present = ~numpy.isnan(past)
+        sums = numpy.where(present, past, 0).sum(axis=1)
+        averages = sums / numpy.maximum(present.sum(axis=1), 1)
+        # NaN comparisons are False, so missing previous values are excluded
+        haschange = (prev != 0) & (prev == prev) & (current != 0)
+        hastrend = sums != 0
+        err = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            change = (current - prev)*100/prev
+            changeratio = current / prev
+            trend = (current - averages)*100/averages
+            trendratio = current / averages
+        finally:
+            numpy.seterr(**err)
+        changes, trends = [], []
+        for i in range(len(results)):
+            if haschange[i]:
+                changes.append((float(change[i]), float(changeratio[i])))
+            else:
+                changes.append(None)
+            if hastrend[i]:
+                trends.append((float(trend[i]), float(trendratio[i])))
+            else:
+                trends.append(None)
+        return changes, trends
+    
+    changes, trends = [], []
+    for result, prev, pastvalues in zip(results, previous, past):
+        change = None
+        if prev and result:
+            change = ((result - prev)*100/prev, result / prev)
+        changes.append(change)
+        pastvalues = [v for v in pastvalues if v is not None]
+        trend = None
+        if sum(pastvalues):
+            average = sum(pastvalues) / len(pastvalues)
+            trend = ((result - average)*100/average, result / average)
+        trends.append(trend)
+    return changes, trends
+
+def summarize(revisions, start, results, indexes=None):
+    """Computes the summaries of the results of revisions[start:], or only
+    of the revisions with the given indexes.
+    revisions is a chronological list of revision ids that contains the
+    WINDOW revisions that precede revisions[start].
+    results is a list of (id, revision, executable, environment, benchmark,
+    value) rows, which must contain every result of the affected series in
+    the given revisions.
+    Returns a list of unsaved ResultSummary objects
+    """
+    series = {}
+    for row in results:
+        series.setdefault(row[2:5], {})[row[1]] = (row[0], row[5])
+    
+    if indexes is None: indexes = range(start, len(revisions))
+    output = []
+    for i in indexes:
+        # Same revisions as the changes view: the current one first
+        lastrevisions = revisions[max(0, i - WINDOW):i + 1]
+        lastrevisions.reverse()
+        # Group the series with a result in this revision by executable and
+        # environment, to compute all their benchmarks at once
+        groups = {}
+        for key, values in series.items():
+            if lastrevisions[0] in values:
+                groups.setdefault(key[:2], []).append(values)
+        for group in groups.values():
+            ids = [values[lastrevisions[0]][0] for values in group]
+            current = [values[lastrevisions[0]][1] for values in group]
+            summaries = [ResultSummary(result_id=id) for id in ids]
+            for trendconfig in TRENDS:
+                window = lastrevisions[:trendconfig + 1]
+                previous = [None] * len(group)
+                past = [[]] * len(group)
+                if len(window) > 1:
+                    previous = [values.get(window[1], (None, None))[1]
+                        for values in group]
+                    past = [[values.get(rev, (None, None))[1]
+                        for rev in window[trendconfig-2:trendconfig+1]]
+                        for values in group]
+                changes, trends = calculatechanges(current, previous, past)
+                for j, summary in enumerate(summaries):
+                    pastvalues = [v for v in past[j] if v is not None]
+                    average = None
+                    if trends[j] is not None:
+                        average = sum(pastvalues) / len(pastvalues)
+                    # The change doesn't depend on the trend setting
+                    summary.previous = previous[j]
+                    summary.change = changes[j] and changes[j][0]
+                    setattr(summary, 'average%d' % trendconfig, average)
+            output += summaries
+    return output
+
+def savesummaries(summaries):
+    """Replaces the stored summaries of the same results"""
+    ids = list(set([s.result_id for s in summaries]))
+    # Delete in chunks to stay below the query parameter limits
+    for i in range(0, len(ids), 500):
+        ResultSummary.objects.filter(result__in=ids[i:i + 500]).delete()
+    bulkinsert(ResultSummary, summaries)
+
+def getrevisionwindow(revision):
+    """Returns the chronological list of revision ids of the project around
+    the given revision: the WINDOW previous and following ones, and the
+    index of the given revision in it
+    """
+    previous = list(Revision.objects.filter(
+        project=revision.project_id, date__lte=revision.date
+    ).exclude(id=revision.id).order_by('-date', '-id').values_list(
+        'id', flat=True)[:WINDOW])
+    previous.reverse()
+    following = list(Revision.objects.filter(
+        project=revision.project_id, date__gt=revision.date
+    ).order_by('date', 'id').values_list('id', flat=True)[:WINDOW])
+    return previous + [revision.id] + following, len(previous)
+
+def updatesummaries(results):
+    """Updates the summaries of the given saved results, and those of the
+    results of the same series in the following revisions, which depend
+    on them
+    """
+    groups = {}
+    revisions = {}
+    for result in results:
+        key = (result.revision_id, result.executable_id, result.environment_id)
+        groups.setdefault(key, set()).add(result.benchmark_id)
+        revisions[result.revision_id] = result.revision
+    for revision in revisions:
+        revisions[revision] = getrevisionwindow(revisions[revision])
+    for (revision, executable, environment), benchmarks in groups.items():
+        window, start = revisions[revision]
+        rows = Result.objects.filter(
+            revision__in=window,
+            executable=executable,
+            environment=environment,
+            benchmark__in=benchmarks,
+        ).values_list('id', 'revision', 'executable', 'environment', 'benchmark', 'value')
+        # Only the following revisions that use this result are updated
+        indexes = [start] + [start + d for d in DEPENDENTS if start + d < len(window)]
+        savesummaries(summarize(window, start, rows, indexes))
+
+def updaterevisionsummaries(revision, include=False):
+    """Updates the summaries of all results of the revisions that follow the
+    given one, whose windows changed because it was added or its date changed.
+    If include is True, the summaries of its own results are updated too
+    """
+    window, start = getrevisionwindow(revision)
+    if not include: start += 1
+    if start == len(window):
+        # Newest revision of its project: no summaries to update
+        return
+    rows = Result.objects.filter(revision__in=window).values_list(
+        'id', 'revision', 'executable', 'environment', 'benchmark', 'value')
+    savesummaries(summarize(window, start, rows))
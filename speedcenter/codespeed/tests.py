@@ -3,8 +3,26 @@ from django.test import TestCase
 from datetime import datetime
 from django.test.client import Client
 from codespeed.models import Project, Benchmark, Revision, Executable, Environment, Result
+from codespeed import cache, metadata
 from django.core.urlresolvers import reverse
-import copy, json
+from django.conf import settings
+from django.db import connection
+import copy, json, os
+
+def countqueries(func, *args, **kwargs):
+    """Returns the number of SQL queries executed by calling func, once the
+    metadata tables are cached
+    """
+    for model in [Environment, Benchmark, Executable]:
+        metadata.getall(model)
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    connection.queries = []
+    try:
+        func(*args, **kwargs)
+        return len(connection.queries)
+    finally:
+        settings.DEBUG = debug
 
 class AddResultTest(TestCase):
     def setUp(self):
@@ -76,6 +94,17 @@ class AddResultTest(TestCase):
         self.assertEquals(res.val_max, 2)
         self.assertEquals(res.val_min, 1)
 
+    def test_revision_date(self):
+        """
+        Results keep a copy of their revision date in sync
+        """
+        self.client.post(self.path, self.data)
+        r = Revision.objects.get(commitid='23232')
+        self.assertEquals(Result.objects.get(revision=r).revision_date, r.date)
+        r.date = datetime(2010, 6, 1, 12, 0, 0)
+        r.save()
+        self.assertEquals(Result.objects.get(revision=r).revision_date, r.date)
+
     def test_bad_environment(self):
         """
         Add result associated with non-existing environment
@@ -111,6 +140,96 @@ class AddResultTest(TestCase):
             self.assertEquals(response.content, 'Key "' + key + '" missing from request')
             self.data[key] = backup
 
+class AddJSONResultsTest(TestCase):
+    def setUp(self):
+        self.path = reverse('codespeed.views.addresults')
+        self.client = Client()
+        self.e = Environment(name='bigdog', cpu='Core 2 Duo 8200')
+        self.e.save()
+        self.data = [
+            {'commitid': '123',
+            'project': 'pypy',
+            'executable': 'pypy-c',
+            'benchmark': 'Richards',
+            'environment': 'bigdog',
+            'result_value': 456,},
+            {'commitid': '123',
+            'project': 'pypy',
+            'executable': 'pypy-c',
+            'benchmark': 'float',
+            'environment': 'bigdog',
+            'result_value': 2.5,
+            'std_dev': 0.1,},
+            {'commitid': '124',
+            'project': 'pypy',
+            'executable': 'pypy-c',
+            'benchmark': 'Richards',
+            'environment': 'bigdog',
+            'result_value': 400,
+            'min': 390,
+            'max': 410,},
+        ]
+    
+    def test_add_results(self):
+        """
+        Add several results in one request
+        """
+        response = self.client.post(self.path, {'json': json.dumps(self.data)})
+        self.assertEquals(response.status_code, 200)
+        responsedata = json.loads(response.content)
+        self.assertEquals(responsedata['saved'], 3)
+        self.assertEquals(responsedata['failed'], 0)
+        self.assertEquals(Revision.objects.count(), 2)
+        self.assertEquals(Executable.objects.count(), 1)
+        self.assertEquals(Result.objects.count(), 3)
+        res = Result.objects.get(revision__commitid='124', benchmark__name='Richards')
+        self.assertEquals(res.value, 400)
+        self.assertEquals(res.val_min, 390)
+        self.assertEquals(res.val_max, 410)
+        self.assertEquals(res.date, res.revision.date)
+        res = Result.objects.get(revision__commitid='123', benchmark__name='float')
+        self.assertEquals(res.std_dev, 0.1)
+    
+    def test_update_results(self):
+        """
+        Results that already exist are updated instead of duplicated
+        """
+        self.client.post(self.path, {'json': json.dumps(self.data)})
+        self.data[0]['result_value'] = 500
+        response = self.client.post(self.path, {'json': json.dumps(self.data)})
+        self.assertEquals(json.loads(response.content)['saved'], 3)
+        self.assertEquals(Result.objects.count(), 3)
+        res = Result.objects.get(revision__commitid='123', benchmark__name='Richards')
+        self.assertEquals(res.value, 500)
+    
+    def test_partial_failure(self):
+        """
+        Invalid items are reported individually and do not prevent
+        valid items from being saved
+        """
+        del(self.data[0]['commitid'])
+        self.data[1]['environment'] = 'bigdog1'
+        response = self.client.post(self.path, {'json': json.dumps(self.data)})
+        self.assertEquals(response.status_code, 200)
+        responsedata = json.loads(response.content)
+        self.assertEquals(responsedata['saved'], 1)
+        self.assertEquals(responsedata['failed'], 2)
+        self.assertEquals(responsedata['results'], [
+            {'status': 'error', 'message': 'Key "commitid" missing from request'},
+            {'status': 'error', 'message': 'Environment bigdog1 not found'},
+            {'status': 'saved'},
+        ])
+        self.assertEquals(Result.objects.count(), 1)
+    
+    def test_bad_json(self):
+        """
+        Make POST request with data that is not a JSON list
+        """
+        response = self.client.post(self.path, {'json': '[{"a": '})
+        self.assertEquals(response.status_code, 400)
+        response = self.client.post(self.path, {'json': '{"a": 1}'})
+        self.assertEquals(response.status_code, 400)
+
 class Timeline(TestCase):
     fixtures = ["pypy.json"]
     
@@ -135,4 +254,1463 @@ class Timeline(TestCase):
         self.assertEquals(len(responsedata['timelines'][0]['executables']), 2, "there should be 2 timelines")
         self.assertEquals(len(responsedata['timelines'][0]['executables']['1']), 16, "There are 16 datapoints")
         self.assertEquals(responsedata['timelines'][0]['executables']['1'][4], [u'2010-06-17 18:57:39', 0.404776086807, 0.011496530978, u'75443'], "Wrong data returned: ")
+    
+    def test_gettimelinedata_downsampling(self):
+        """Test that long series are downsampled keeping their extremes,
+        and that a date range returns the full resolution
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        data = {
+            "exe": "1",
+            "base": "none",
+            "ben": "ai",
+            "env": "tannit",
+            "revs": 1000,
+        }
+        responsedata = json.loads(self.client.get(path, data).content)
+        full = responsedata['timelines'][0]['executables']['1']
+        data['points'] = 10
+        responsedata = json.loads(self.client.get(path, data).content)
+        sampled = responsedata['timelines'][0]['executables']['1']
+        self.assertTrue(len(sampled) <= 10)
+        self.assertEquals(sampled[0], full[0])
+        self.assertEquals(sampled[-1], full[-1])
+        values = [point[1] for point in full]
+        self.assertTrue(full[values.index(max(values))] in sampled)
+        self.assertTrue(full[values.index(min(values))] in sampled)
+        
+        data['points'] = "ten"
+        responsedata = json.loads(self.client.get(path, data).content)
+        self.assertEquals(responsedata['error'], "Invalid points")
+        data['points'] = 10
+        
+        data['start'] = full[9][0]
+        data['end'] = full[2][0]
+        responsedata = json.loads(self.client.get(path, data).content)
+        self.assertEquals(responsedata['timelines'][0]['executables']['1'], full[2:10])
+    
+    def test_gettimelineresults_chunks(self):
+        """Series are fetched in queries that bind at most TIMELINEPARAMS
+        parameters
+        """
+        from codespeed import views
+        env = Environment.objects.get(name='tannit')
+        benchmarks = list(Benchmark.objects.values_list('id', flat=True))
+        executables = list(Executable.objects.values_list('id', flat=True))
+        latest = Result.objects.filter(environment=env).order_by('-revision_date')[0]
+        args = (env, benchmarks, executables, 3, datetime(2000, 1, 1),
+            datetime(2100, 1, 1), (latest.revision_date, latest.revision_id))
+        full = views.gettimelineresults(*args)
+        oldparams = views.TIMELINEPARAMS
+        # 9 parameters per series with the date range and cursor
+        views.TIMELINEPARAMS = 20
+        try:
+            self.assertEquals(views.gettimelineresults(*args), full)
+            keys = len(benchmarks) * len(executables)
+            self.assertEquals(countqueries(views.gettimelineresults, *args),
+                (keys + 1) // 2)
+        finally:
+            views.TIMELINEPARAMS = oldparams
+        self.assertTrue(len(full[0]) > 2)
+    
+    def test_gettimelinedata_pagination(self):
+        """Test that following the next cursor returns the older results
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        data = {
+            "exe": "1",
+            "base": "none",
+            "ben": "ai",
+            "env": "tannit",
+            "revs": 1000,
+        }
+        responsedata = json.loads(self.client.get(path, data).content)
+        full = responsedata['timelines'][0]['executables']['1']
+        self.assertEquals(responsedata['timelines'][0]['next'], None)
+        
+        data['revs'] = 10
+        pages = []
+        while True:
+            responsedata = json.loads(self.client.get(path, data).content)
+            if not responsedata['timelines']: break
+            timeline = responsedata['timelines'][0]
+            pages += timeline['executables']['1']
+            if timeline['next'] is None: break
+            data['before'] = timeline['next']
+        self.assertEquals(pages, full)
+        
+        data['before'] = "not a date,1"
+        responsedata = json.loads(self.client.get(path, data).content)
+        self.assertEquals(responsedata['error'], "Invalid before cursor")
+    
+    def test_gettimelinedata_pagination_executables(self):
+        """Series of different lengths are paged without returning any
+        result twice
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        # Executable 3 has a result in every other revision only
+        for i, result in enumerate(Result.objects.filter(executable=3,
+                benchmark__name='ai').order_by('revision_date')):
+            if i % 2: result.delete()
+        data = {"exe": "1,3", "base": "none", "ben": "ai", "env": "tannit",
+            "revs": 1000}
+        full = json.loads(self.client.get(path, data).content)['timelines'][0]['executables']
+        data['revs'] = 7
+        pages = {'1': [], '3': []}
+        while True:
+            responsedata = json.loads(self.client.get(path, data).content)
+            if not responsedata['timelines']: break
+            timeline = responsedata['timelines'][0]
+            for exe, results in timeline['executables'].items():
+                pages[exe] += results
+            if timeline['next'] is None: break
+            data['before'] = timeline['next']
+        self.assertEquals(pages, full)
+        self.assertTrue(len(full['1']) > len(full['3']) > 7)
+    
+    def test_gettimelinedata_grid_query_count(self):
+        """The number of queries of the grid must not depend on the number
+        of benchmarks or executables
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        data = {
+            "exe": "1",
+            "base": "2+35",
+            "ben": "grid",
+            "env": "tannit",
+            "revs": 16
+        }
+        queries = countqueries(self.client.get, path, data)
+        data['exe'] = "1,2,3,4"
+        self.assertEquals(countqueries(self.client.get, path, data), queries)
+        for i in range(10):
+            b = Benchmark(name='extra' + str(i))
+            b.save()
+            Result(value=1.0, revision_id=35, executable_id=2, benchmark=b,
+                environment_id=1).save()
+        self.assertEquals(countqueries(self.client.get, path, data), queries)
+
 
+class Comparison(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        self.client = Client()
+        self.path = reverse('codespeed.views.getcomparisondata')
+    
+    def test_getcomparisondata(self):
+        """Test that getcomparisondata returns the results of every
+        executable, environment and benchmark
+        """
+        response = self.client.get(self.path)
+        responsedata = json.loads(response.content)
+        self.assertEquals(responsedata['error'], "None")
+        self.assertEquals(responsedata['2+35']['1']['1'], Result.objects.get(
+            executable=2, revision=35, environment=1, benchmark=1).value)
+        self.assertEquals(len(responsedata['2+35']['1']), Benchmark.objects.count())
+        self.assertEquals(
+            sorted([key for key in responsedata if key != 'error']),
+            ['1+L', '2+35', '3+L', '4+35'])
+        latest = Revision.objects.filter(project=1).latest('date')
+        self.assertEquals(responsedata['1+L']['1']['1'], Result.objects.get(
+            executable=1, revision=latest, environment=1, benchmark=1).value)
+    
+    def test_getcomparisondata_query_count(self):
+        """The number of queries must not depend on the number of benchmarks"""
+        queries = countqueries(self.client.get, self.path)
+        for i in range(10):
+            b = Benchmark(name='extra' + str(i))
+            b.save()
+            Result(value=1.0, revision_id=35, executable_id=2, benchmark=b,
+                environment_id=1).save()
+        self.assertEquals(countqueries(self.client.get, self.path), queries)
+    
+    def test_getcomparisondata_other_process(self):
+        """Without a shared cache backend, revisions tagged by other
+        processes are shown by the next request
+        """
+        self.client.get(self.path)
+        rev = Revision.objects.filter(project=1, tag="").latest('date')
+        # Without signals, like in another process
+        Revision.objects.filter(id=rev.id).update(tag='other')
+        responsedata = json.loads(self.client.get(self.path).content)
+        self.assertTrue('1+%d' % rev.id in responsedata)
+    
+    def test_getcomparisonexes_query_count(self):
+        """The executables are fetched with a number of queries that doesn't
+        depend on the number of tags, and are memoized until revisions change
+        """
+        from codespeed.views import getcomparisonexes
+        queries = countqueries(getcomparisonexes)
+        self.assertEquals(countqueries(getcomparisonexes), 0)
+        for rev in Revision.objects.filter(project=1)[:5]:
+            rev.tag = 'tag' + str(rev.id)
+            rev.save()
+        self.assertEquals(countqueries(getcomparisonexes), queries)
+        self.assertEquals(len([exe for exe in getcomparisonexes()[0]
+            if exe['revision'].tag.startswith('tag')]), 5 * 2)
+
+class ChangesTable(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        self.client = Client()
+        self.path = reverse('codespeed.views.getchangestable')
+        self.data = {
+            "exe": "1",
+            "env": "tannit",
+            "tre": 10,
+            "rev": "75518",
+        }
+    
+    def test_getchangestable(self):
+        """Test that getchangestable renders a row for every benchmark"""
+        response = self.client.get(self.path, self.data)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(
+            response.content.count('<tr>\n        <td class="text"'),
+            Result.objects.filter(executable=1, revision__commitid="75518").count())
+    
+    def test_getchangestable_query_count(self):
+        """The number of queries must not depend on the trend window"""
+        queries = countqueries(self.client.get, self.path, self.data)
+        self.data['tre'] = 100
+        self.assertEquals(countqueries(self.client.get, self.path, self.data), queries)
+
+class ResponseCache(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        from codespeed import settings as codespeed_settings
+        self.settings = codespeed_settings
+        self.responsecache = self.settings.responsecache
+        self.settings.responsecache = 'locmem'
+        cache.backend = None
+        self.client = Client()
+        self.path = reverse('codespeed.views.gettimelinedata')
+        self.data = {
+            "exe": "1",
+            "base": "none",
+            "ben": "ai",
+            "env": "tannit",
+            "revs": 10
+        }
+    
+    def test_cache_hit(self):
+        """A repeated request is served from the cache"""
+        stats = cache.stats()
+        response = self.client.get(self.path, self.data)
+        self.assertEquals(cache.stats()['misses'], stats['misses'] + 1)
+        cachedresponse = self.client.get(self.path, self.data)
+        self.assertEquals(cache.stats()['hits'], stats['hits'] + 1)
+        self.assertEquals(cachedresponse.content, response.content)
+    
+    def test_stats_threads(self):
+        """Hits and misses counted by concurrent threads are not lost"""
+        import threading
+        stats = cache.stats()
+        def count():
+            for i in range(1000):
+                cache.count(True)
+                cache.count(False)
+        threads = [threading.Thread(target=count) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEquals(cache.stats()['hits'], stats['hits'] + 4000)
+        self.assertEquals(cache.stats()['misses'], stats['misses'] + 4000)
+    
+    def test_invalidation(self):
+        """Saving a result invalidates the cached responses of its project
+        and environment
+        """
+        response = self.client.get(self.path, self.data)
+        latest = json.loads(response.content)['timelines'][0]['executables']['1'][0]
+        self.client.post(reverse('codespeed.views.addresult'), {
+            'commitid': latest[3],
+            'project': 'PyPy',
+            'executable': 'pypy-c-jit',
+            'benchmark': 'ai',
+            'environment': 'tannit',
+            'result_value': 1.5,
+        })
+        response = self.client.get(self.path, self.data)
+        latest = json.loads(response.content)['timelines'][0]['executables']['1'][0]
+        self.assertEquals(latest[1], 1.5)
+    
+    def tearDown(self):
+        self.settings.responsecache = self.responsecache
+        cache.backend = None
+    
+    def test_commit_before_invalidation(self):
+        """Responses are invalidated after the result is committed, so that
+        no response with the old data is cached under the new generation
+        """
+        from codespeed import summaries
+        self.client.get(self.path, self.data)
+        generations = []
+        updatesummaries = summaries.updatesummaries
+        def getgenerations(results):
+            generations.append(cache.backend.getgenerations([cache.ALL]))
+            updatesummaries(results)
+        summaries.updatesummaries = getgenerations
+        try:
+            self.client.post(reverse('codespeed.views.addresult'), {
+                'commitid': '75518', 'project': 'PyPy', 'executable': 'pypy-c-jit',
+                'benchmark': 'ai', 'environment': 'tannit', 'result_value': 1.5})
+        finally:
+            summaries.updatesummaries = updatesummaries
+        self.assertEquals(cache.backend.getgenerations([cache.ALL])[0],
+            generations[0][0] + 1)
+    
+    def test_admin_invalidation(self):
+        """Results changed through the admin invalidate the cached responses"""
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('cacheadmin', 'admin@example.com', 'admin')
+        self.assertTrue(self.client.login(username='cacheadmin', password='admin'))
+        generation = cache.getbackend().getgenerations([cache.META])[0]
+        result = Result.objects.all()[0]
+        response = self.client.post('/admin/codespeed/result/%d/delete/' % result.id,
+            {'post': 'yes'})
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(Result.objects.filter(id=result.id).count(), 0)
+        self.assertTrue(cache.backend.getgenerations([cache.META])[0] > generation)
+    
+    def test_lru_eviction(self):
+        """The local backend evicts the least recently used response"""
+        backend = cache.LocalBackend(2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEquals(backend.get('b'), None)
+        self.assertEquals(backend.get('a'), 1)
+        self.assertEquals(backend.get('c'), 3)
+        backend.set('a', 4)
+        backend.set('d', 5)
+        self.assertEquals(backend.get('c'), None)
+        self.assertEquals([backend.get(key) for key in 'ad'], [4, 5])
+        self.assertEquals(len(backend), 2)
+
+class ResultSummaries(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        self.client = Client()
+        self.path = reverse('codespeed.views.getchangestable')
+        self.data = {
+            "exe": "1",
+            "env": "tannit",
+            "rev": "75518",
+        }
+    
+    def test_backfill(self):
+        """The changes table is the same when computed from the summaries"""
+        from django.core.management import call_command
+        from codespeed.summaries import TRENDS
+        from codespeed.models import ResultSummary
+        tables = {}
+        for trend in TRENDS:
+            self.data['tre'] = trend
+            tables[trend] = self.client.get(self.path, self.data).content
+        call_command('backfillsummaries', verbosity=0)
+        self.assertEquals(ResultSummary.objects.count(), Result.objects.count())
+        for trend in TRENDS:
+            self.data['tre'] = trend
+            cache.invalidate_all()
+            self.assertEquals(self.client.get(self.path, self.data).content, tables[trend])
+    
+    def test_update(self):
+        """Saving a result updates its summaries"""
+        from codespeed.models import ResultSummary
+        self.client.post(reverse('codespeed.views.addresult'), {
+            'commitid': '75519',
+            'project': 'PyPy',
+            'executable': 'pypy-c-jit',
+            'benchmark': 'ai',
+            'environment': 'tannit',
+            'result_value': 0.5,
+        })
+        result = Result.objects.get(revision__commitid='75519', benchmark__name='ai')
+        previous = Result.objects.get(
+            revision__commitid='75518', benchmark__name='ai', executable=1)
+        summary = ResultSummary.objects.get(result=result)
+        self.assertEquals(summary.previous, previous.value)
+        self.assertEquals(summary.change,
+            (result.value - previous.value)*100/previous.value)
+    
+    def getsummaries(self):
+        from codespeed.models import ResultSummary
+        return list(ResultSummary.objects.order_by('result').values_list(
+            'result', 'previous', 'change', 'average5', 'average10', 'average20',
+            'average50', 'average100'))
+    
+    def test_update_old_revision(self):
+        """Saving a result for an old revision updates the summaries of the
+        following revisions that depend on it
+        """
+        from django.core.management import call_command
+        call_command('backfillsummaries', verbosity=0)
+        self.client.post(reverse('codespeed.views.addresult'), {
+            'commitid': '75378',
+            'project': 'PyPy',
+            'executable': 'pypy-c-jit',
+            'benchmark': 'ai',
+            'environment': 'tannit',
+            'result_value': 10,
+        })
+        updated = self.getsummaries()
+        call_command('backfillsummaries', verbosity=0)
+        self.assertEquals(updated, self.getsummaries())
+    
+    def test_same_date(self):
+        """The summaries and the live calculation agree when revisions have
+        the same date
+        """
+        from django.core.management import call_command
+        from codespeed.models import ResultSummary
+        date = Revision.objects.get(commitid='75480').date
+        Revision.objects.filter(commitid__in=['75464', '75492']).update(date=date)
+        Result.objects.filter(revision__commitid__in=['75464', '75492']).update(
+            revision_date=date)
+        self.data['tre'] = 5
+        for rev in ['75464', '75492', '75518']:
+            self.data['rev'] = rev
+            call_command('backfillsummaries', verbosity=0)
+            cache.invalidate_all()
+            table = self.client.get(self.path, self.data).content
+            ResultSummary.objects.all().delete()
+            cache.invalidate_all()
+            self.assertEquals(self.client.get(self.path, self.data).content, table)
+    
+    def test_conflict_retried(self):
+        """Saving a result is retried when a concurrent transaction saved the
+        same summaries
+        """
+        from django.db import IntegrityError
+        from codespeed import summaries
+        calls = []
+        updatesummaries = summaries.updatesummaries
+        def conflicting(results):
+            calls.append(results)
+            if len(calls) == 1: raise IntegrityError("duplicate summary")
+            updatesummaries(results)
+        summaries.updatesummaries = conflicting
+        try:
+            response = self.client.post(reverse('codespeed.views.addresult'), {
+                'commitid': '75519', 'project': 'PyPy', 'executable': 'pypy-c-jit',
+                'benchmark': 'ai', 'environment': 'tannit', 'result_value': 0.5})
+        finally:
+            summaries.updatesummaries = updatesummaries
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(calls), 2)
+        self.assertEquals(Result.objects.filter(revision__commitid='75519').count(), 1)
+    
+    def test_rollback_invalidates_metadata(self):
+        """The cached metadata is dropped only when a transaction rolled back"""
+        from django.db import transaction
+        from codespeed.views import retryconflicts
+        invalidations = []
+        invalidate = metadata.invalidate
+        metadata.invalidate = lambda *args, **kwargs: invalidations.append(args)
+        def fail(write):
+            if write: transaction.set_dirty()
+            raise ValueError("invalid data")
+        # The test case runs in a single transaction, which fixtures made dirty
+        transaction.set_clean()
+        try:
+            self.assertRaises(ValueError, retryconflicts, fail, False)
+            self.assertEquals(invalidations, [])
+            self.assertRaises(ValueError, retryconflicts, fail, True)
+            self.assertEquals(len(invalidations), 1)
+        finally:
+            metadata.invalidate = invalidate
+
+class CommitLogs(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        self.client = Client()
+        self.path = reverse('codespeed.views.displaylogs')
+        self.rev = Revision.objects.get(commitid='75518')
+        self.previous = Revision.objects.filter(
+            project=self.rev.project, date__lt=self.rev.date).order_by('-date')[0]
+    
+    def test_displaylogs(self):
+        """The stored logs since the previous revision are displayed"""
+        from codespeed.models import CommitLog
+        from datetime import timedelta
+        project = self.rev.project
+        for i, date in enumerate([
+                self.previous.date,
+                self.previous.date + timedelta(seconds=1),
+                self.rev.date,
+                self.rev.date + timedelta(seconds=1)]):
+            CommitLog(project=project, commitid='log%d' % i, date=date,
+                author='author', message='message').save()
+        response = self.client.get(self.path, {'revisionid': self.rev.id})
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue('log1' in response.content)
+        self.assertTrue('log2' in response.content)
+        self.assertFalse('log0' in response.content)
+        self.assertFalse('log3' in response.content)
+        self.assertTrue(response.content.index('log2') < response.content.index('log1'))
+    
+    def test_displaylogs_not_stored(self):
+        """Logs that have not been stored are not fetched for pending
+        revisions, which get them in the background, nor without a VCS
+        """
+        Revision.objects.filter(id=self.rev.id).update(pending=True)
+        response = self.client.get(self.path, {'revisionid': self.rev.id})
+        self.assertTrue('no logs found' in response.content)
+        Revision.objects.filter(id=self.rev.id).update(pending=False)
+        Project.objects.filter(id=self.rev.project_id).update(repo_type='N')
+        response = self.client.get(self.path, {'revisionid': self.rev.id})
+        self.assertTrue('no logs found' in response.content)
+
+class GitLogs(TestCase):
+    
+    def setUp(self):
+        import tempfile, subprocess, os
+        from codespeed import git
+        self.tmpdir = tempfile.mkdtemp()
+        self.oldpath = git.path
+        git.path = self.tmpdir + '/repos/'
+        repo = self.tmpdir + '/project'
+        env = dict(os.environ, GIT_AUTHOR_NAME='Author', GIT_AUTHOR_EMAIL='a@b.c',
+            GIT_COMMITTER_NAME='Author', GIT_COMMITTER_EMAIL='a@b.c')
+        subprocess.call(['git', 'init', '-q', repo])
+        self.commitids = []
+        for i in range(4):
+            env['GIT_AUTHOR_DATE'] = env['GIT_COMMITTER_DATE'] = '%d +0000' % (1277000000 + i * 60)
+            subprocess.call(['git', 'commit', '-q', '--allow-empty', '-m', 'Commit %d' % i],
+                cwd=repo, env=env)
+            p = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=repo, stdout=subprocess.PIPE)
+            self.commitids.append(p.communicate()[0].strip())
+        self.project = Project(name='git', repo_type='G', repo_path=repo)
+        self.project.save()
+    
+    def tearDown(self):
+        import shutil
+        from codespeed import git
+        git.closereader(git.getrepodir(self.project.repo_path))
+        git.path = self.oldpath
+        shutil.rmtree(self.tmpdir)
+    
+    def test_getcommits(self):
+        """All commits are resolved, also with abbreviated commitids"""
+        from codespeed import git
+        git.updaterepo(self.project.repo_path)
+        commits = git.getcommits(self.project.repo_path,
+            [self.commitids[0], self.commitids[2][:10], 'missing'])
+        self.assertEquals(len(commits), 2)
+        self.assertEquals(commits[self.commitids[0]]['message'], 'Commit 0')
+        self.assertEquals(commits[self.commitids[2][:10]]['commitid'], self.commitids[2])
+        self.assertEquals(commits[self.commitids[2][:10]]['author'], 'Author')
+    
+    def test_getcommitlogs(self):
+        """The logs between two revisions are returned newest first"""
+        from codespeed.views import getcommitlogs
+        end = Revision(commitid=self.commitids[3], project=self.project)
+        start = Revision(commitid=self.commitids[0], project=self.project)
+        logs = getcommitlogs(end, start, update=True)
+        self.assertEquals([log['commitid'] for log in logs],
+            [self.commitids[3], self.commitids[2], self.commitids[1]])
+        self.assertEquals(logs[0]['date'],
+            datetime.fromtimestamp(1277000180).strftime("%Y-%m-%d %H:%M:%S"))
+        logs = getcommitlogs(start, start)
+        self.assertEquals([log['message'] for log in logs], ['Commit 0'])
+    
+    def test_fetchrevisioninfo(self):
+        """New revisions are saved as pending, and their VCS info is fetched
+        by the fetchrevisioninfo command
+        """
+        from django.core.management import call_command
+        from codespeed.models import CommitLog
+        Environment(name='bigdog').save()
+        data = {
+            'project': 'git',
+            'executable': 'git-exe',
+            'benchmark': 'Richards',
+            'environment': 'bigdog',
+            'result_value': 1,
+        }
+        for i in [0, 3, 5]:
+            data['commitid'] = i < 4 and self.commitids[i] or 'missing'
+            response = self.client.post(reverse('codespeed.views.addresult'), data)
+            self.assertEquals(response.status_code, 200)
+        self.assertEquals(Revision.objects.filter(project=self.project, pending=True).count(), 3)
+        
+        call_command('fetchrevisioninfo', verbosity=0)
+        rev = Revision.objects.get(commitid=self.commitids[3])
+        self.assertFalse(rev.pending)
+        self.assertEquals(rev.date, datetime.fromtimestamp(1277000180))
+        self.assertEquals(rev.message, 'Commit 3')
+        self.assertEquals(Result.objects.get(revision=rev).revision_date, rev.date)
+        self.assertEquals(CommitLog.objects.filter(project=self.project).count(), 4)
+        missing = Revision.objects.get(commitid='missing')
+        self.assertTrue(missing.pending)
+        self.assertEquals(missing.attempts, 1)
+        self.assertTrue(missing.error)
+        
+        call_command('fetchrevisioninfo', verbosity=0, attempts=1)
+        self.assertEquals(Revision.objects.get(commitid='missing').attempts, 1)
+    
+    def test_displaylogs(self):
+        """The logs of revisions saved with their date are fetched and
+        stored when they are first shown
+        """
+        from codespeed.models import CommitLog
+        Environment(name='bigdog').save()
+        for i in [0, 3]:
+            self.client.post(reverse('codespeed.views.addresult'), {
+                'commitid': self.commitids[i],
+                'revision_date': datetime.fromtimestamp(1277000000 + i * 60).strftime(
+                    "%Y-%m-%d %H:%M:%S"),
+                'project': 'git',
+                'executable': 'git-exe',
+                'benchmark': 'Richards',
+                'environment': 'bigdog',
+                'result_value': 1,
+            })
+        rev = Revision.objects.get(commitid=self.commitids[3])
+        self.assertFalse(rev.pending)
+        self.assertEquals(CommitLog.objects.count(), 0)
+        path = reverse('codespeed.views.displaylogs')
+        response = self.client.get(path, {'revisionid': rev.id})
+        for message in ['Commit 3', 'Commit 2', 'Commit 1']:
+            self.assertTrue(message in response.content)
+        self.assertFalse('Commit 0' in response.content)
+        self.assertEquals(CommitLog.objects.count(), 3)
+    
+    def test_fetchrevisioninfo_archive(self):
+        """Archived series are reordered by the fetched revision dates"""
+        import numpy, shutil, tempfile
+        from django.core.management import call_command
+        from codespeed import settings as codespeed_settings
+        Environment(name='bigdog').save()
+        codespeed_settings.archivedir = tempfile.mkdtemp()
+        try:
+            # Pending revisions are archived in the order they are submitted
+            for i in [3, 0, 1]:
+                self.client.post(reverse('codespeed.views.addresult'), {
+                    'commitid': self.commitids[i],
+                    'project': 'git',
+                    'executable': 'git-exe',
+                    'benchmark': 'Richards',
+                    'environment': 'bigdog',
+                    'result_value': i,
+                })
+            key = Result.objects.values_list('executable', 'benchmark', 'environment')[0]
+            path = os.path.join(codespeed_settings.archivedir, "%d-%d-%d" % key)
+            self.assertEquals(list(numpy.load(os.path.join(path, 'value.npy'))),
+                [3.0, 0.0, 1.0])
+            
+            call_command('fetchrevisioninfo', verbosity=0)
+            self.assertEquals(list(numpy.load(os.path.join(path, 'value.npy'))),
+                [0.0, 1.0, 3.0])
+            self.assertEquals(str(numpy.load(os.path.join(path, 'revision_date.npy'))[0]),
+                datetime.fromtimestamp(1277000000).strftime("%Y-%m-%dT%H:%M:%S"))
+        finally:
+            shutil.rmtree(codespeed_settings.archivedir)
+            codespeed_settings.archivedir = None
+
+class MercurialLogs(TestCase):
+    
+    def test_logparser(self):
+        """Logs are parsed from the command server output as it arrives,
+        whatever the chunk boundaries are
+        """
+        from codespeed.mercurial import LogParser
+        output = (
+            "75518:0123456789ab\nJohn Doe / john\n1277000180 -7200\nFix\n\nthe bug\n=newlog=\n"
+            "75517:ba9876543210\nJane Doe / jane\n1277000120 0\nAdd a test\n=newlog=\n")
+        for size in [1, 7, 1000]:
+            parser = LogParser()
+            for i in range(0, len(output), size):
+                parser.feed(output[i:i + size])
+            self.assertEquals([log['commitid'] for log in parser.logs],
+                ['75518:0123456789ab', '75517:ba9876543210'])
+            self.assertEquals(parser.logs[0]['message'], 'Fix\n\nthe bug')
+            self.assertEquals(parser.logs[0]['author'], 'John Doe / john')
+            self.assertEquals(parser.logs[1]['date'],
+                datetime.fromtimestamp(1277000120).strftime("%Y-%m-%d %H:%M:%S"))
+
+class SubversionLogs(TestCase):
+    
+    def test_memo(self):
+        """Memoized queries share their logs, which are dropped together
+        with the last query that uses them
+        """
+        from codespeed import subversion
+        oldsize = subversion.memosize
+        subversion.memosize = 2
+        try:
+            entries = [{'commitid': number} for number in [12, 11, 10]]
+            subversion.setmemo(('repo', 10, 12), entries)
+            subversion.setmemo(('repo', 11, 11), entries[1:2])
+            self.assertEquals(subversion.getmemo(('repo', 10, 12)), entries)
+            subversion.setmemo(('repo', 12, 12), entries[:1])
+            # The least recently used query was dropped, but its log is still used
+            self.assertEquals(subversion.getmemo(('repo', 11, 11)), None)
+            self.assertEquals(subversion.getmemo(('repo', 12, 12)), entries[:1])
+            subversion.setmemo(('other', 1, 1), [{'commitid': 1}])
+            self.assertEquals(subversion.getmemo(('repo', 10, 12)), None)
+            self.assertEquals(sorted(subversion.logs.keys()),
+                [('other', 1), ('repo', 12)])
+            # Memoizing a query again doesn't leak its logs
+            subversion.setmemo(('other', 1, 1), [{'commitid': 1}])
+            subversion.setmemo(('other', 2, 2), [{'commitid': 2}])
+            subversion.setmemo(('other', 3, 3), [{'commitid': 3}])
+            self.assertEquals(sorted(subversion.logs.keys()),
+                [('other', 2), ('other', 3)])
+        finally:
+            subversion.memosize = oldsize
+            subversion.clearmemo()
+
+class MetadataCache(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def test_lookups(self):
+        """Cached lookups don't query the database"""
+        ai = metadata.get(Benchmark, name='ai')
+        self.assertEquals(countqueries(metadata.get, Benchmark, name='ai'), 0)
+        self.assertTrue(metadata.get(Benchmark, id=ai.id) is ai)
+        exe = metadata.get(Executable, id=1)
+        self.assertEquals(countqueries(getattr, exe, 'project'), 0)
+        self.assertRaises(Environment.DoesNotExist,
+            metadata.get, Environment, name='missing')
+    
+    def test_created_elsewhere(self):
+        """Objects created without the signals, like by another process, are
+        found by reloading the tables
+        """
+        from codespeed.models import bulkinsert
+        metadata.getall(Executable)
+        bulkinsert(Environment, [Environment(name='otherprocess')])
+        bulkinsert(Executable, [Executable(name='otherexe', project_id=2)])
+        self.assertEquals(metadata.get(Environment, name='otherprocess').name,
+            'otherprocess')
+        exe = Executable.objects.get(name='otherexe')
+        self.assertEquals(metadata.get(Executable, id=exe.id).project.name,
+            Project.objects.get(id=2).name)
+        self.assertRaises(Environment.DoesNotExist,
+            metadata.get, Environment, name='missing')
+    
+    def test_changed_elsewhere(self):
+        """Without a shared cache backend, objects changed by other
+        processes are reloaded by the next request
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        data = {"exe": "1", "base": "none", "ben": "ai", "env": "tannit", "revs": 5}
+        self.client.get(path, data)
+        # Without signals, like in another process
+        Benchmark.objects.filter(name='ai').update(units='ms')
+        responsedata = json.loads(self.client.get(path, data).content)
+        self.assertEquals(responsedata['timelines'][0]['units'], 'ms')
+    
+    def test_invalidation(self):
+        """Saving or deleting objects invalidates the cached tables"""
+        count = len(metadata.getall(Benchmark))
+        b, created = metadata.get_or_create(Benchmark, name='new')
+        self.assertTrue(created)
+        self.assertEquals(len(metadata.getall(Benchmark)), count + 1)
+        self.assertEquals(metadata.get_or_create(Benchmark, name='new'), (b, False))
+        b.delete()
+        self.assertEquals(len(metadata.getall(Benchmark)), count)
+    
+    def test_addresult_query_count(self):
+        """Adding results for existing metadata doesn't look it up, when the
+        tables are kept across requests
+        """
+        from codespeed import settings as codespeed_settings
+        data = {
+            'commitid': '75518',
+            'project': 'PyPy',
+            'executable': 'pypy-c-jit',
+            'benchmark': 'ai',
+            'environment': 'tannit',
+            'result_value': 1,
+        }
+        responsecache = codespeed_settings.responsecache
+        codespeed_settings.responsecache = 'django'
+        cache.backend = None
+        countqueries(lambda: None)
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            self.client.post(reverse('codespeed.views.addresult'), data)
+            queries = [query['sql'] for query in connection.queries]
+        finally:
+            settings.DEBUG = False
+            codespeed_settings.responsecache = responsecache
+            cache.backend = None
+        for table in ['project', 'benchmark', 'executable', 'environment']:
+            self.assertEquals([sql for sql in queries
+                if 'FROM "codespeed_%s"' % table in sql], [])
+
+class ChangePoints(TestCase):
+    
+    def setUp(self):
+        Environment(name='bigdog').save()
+        self.path = reverse('codespeed.views.addresults')
+        self.values = [1.0, 1.02, 0.98, 1.01, 0.99, 1.0, 1.03, 0.97, 1.01, 1.0,
+            1.5, 1.52, 1.48, 1.51, 1.49, 1.5]
+    
+    def save(self, values, start=0):
+        items = []
+        for i, value in enumerate(values):
+            items.append({
+                'commitid': str(start + i),
+                'revision_date': '2010-06-%02d 12:00:00' % (start + i + 1),
+                'project': 'pypy',
+                'executable': 'pypy-c',
+                'benchmark': 'Richards',
+                'environment': 'bigdog',
+                'result_value': value,
+            })
+        self.client.post(self.path, {'json': json.dumps(items)})
+    
+    def test_detection(self):
+        """A step in a series is found incrementally, and the feed shows it"""
+        from codespeed.models import ChangePoint
+        self.save(self.values[:8])
+        for i in range(8, len(self.values)):
+            self.save(self.values[i:i + 1], i)
+        self.assertEquals(ChangePoint.objects.count(), 1)
+        point = ChangePoint.objects.get()
+        self.assertEquals(point.result.revision.commitid, '10')
+        self.assertTrue(45 < point.change < 55)
+        
+        response = self.client.get(reverse('codespeed.views.getchangepoints'),
+            {'env': 'bigdog', 'ben': 'Richards'})
+        feed = json.loads(response.content)['changepoints']
+        self.assertEquals(len(feed), 1)
+        self.assertEquals(feed[0]['commitid'], '10')
+        self.assertTrue(feed[0]['regression'])
+        response = self.client.get(reverse('codespeed.views.getchangepoints'),
+            {'env': 'missing'})
+        self.assertEquals(response.status_code, 400)
+    
+    def test_backfill(self):
+        """Detecting over the whole history finds the same change points"""
+        from django.core.management import call_command
+        from codespeed.models import ChangePoint, SeriesState
+        self.save(self.values)
+        incremental = list(ChangePoint.objects.values_list('result', 'before', 'after'))
+        state = SeriesState.objects.values_list('count', 'mean', 'up', 'down')[0]
+        call_command('detectchangepoints', verbosity=0)
+        self.assertEquals(list(ChangePoint.objects.values_list('result', 'before', 'after')),
+            incremental)
+        self.assertEquals(SeriesState.objects.values_list('count', 'mean', 'up', 'down')[0], state)
+    
+    def test_no_history_scan(self):
+        """Saving a result doesn't read the older results of its series"""
+        from codespeed.changepoints import updatechangepoints
+        self.save(self.values[:10])
+        result = Result.objects.get(revision__commitid='9')
+        result.revision_date = datetime(2010, 7, 1)
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            updatechangepoints([result])
+            queries = [query['sql'] for query in connection.queries]
+        finally:
+            settings.DEBUG = False
+        self.assertEquals([sql for sql in queries if 'FROM "codespeed_result"' in sql], [])
+
+class Samples(TestCase):
+    
+    def setUp(self):
+        Environment(name='bigdog').save()
+        self.data = {
+            'commitid': '123',
+            'project': 'pypy',
+            'executable': 'pypy-c',
+            'benchmark': 'Richards',
+            'environment': 'bigdog',
+            'result_value': 2.0,
+            'samples': '1.0, 2.0, 3.0,4.0',
+        }
+    
+    def test_stats(self):
+        """Statistics are the same with and without numpy"""
+        from codespeed import samples
+        values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0]
+        packed = samples.pack(values)
+        self.assertEquals(len(packed), 8 * len(values))
+        self.assertEquals(list(samples.unpack(packed)), values)
+        stats = samples.getstats(samples.unpack(packed))
+        self.assertEquals(stats['count'], 8)
+        self.assertEquals(stats['median'], 3.5)
+        self.assertEquals(stats['min'], 1.0)
+        self.assertTrue(stats['ci95'][0] < stats['mean'] < stats['ci95'][1])
+        numpy, samples.numpy = samples.numpy, None
+        try:
+            self.assertEquals(samples.unpack(packed), values)
+            purestats = samples.getstats(values)
+        finally:
+            samples.numpy = numpy
+        for key in stats:
+            if key == 'ci95':
+                for a, b in zip(stats[key], purestats[key]):
+                    self.assertAlmostEquals(a, b)
+            else:
+                self.assertAlmostEquals(stats[key], purestats[key])
+        self.assertRaises(ValueError, samples.parse, "1.0,a")
+        self.assertRaises(ValueError, samples.parse, "[]")
+        self.assertEquals(samples.parse("[1, 2.5]"), [1.0, 2.5])
+    
+    def test_addresult(self):
+        """Samples are stored packed, and fill in the missing statistics"""
+        response = self.client.post(reverse('codespeed.views.addresult'), self.data)
+        self.assertEquals(response.status_code, 200)
+        res = Result.objects.get()
+        self.assertEquals(res.value, 2.0)
+        self.assertEquals(res.val_min, 1.0)
+        self.assertEquals(res.val_max, 4.0)
+        self.assertAlmostEquals(res.std_dev, 1.2909944)
+        self.assertEquals(len(res.samples), 32)
+        
+        self.data['samples'] = 'a,b'
+        response = self.client.post(reverse('codespeed.views.addresult'), self.data)
+        self.assertEquals(response.status_code, 400)
+        # Nothing is created for a rejected result
+        data = dict(self.data, commitid='124', project='newproject',
+            executable='newexe', benchmark='newbench')
+        response = self.client.post(reverse('codespeed.views.addresult'), data)
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(Project.objects.filter(name='newproject').count(), 0)
+        self.assertEquals(Benchmark.objects.filter(name='newbench').count(), 0)
+        self.assertEquals(Revision.objects.filter(commitid='124').count(), 0)
+    
+    def test_admin(self):
+        """The admin list and change pages don't load the samples"""
+        from django.contrib.auth.models import User
+        self.client.post(reverse('codespeed.views.addresult'), self.data)
+        result = Result.objects.get()
+        User.objects.create_superuser('samplesadmin', 'admin@example.com', 'admin')
+        self.assertTrue(self.client.login(username='samplesadmin', password='admin'))
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            for path in ['/admin/codespeed/result/',
+                    '/admin/codespeed/result/%d/' % result.id]:
+                self.assertEquals(self.client.get(path).status_code, 200)
+            queries = [query['sql'] for query in connection.queries]
+        finally:
+            settings.DEBUG = debug
+        self.assertFalse([sql for sql in queries if 'samples' in sql])
+        response = self.client.post('/admin/codespeed/result/%d/delete/' % result.id,
+            {'post': 'yes'})
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(Result.objects.count(), 0)
+    
+    def test_addresults(self):
+        """The batch path stores samples given as a list"""
+        self.data['samples'] = [0.5, 1.5]
+        self.data['std_dev'] = 0.25
+        item = dict(self.data, benchmark='float', samples='x')
+        response = self.client.post(reverse('codespeed.views.addresults'),
+            {'json': json.dumps([self.data, item])})
+        statuses = json.loads(response.content)['results']
+        self.assertEquals(statuses[0], {'status': 'saved'})
+        self.assertEquals(statuses[1]['status'], 'error')
+        res = Result.objects.get()
+        self.assertEquals(res.std_dev, 0.25)
+        self.assertEquals(res.val_max, 1.5)
+    
+    def test_getsamples(self):
+        """The samples are sent as stored, or as JSON statistics"""
+        import struct
+        self.client.post(reverse('codespeed.views.addresult'), self.data)
+        exe = Executable.objects.get()
+        path = reverse('codespeed.views.getsamples')
+        query = {'exe': exe.id, 'ben': 'Richards', 'env': 'bigdog', 'rev': '123'}
+        response = self.client.get(path, query)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/octet-stream')
+        self.assertEquals(struct.unpack('<4d', response.content), (1.0, 2.0, 3.0, 4.0))
+        
+        response = self.client.get(path, dict(query, format='json'))
+        data = json.loads(response.content)
+        self.assertEquals(data['samples'], [1.0, 2.0, 3.0, 4.0])
+        self.assertEquals(data['stats']['median'], 2.5)
+        
+        self.assertEquals(self.client.get(path, dict(query, rev='124')).status_code, 404)
+        self.assertEquals(self.client.get(path, dict(query, ben='missing')).status_code, 400)
+
+class ImportResults(TestCase):
+    
+    def setUp(self):
+        import tempfile
+        Environment(name='tannit').save()
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, 'checkpoint')
+        for revision in [9, 10]:
+            self.write(revision)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+    
+    def write(self, revision):
+        f = open(os.path.join(self.dir, '%d.json' % revision), 'w')
+        json.dump({'revision': revision, 'options': '', 'results': [
+            ['ai', 'ComparisonResult', {'avg_base': 0.4, 'avg_changed': 0.2,
+                'std_base': 0.01, 'std_changed': 0.02}],
+            ['html5lib', 'SimpleComparisonResult', {'base_time': 11.0,
+                'changed_time': 12.0}],
+            ['float', 'RawResult', {'base_times': [1.0, 2.0],
+                'changed_times': [0.5, 1.5]}],
+        ]}, f)
+        f.close()
+    
+    def run_import(self):
+        from django.core.management import call_command
+        call_command('importresults', self.dir, executable='pypy-c-jit',
+            environment='tannit', checkpoint=self.checkpoint, workers=2, batch=1,
+            verbosity=0)
+    
+    def test_import(self):
+        """Files are imported in revision order and not imported again"""
+        self.run_import()
+        self.assertEquals(Result.objects.count(), 6)
+        self.assertEquals(list(Revision.objects.order_by('id').values_list(
+            'commitid', flat=True)), ['9', '10'])
+        res = Result.objects.get(revision__commitid='10', benchmark__name='ai')
+        self.assertEquals((res.value, res.std_dev), (0.2, 0.02))
+        res = Result.objects.get(revision__commitid='10', benchmark__name='float')
+        self.assertEquals(res.value, 1.0)
+        self.assertEquals(len(res.samples), 16)
+        
+        Result.objects.all().delete()
+        self.write(11)
+        self.run_import()
+        self.assertEquals(list(Result.objects.values_list(
+            'revision__commitid', flat=True).distinct()), ['11'])
+        self.assertEquals(len(open(self.checkpoint).readlines()), 3)
+    
+    def test_failed_file(self):
+        """Files that fail are not recorded in the checkpoint"""
+        open(os.path.join(self.dir, '11.json'), 'w').write('{"revision": ')
+        self.run_import()
+        self.assertEquals(Result.objects.count(), 6)
+        self.assertEquals([line.split('/')[-1] for line in open(self.checkpoint)],
+            ['9.json\n', '10.json\n'])
+
+class UpgradeDB(TestCase):
+    
+    def test_addcolumn(self):
+        """Added columns get defaults every database accepts"""
+        from codespeed.management.commands.upgradedb import sqldefault, addcolumn
+        self.assertEquals(sqldefault(Revision._meta.get_field('pending')), "0")
+        self.assertEquals(sqldefault(Revision._meta.get_field('attempts')), "0")
+        self.assertEquals(sqldefault(Revision._meta.get_field('error')), "''")
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE upgradetest (id integer)")
+        cursor.execute("INSERT INTO upgradetest VALUES (1)")
+        for name in ['pending', 'error', 'attempts']:
+            addcolumn(cursor, 'upgradetest', Revision._meta.get_field(name))
+        cursor.execute("SELECT pending, error, attempts FROM upgradetest")
+        self.assertEquals(cursor.fetchall(), [(0, '', 0)])
+
+class ResultExport(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        self.path = reverse('codespeed.views.getresultexport')
+    
+    def test_csv(self):
+        """All results are streamed as CSV, ordered by series"""
+        import csv
+        response = self.client.get(self.path)
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse(response._is_string)
+        rows = list(csv.reader(response.content.splitlines()))
+        self.assertEquals(rows[0][:5],
+            ['project', 'executable', 'benchmark', 'environment', 'commitid'])
+        self.assertEquals(len(rows) - 1, Result.objects.count())
+        series = [(row[2], row[3], row[1]) for row in rows[1:]]
+        self.assertEquals(series, sorted(series, key=lambda key: (
+            Benchmark.objects.get(name=key[0]).id, key[1],
+            Executable.objects.get(name=key[2]).id)))
+        
+        # Values are written with full precision
+        Result.objects.update(value=1.0 / 3)
+        rows = list(csv.reader(self.client.get(self.path).content.splitlines()))
+        self.assertEquals(float(rows[1][6]), 1.0 / 3)
+    
+    def test_filters(self):
+        """Filtered results are streamed as newline-delimited JSON"""
+        result = Result.objects.filter(benchmark__name='ai')[0]
+        query = {'format': 'ndjson', 'ben': 'ai', 'env': 'tannit',
+            'exe': str(result.executable_id),
+            'project': result.executable.project.name,
+            'start': str(result.revision_date), 'end': str(result.revision_date)}
+        response = self.client.get(self.path, query)
+        rows = [json.loads(line) for line in response.content.splitlines()]
+        self.assertEquals(len(rows), Result.objects.filter(benchmark__name='ai',
+            executable=result.executable, revision_date=result.revision_date).count())
+        self.assertEquals(rows[0]['commitid'], result.revision.commitid)
+        self.assertEquals(rows[0]['value'], result.value)
+        
+        response = self.client.get(self.path, {'project': 'missing'})
+        self.assertEquals(response.status_code, 400)
+        response = self.client.get(self.path, {'start': 'yesterday'})
+        self.assertEquals(response.status_code, 400)
+
+class Archive(TestCase):
+    
+    def setUp(self):
+        import tempfile
+        from codespeed import settings as codespeed_settings
+        Environment(name='bigdog').save()
+        self.settings = codespeed_settings
+        self.dir = tempfile.mkdtemp()
+        self.settings.archivedir = self.dir
+        self.path = reverse('codespeed.views.addresults')
+    
+    def tearDown(self):
+        import shutil
+        self.settings.archivedir = None
+        shutil.rmtree(self.dir)
+    
+    def save(self, values, start=0):
+        self.client.post(self.path, {'json': json.dumps([{
+            'commitid': str(start + i),
+            'revision_date': '2010-06-%02d 12:00:00' % (start + i + 1),
+            'project': 'pypy',
+            'executable': 'pypy-c',
+            'benchmark': 'Richards',
+            'environment': 'bigdog',
+            'result_value': value,
+            'std_dev': i == 1 and 0.5 or None,
+        } for i, value in enumerate(values)])})
+    
+    def load(self, column):
+        import numpy
+        key = Result.objects.values_list('executable', 'benchmark', 'environment')[0]
+        return numpy.load(os.path.join(self.dir, "%d-%d-%d" % key, column + '.npy'),
+            mmap_mode='r')
+    
+    def test_append(self):
+        """New results are appended, older ones rewrite the series"""
+        import numpy
+        from codespeed import archive
+        self.save([1.0, 2.0])
+        rebuildseries, archive.rebuildseries = archive.rebuildseries, None
+        try:
+            self.save([3.0, 4.0], 2)
+        finally:
+            archive.rebuildseries = rebuildseries
+        self.assertEquals(list(self.load('value')), [1.0, 2.0, 3.0, 4.0])
+        self.assertEquals(self.load('std_dev')[1], 0.5)
+        self.assertTrue(numpy.isnan(self.load('std_dev')[0]))
+        self.assertEquals(str(self.load('revision_date')[2]), '2010-06-03T12:00:00')
+        
+        # A result for an older revision
+        self.client.post(self.path, {'json': json.dumps([{
+            'commitid': '0.5', 'revision_date': '2010-06-01 18:00:00',
+            'project': 'pypy', 'executable': 'pypy-c', 'benchmark': 'Richards',
+            'environment': 'bigdog', 'result_value': 1.5}])})
+        self.assertEquals(list(self.load('value')), [1.0, 1.5, 2.0, 3.0, 4.0])
+        self.assertEquals(list(self.load('result_id')), list(Result.objects.order_by(
+            'revision_date').values_list('id', flat=True)))
+    
+    def test_buildarchive(self):
+        """The command builds the same archive, and it can be downloaded"""
+        from django.core.management import call_command
+        self.save([1.0, 2.0, 3.0])
+        values = open(self.load('value').filename, 'rb').read()
+        import shutil
+        shutil.rmtree(self.dir)
+        call_command('buildarchive', verbosity=0)
+        self.assertEquals(open(self.load('value').filename, 'rb').read(), values)
+        
+        path = reverse('codespeed.views.getarchive')
+        index = json.loads(self.client.get(path).content)['series']
+        self.assertEquals([(s['benchmark'], s['length']) for s in index], [('Richards', 3)])
+        response = self.client.get(path, {'exe': index[0]['executable_id'],
+            'ben': 'Richards', 'env': 'bigdog', 'column': 'value'})
+        self.assertEquals(response.content, values)
+        response = self.client.get(path, {'exe': index[0]['executable_id'],
+            'ben': 'Richards', 'env': 'bigdog', 'column': 'commitid'})
+        self.assertEquals(response.status_code, 400)
+
+class QueryScaling(TestCase):
+    """Seeds datasets of increasing size and checks that the number of
+    queries of every view doesn't grow with the number of benchmarks and
+    revisions, and that its time grows at most linearly with the size of
+    the response
+    """
+    # Sizes of the datasets, as (benchmarks, revisions)
+    SMALL = (4, 10)
+    LARGE = (16, 40)
+    # Number of timed requests, of which the fastest is compared
+    TIMINGS = 5
+    
+    def setUp(self):
+        from codespeed import settings as codespeed_settings
+        self.settings = codespeed_settings
+        self.responsecache = self.settings.responsecache
+        # Every request has to be served by the view
+        self.settings.responsecache = None
+        cache.backend = None
+        self.project = Project(name='scaling', track=True)
+        self.project.save()
+        self.environment = Environment(name='scalingenv')
+        self.environment.save()
+        self.executables = []
+        for i in range(2):
+            exe = Executable(name='scalingexe%d' % i, project=self.project)
+            exe.save()
+            self.executables.append(exe)
+        self.benchmarks = []
+        self.revisions = []
+    
+    def tearDown(self):
+        self.settings.responsecache = self.responsecache
+        cache.backend = None
+    
+    def seed(self, size):
+        """Grows the dataset to the given number of benchmarks and
+        revisions, with a result of every executable for each of them
+        """
+        from django.core.management import call_command
+        from datetime import timedelta
+        from codespeed.models import bulkinsert
+        benchmarks, revisions = size
+        new = []
+        for i in range(len(self.benchmarks), benchmarks):
+            b = Benchmark(name='scaling%03d' % i)
+            b.save()
+            self.benchmarks.append(b)
+            new += [(b, rev) for rev in self.revisions]
+        for i in range(len(self.revisions), revisions):
+            rev = Revision(commitid=str(i), project=self.project,
+                date=datetime(2011, 1, 1) + timedelta(hours=i))
+            rev.save()
+            self.revisions.append(rev)
+            new += [(b, rev) for b in self.benchmarks]
+        results = []
+        for b, rev in new:
+            for exe in self.executables:
+                results.append(Result(value=1.0 + (rev.id % 7) / 10.0,
+                    std_dev=0.01, revision=rev, revision_date=rev.date,
+                    date=rev.date, executable=exe, benchmark=b,
+                    environment=self.environment))
+        bulkinsert(Result, results)
+        call_command('backfillsummaries', verbosity=0)
+        call_command('detectchangepoints', verbosity=0)
+        if self.settings.archivedir: call_command('buildarchive', verbosity=0)
+    
+    def measure(self, path, getdata, method='get'):
+        """Returns the number of queries of a request and the best time of
+        TIMINGS requests. The data is fetched for each request, as requests
+        that save results can't be repeated
+        """
+        import time
+        request = getattr(self.client, method)
+        # The first request fills the caches
+        response = request(path, getdata())
+        self.assertEquals(response.status_code, 200, response.content[:200])
+        queries = countqueries(request, path, getdata())
+        best = None
+        for i in range(self.TIMINGS):
+            data = getdata()
+            start = time.time()
+            request(path, data)
+            elapsed = time.time() - start
+            if best is None or elapsed < best: best = elapsed
+        return queries, best
+    
+    def assertScales(self, path, getdata=lambda: {}, method='get', growth=None):
+        """Checks that a view has the same number of queries on the small
+        and the large dataset, and that its time grows at most by "growth"
+        (by default the growth in benchmarks, as most responses list them).
+        The time is compared with a generous factor, so that only a growth
+        with the size of the history fails
+        """
+        if growth is None: growth = float(self.LARGE[0]) / self.SMALL[0]
+        self.seed(self.SMALL)
+        small = self.measure(path, getdata, method)
+        self.seed(self.LARGE)
+        large = self.measure(path, getdata, method)
+        self.assertEquals(large[0], small[0],
+            "%s: %d queries with %s benchmarks and revisions, %d with %s" % (
+                path, small[0], self.SMALL, large[0], self.LARGE))
+        self.assertTrue(large[1] <= 3 * growth * small[1] + 0.1,
+            "%s: %.1fms with %s benchmarks and revisions, %.1fms with %s" % (
+                path, small[1] * 1000, self.SMALL, large[1] * 1000, self.LARGE))
+    
+    def test_changes(self):
+        self.assertScales(reverse('codespeed.views.changes'), lambda: {
+            'rev': self.revisions[-1].commitid, 'exe': self.executables[0].id,
+            'env': self.environment.name})
+    
+    def test_getchangestable(self):
+        self.assertScales(reverse('codespeed.views.getchangestable'), lambda: {
+            'rev': self.revisions[-1].commitid, 'exe': self.executables[0].id,
+            'env': self.environment.name, 'tre': 10})
+    
+    def test_timeline(self):
+        self.assertScales(reverse('codespeed.views.timeline'), lambda: {
+            'exe': self.executables[0].id, 'env': self.environment.name,
+            'ben': self.benchmarks[0].name})
+    
+    def test_gettimelinedata(self):
+        """Also constant in the number of requested points"""
+        path = reverse('codespeed.views.gettimelinedata')
+        exes = ",".join([str(exe.id) for exe in self.executables])
+        self.assertScales(path, lambda: {'exe': exes,
+            'base': 'none', 'env': self.environment.name,
+            'ben': self.benchmarks[0].name, 'revs': len(self.revisions)}, growth=float(self.LARGE[1]) / self.SMALL[1])
+        data = {'exe': exes, 'base': 'none', 'env': self.environment.name,
+            'ben': self.benchmarks[0].name, 'revs': 2}
+        few = self.measure(path, lambda: data)
+        data['revs'] = self.LARGE[1]
+        self.assertEquals(self.measure(path, lambda: data)[0], few[0])
+    
+    def test_gettimelinedata_grid(self):
+        """The grid shows the last 15 results of every benchmark, whatever
+        the requested number of revisions
+        """
+        path = reverse('codespeed.views.gettimelinedata')
+        getdata = lambda: {'exe': self.executables[0].id, 'base': 'none',
+            'env': self.environment.name, 'ben': 'grid', 'revs': len(self.revisions)}
+        self.assertScales(path, getdata,
+            growth=float(self.LARGE[0]) / self.SMALL[0] * 15 / self.SMALL[1])
+        timelines = json.loads(self.client.get(path, getdata()).content)['timelines']
+        self.assertEquals(len(timelines), self.LARGE[0])
+        self.assertEquals(set([len(timeline['executables'][str(self.executables[0].id)])
+            for timeline in timelines]), set([15]))
+    
+    def test_comparison(self):
+        self.assertScales(reverse('codespeed.views.comparison'))
+    
+    def test_getcomparisondata(self):
+        self.assertScales(reverse('codespeed.views.getcomparisondata'))
+    
+    def test_getchangepoints(self):
+        self.assertScales(reverse('codespeed.views.getchangepoints'), lambda: {
+            'env': self.environment.name, 'limit': 20}, growth=1)
+    
+    def test_displaylogs(self):
+        self.assertScales(reverse('codespeed.views.displaylogs'), lambda: {
+            'revisionid': self.revisions[-1].id}, growth=1)
+    
+    def test_getresultexport(self):
+        """Constant in queries; the rows are streamed"""
+        self.assertScales(reverse('codespeed.views.getresultexport'), lambda: {
+            'env': self.environment.name},
+            growth=float(self.LARGE[0] * self.LARGE[1]) / (self.SMALL[0] * self.SMALL[1]))
+    
+    def test_getarchive(self):
+        import tempfile, shutil
+        self.settings.archivedir = tempfile.mkdtemp()
+        try:
+            self.assertScales(reverse('codespeed.views.getarchive'))
+        finally:
+            shutil.rmtree(self.settings.archivedir)
+            self.settings.archivedir = None
+    
+    def test_addresult(self):
+        def getdata():
+            return {'commitid': 'new%d' % Revision.objects.count(),
+                'project': self.project.name, 'executable': self.executables[0].name,
+                'benchmark': self.benchmarks[0].name, 'environment': self.environment.name,
+                'result_value': 1.5}
+        self.assertScales(reverse('codespeed.views.addresult'), getdata,
+            method='post', growth=1)
+    
+    def test_addresults(self):
+        def getdata():
+            return {'json': json.dumps([{'commitid': 'new%d' % Revision.objects.count(),
+                'project': self.project.name, 'executable': exe.name,
+                'benchmark': b.name, 'environment': self.environment.name,
+                'result_value': 1.5}
+                for exe in self.executables for b in self.benchmarks[:4]])}
+        self.assertScales(reverse('codespeed.views.addresults'), getdata,
+            method='post', growth=1)
+
+class Profiling(TestCase):
+    fixtures = ["pypy.json"]
+    
+    def setUp(self):
+        from codespeed import settings as codespeed_settings, profiling
+        self.settings = codespeed_settings
+        self.profiling = profiling
+        self.settings.profiling = True
+        # A new client loads the middleware again
+        self.client = Client()
+        if profiling.requests is not None: profiling.requests.clear()
+    
+    def tearDown(self):
+        self.settings.profiling = False
+    
+    def gettimings(self, response):
+        timings = {}
+        for metric in response['Server-Timing'].split(', '):
+            parts = metric.split(';')
+            timings[parts[0]] = dict([part.split('=', 1) for part in parts[1:]])
+        return timings
+    
+    def test_servertiming(self):
+        """Requests get a Server-Timing header with their query count"""
+        path = reverse('codespeed.views.changes')
+        data = {'rev': '75518', 'exe': '1', 'env': 'tannit'}
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            timings = self.gettimings(self.client.get(path, data))
+            queries = len(connection.queries)
+        finally:
+            settings.DEBUG = False
+        self.assertEquals(timings['sql']['desc'], '"%d queries"' % queries)
+        self.assertEquals(timings['template']['desc'], '"1 renders"')
+        self.assertTrue(float(timings['total']['dur']) >= float(timings['sql']['dur']))
+    
+    def test_vcs(self):
+        """Nested VCS calls are timed once"""
+        from django.http import HttpRequest
+        @self.profiling.timed('vcs')
+        def getlogs(nested):
+            if nested: getlogs(False)
+        profile = self.profiling.Profile(HttpRequest())
+        self.profiling.current.profile = profile
+        try:
+            getlogs(True)
+        finally:
+            self.profiling.current.profile = None
+        self.assertEquals(profile.timers['vcs'][0], 1)
+        # Not timed outside of a request
+        getlogs(True)
+        self.assertEquals(profile.timers['vcs'][0], 1)
+    
+    def test_slowest(self):
+        """Recorded requests are listed slowest first, to staff users only"""
+        from django.contrib.auth.models import User
+        self.client.get(reverse('codespeed.views.getcomparisondata'))
+        self.client.get(reverse('codespeed.views.changes'))
+        path = reverse('codespeed.views.getprofiling')
+        response = self.client.get(path, {'format': 'json'})
+        self.assertFalse('requests' in response.content)
+        User.objects.create_user('staff', 'staff@example.com', 'staff')
+        User.objects.filter(username='staff').update(is_staff=True)
+        self.assertTrue(self.client.login(username='staff', password='staff'))
+        responsedata = json.loads(self.client.get(path, {'format': 'json'}).content)
+        requests = responsedata['requests']
+        self.assertEquals(responsedata['cache'], cache.stats())
+        self.assertEquals(sorted([r['path'] for r in requests
+            if not r['path'].startswith(path)]),
+            [reverse('codespeed.views.changes'),
+            reverse('codespeed.views.getcomparisondata')])
+        totals = [r['total'] for r in requests]
+        self.assertEquals(totals, sorted(totals, reverse=True))
+        self.assertEquals(self.client.get(path).status_code, 200)
+    
+    def test_disabled(self):
+        self.settings.profiling = False
+        response = Client().get(reverse('codespeed.views.getcomparisondata'))
+        self.assertFalse(response.has_header('Server-Timing'))
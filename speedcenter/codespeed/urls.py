@@ -15,9 +15,15 @@ urlpatterns += patterns('codespeed.views',
     (r'^timeline/json/$', 'gettimelinedata'),
     (r'^comparison/$', 'comparison'),
     (r'^comparison/json/$', 'getcomparisondata'),
+    (r'^changepoints/json/$', 'getchangepoints'),
+    (r'^result/samples/$', 'getsamples'),
+    (r'^result/export/$', 'getresultexport'),
+    (r'^result/archive/$', 'getarchive'),
+    (r'^profiling/$', 'getprofiling'),
 )
 
 urlpatterns += patterns('codespeed.views',
     # URL interface for adding results
     (r'^result/add/$', 'addresult'),
+    (r'^result/add/json/$', 'addresults'),
 )
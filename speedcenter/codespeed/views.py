@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 from django.shortcuts import get_object_or_404, render_to_response
 from codespeed.models import Project, Revision, Result, Executable, Benchmark, Environment
+from codespeed.models import ResultSummary, CommitLog, ChangePoint, bulkinsert, bulkupdate
 from django.http import HttpResponse, Http404, HttpResponseNotAllowed, HttpResponseBadRequest, HttpResponseNotFound
-from codespeed import settings
+from codespeed import settings, cache, summaries, metadata, changepoints, samples, archive, profiling
+from django.db import connection, transaction, IntegrityError
+from django.conf import settings as django_settings
+from django.core.exceptions import ValidationError
+from django.contrib.admin.views.decorators import staff_member_required
 from datetime import datetime
 from time import sleep
-import json
+import os, csv, json
+from cStringIO import StringIO
 from itertools import chain
 
 def no_environment_error():
@@ -23,13 +29,22 @@ def no_executables_error():
         'message': 'There needs to be at least one executable'
     })
 
+def getprojectexecutables():
+    """Returns a dict that maps project ids to their executables"""
+    executables = {}
+    for exe in metadata.getall(Executable):
+        executables.setdefault(exe.project_id, []).append(exe)
+    return executables
+
+@cache.memoize
 def getbaselineexecutables():
     baseline = [{'key': "none", 'name': "None", 'executable': "none", 'revision': "none"}]
     revs = Revision.objects.exclude(tag="")
+    executables = getprojectexecutables()
     maxlen = 22
     for rev in revs:
         #add executables that correspond to each tagged revision.
-        for exe in Executable.objects.filter(project=rev.project):
+        for exe in executables.get(rev.project_id, []):
             exestring = str(exe)
             if len(exestring) > maxlen: exestring = str(exe)[0:maxlen] + "..."
             name = exestring + " " + rev.tag
@@ -81,6 +96,25 @@ def getdefaultexecutable():
     
     return default
 
+def getlatestrevisions(projects):
+    """Returns the latest revision of each of the given projects that has
+    any, in one query
+    """
+    qn = connection.ops.quote_name
+    table = qn(Revision._meta.db_table)
+    revs = Revision.objects.filter(
+        project__in=[proj.id for proj in projects]
+    ).extra(where=["%s.%s = (SELECT MAX(latest.%s) FROM %s latest"
+        " WHERE latest.%s = %s.%s)" % (table, qn('date'), qn('date'),
+        table, qn('project_id'), table, qn('project_id'))])
+    latest = {}
+    for rev in revs:
+        # Several revisions may have the latest date
+        if rev.project_id not in latest or rev.id > latest[rev.project_id].id:
+            latest[rev.project_id] = rev
+    return [latest[proj.id] for proj in projects if proj.id in latest]
+
+@cache.memoize
 def getcomparisonexes():
     executables = []
     executablekeys = []
@@ -92,11 +126,11 @@ def getcomparisonexes():
         executables.append(exe)
     
     # add latest revs of tracked projects
-    projects = Project.objects.filter(track=True)
-    for proj in projects:
-        rev = Revision.objects.filter(project=proj).latest('date')
+    projects = [proj for proj in metadata.getall(Project) if proj.track]
+    projectexecutables = getprojectexecutables()
+    for rev in getlatestrevisions(projects):
         if rev.tag == "":
-            for exe in Executable.objects.filter(project=rev.project):
+            for exe in projectexecutables.get(rev.project_id, []):
                 exestring = str(exe)
                 if len(exestring) > maxlen: exestring = str(exe)[0:maxlen] + "..."
                 name = exestring + " latest"
@@ -111,6 +145,10 @@ def getcomparisonexes():
     
     return executables, executablekeys
 
+def comparisonscope(data):
+    return [cache.ALL]
+
+@cache.cached(comparisonscope)
 def getcomparisondata(request):
     if request.method != 'GET': return HttpResponseNotAllowed('GET')
     data = request.GET
@@ -119,21 +157,32 @@ def getcomparisondata(request):
     
     compdata = {}
     compdata['error'] = "Unknown error"
+    environments = metadata.getall(Environment)
+    benchmarks = sorted(metadata.getall(Benchmark), key=lambda bench: bench.name)
+    
+    # Fetch the results for all (executable, revision) pairs in one query,
+    # then pivot them in memory
+    exekeys = {}
+    for exe in executables:
+        pair = (exe['executable'].id, exe['revision'].id)
+        exekeys.setdefault(pair, []).append(exe['key'])
+    values = {}
+    if exekeys:
+        resultquery = Result.objects.filter(
+            executable__in=set([pair[0] for pair in exekeys]),
+            revision__in=set([pair[1] for pair in exekeys])
+        ).values_list('executable', 'revision', 'environment', 'benchmark', 'value')
+        for exe_id, rev_id, env_id, bench_id, value in resultquery:
+            if (exe_id, rev_id) in exekeys:
+                values[(exe_id, rev_id, env_id, bench_id)] = value
+    
     for exe in executables:
         compdata[exe['key']] = {}
-        for env in Environment.objects.all():
+        for env in environments:
             compdata[exe['key']][env.id] = {}
-            for bench in Benchmark.objects.all().order_by('name'):
-                try:
-                    value = Result.objects.get(
-                        environment=env,
-                        executable=exe['executable'],
-                        revision=exe['revision'],
-                        benchmark=bench
-                    ).value
-                except Result.DoesNotExist:
-                    value = None
-                compdata[exe['key']][env.id][bench.id] = value
+            for bench in benchmarks:
+                compdata[exe['key']][env.id][bench.id] = values.get((
+                    exe['executable'].id, exe['revision'].id, env.id, bench.id))
     compdata['error'] = "None"
     
     return HttpResponse(json.dumps( compdata ))
@@ -245,6 +294,121 @@ def comparison(request):
         'selecteddirection': selecteddirection
     })
 
+# Maximum number of bound parameters of the timeline queries
+TIMELINEPARAMS = 900
+
+def gettimelineresults(environment, benchmarks, executables, number_of_rev,
+        start=None, end=None, before=None):
+    """Returns the last number_of_rev results of every (benchmark, executable)
+    series for the given environment as a dict that maps
+    (benchmark id, executable id) to a list of
+    [revision date, value, std_dev, commitid] rows, newest first.
+    Only results with a revision date between start and end are returned,
+    if given. before is a (revision date, revision id) cursor: only older
+    results are returned. It can also be a dict that maps (benchmark id,
+    executable id) to the cursor of each series, and then only those series
+    are returned.
+    Also returns a dict with the cursor of the oldest result of each series
+    that may have older results.
+    The series are fetched with a UNION of per series queries, each limited
+    by an index range scan, so the work does not depend on the history size
+    """
+    series, cursors = {}, {}
+    if not benchmarks or not executables:
+        return series, cursors
+    qn = connection.ops.quote_name
+    columns = ", ".join([
+        "r.%s" % qn('benchmark_id'), "r.%s" % qn('executable_id'),
+        "r.%s" % qn('revision_date'), "r.%s" % qn('value'),
+        "r.%s" % qn('std_dev'), "rev.%s" % qn('commitid'),
+        "r.%s" % qn('revision_id'),
+    ])
+    conditions = ["r.%s = %%s" % qn(column)
+        for column in ['environment_id', 'executable_id', 'benchmark_id']]
+    params = []
+    if start is not None:
+        conditions.append("r.%s >= %%s" % qn('revision_date'))
+        params.append(connection.ops.value_to_db_datetime(start))
+    if end is not None:
+        conditions.append("r.%s <= %%s" % qn('revision_date'))
+        params.append(connection.ops.value_to_db_datetime(end))
+    if before is not None:
+        # Written as a range of the index, which is read backwards from it
+        conditions.append("r.%s <= %%s AND NOT (r.%s = %%s AND r.%s >= %%s)" % (
+            qn('revision_date'), qn('revision_date'), qn('revision_id')))
+    sql = """SELECT * FROM (SELECT %s FROM %s r INNER JOIN %s rev ON r.%s = rev.%s
+        WHERE %s ORDER BY r.%s DESC, r.%s DESC LIMIT %%s) s""" % (
+        columns, qn(Result._meta.db_table), qn(Revision._meta.db_table),
+        qn('revision_id'), qn('id'), " AND ".join(conditions),
+        qn('revision_date'), qn('revision_id'))
+    
+    keys = [(bench, exe) for bench in benchmarks for exe in executables]
+    if isinstance(before, dict):
+        keys = [key for key in keys if key in before]
+    def getparams(bench, exe):
+        values = [environment.id, exe, bench] + params
+        if before is not None:
+            if isinstance(before, dict): date, revision = before[(bench, exe)]
+            else: date, revision = before
+            date = connection.ops.value_to_db_datetime(date)
+            values += [date, date, revision]
+        return values + [number_of_rev]
+    cursor = connection.cursor()
+    rows = []
+    # Databases limit the number of terms of a compound SELECT (500 for
+    # SQLite) and of bound parameters (999 for SQLite before 3.32), so
+    # each query fetches at most 200 series and binds at most TIMELINEPARAMS
+    perseries = 4 + len(params) + (before is not None and 3 or 0)
+    chunksize = min(200, TIMELINEPARAMS // perseries)
+    for i in range(0, len(keys), chunksize):
+        chunk = keys[i:i + chunksize]
+        cursor.execute(" UNION ALL ".join([sql + str(j) for j in range(len(chunk))]),
+            sum([getparams(bench, exe) for bench, exe in chunk], []))
+        rows.extend(cursor.fetchall())
+    
+    for row in rows:
+        date, value, std_dev, commitid, revision = row[2:7]
+        if std_dev is None: std_dev = ""
+        series.setdefault((row[0], row[1]), []).append(
+            (str(date), revision, [str(date), value, std_dev, commitid]))
+    for key in series:
+        results = series[key]
+        results.sort(reverse=True)
+        if len(results) >= number_of_rev:
+            cursors[key] = results[-1][:2]
+        series[key] = [result[2] for result in results]
+    return series, cursors
+
+def downsample(results, points):
+    """Reduces a series to about the given number of points.
+    The series is split in buckets of consecutive results, and the minimum
+    and maximum of each bucket are kept, so that outliers and regressions
+    stay visible. The first and last results are always kept
+    """
+    if len(results) <= max(points, 2):
+        return results
+    buckets = max((points - 2) // 2, 1)
+    inner = results[1:-1]
+    size = float(len(inner)) / buckets
+    sampled = [results[0]]
+    for i in range(buckets):
+        bucket = inner[int(i * size):int((i + 1) * size)]
+        if not bucket: continue
+        values = [res[1] for res in bucket]
+        low = values.index(min(values))
+        high = values.index(max(values))
+        for j in sorted(set([low, high])):
+            sampled.append(bucket[j])
+    sampled.append(results[-1])
+    return sampled
+
+def timelinescope(data):
+    environment = metadata.get(Environment, name=data['env'])
+    projects = [metadata.get(Executable, id=exe).project_id
+        for exe in data['exe'].split(",")]
+    return [(project, environment.id) for project in set(projects)]
+
+@cache.cached(timelinescope)
 def gettimelinedata(request):
     if request.method != 'GET': return HttpResponseNotAllowed('GET')
     data = request.GET
@@ -255,21 +419,76 @@ def gettimelinedata(request):
         timeline_list['error'] = "No executables selected"
         return HttpResponse(json.dumps( timeline_list ))
 
-    environment = Environment.objects.get(name=data['env'])
+    environment = metadata.get(Environment, name=data['env'])
     benchmarks = []
-    number_of_rev = data['revs']
+    number_of_rev = int(data['revs'])
     if data['ben'] == 'grid':
-        benchmarks = Benchmark.objects.all().order_by('name')
+        benchmarks = sorted(metadata.getall(Benchmark), key=lambda bench: bench.name)
         number_of_rev = 15
     else:
-        benchmarks.append(Benchmark.objects.get(name=data['ben']))
+        benchmarks.append(metadata.get(Benchmark, name=data['ben']))
+    
+    # Optional date range, for example to zoom into a part of the timeline
+    daterange = {}
+    for key in ['start', 'end']:
+        if data.get(key):
+            try:
+                daterange[key] = Result._meta.get_field('date').to_python(data[key])
+            except ValidationError:
+                timeline_list['error'] = "Invalid " + key + " date"
+                return HttpResponse(json.dumps( timeline_list ))
+        else:
+            daterange[key] = None
+    # Optional cursor, as returned in the "next" field of a previous
+    # response, to load older results. It has a
+    # "<benchmark id>.<executable id>@<revision date>,<revision id>" position
+    # for each series that has older results, separated by ";".
+    # A "<revision date>,<revision id>" cursor applies to every series
+    def parseposition(position):
+        date, revid = position.rsplit(",", 1)
+        return (Result._meta.get_field('date').to_python(date), int(revid))
+    before = None
+    if data.get('before'):
+        try:
+            if "@" in data['before']:
+                before = {}
+                for part in data['before'].split(";"):
+                    key, position = part.split("@")
+                    bench, exe = key.split(".")
+                    before[(int(bench), int(exe))] = parseposition(position)
+            else:
+                before = parseposition(data['before'])
+        except (ValueError, ValidationError):
+            timeline_list['error'] = "Invalid before cursor"
+            return HttpResponse(json.dumps( timeline_list ))
+    # Maximum number of points per series
+    try:
+        points = int(data.get('points') or 0)
+    except ValueError:
+        timeline_list['error'] = "Invalid points"
+        return HttpResponse(json.dumps( timeline_list ))
     
     baselinerev = None
     baselineexe = None
+    baselinevalues = {}
     if data['base'] != "none" and data['base'] != 'undefined':
         exeid, revid = data['base'].split("+")
         baselinerev = Revision.objects.get(id=revid)
-        baselineexe = Executable.objects.get(id=exeid)
+        baselineexe = metadata.get(Executable, id=exeid)
+        baselinevalues = dict(Result.objects.filter(
+            executable=baselineexe,
+            revision=baselinerev,
+            environment=environment,
+            benchmark__in=benchmarks
+        ).values_list('benchmark', 'value'))
+    
+    exeids = dict([(int(exe), exe) for exe in executables])
+    series, cursors = gettimelineresults(
+        environment, [bench.id for bench in benchmarks], exeids.keys(),
+        number_of_rev, daterange['start'], daterange['end'], before)
+    if points > 0:
+        for key in series:
+            series[key] = downsample(series[key], points)
     for bench in benchmarks:
         append = False
         timeline = {}
@@ -281,36 +500,25 @@ def gettimelinedata(request):
         timeline['lessisbetter'] = lessisbetter
         timeline['executables'] = {}
         timeline['baseline'] = "None"
+        # Cursor to request the previous page of results, with the position
+        # of every series that may have older results. The complete series
+        # are left out, so that no results are returned twice
+        positions = []
         
-        for executable in executables:
-            resultquery = Result.objects.filter(
-                    benchmark=bench
-                ).filter(
-                    environment=environment
-                ).filter(
-                    executable=executable
-                ).order_by('-revision__date')[:number_of_rev]
-            if not len(resultquery): continue
-            results = []
-            for res in resultquery:
-                std_dev = ""
-                if res.std_dev != None: std_dev = res.std_dev
-                results.append(
-                    [str(res.revision.date), res.value, std_dev, res.revision.commitid]
-                )
+        for exeid, executable in exeids.items():
+            results = series.get((bench.id, exeid))
+            if not results: continue
             timeline['executables'][executable] = results
             append = True
+            if (bench.id, exeid) in cursors:
+                positions.append("%d.%d@%s,%s" % (
+                    (bench.id, exeid) + tuple(cursors[(bench.id, exeid)])))
+        timeline['next'] = positions and ";".join(positions) or None
         if baselinerev != None and append:
-            try:
-                baselinevalue = Result.objects.get(
-                    executable=baselineexe,
-                    benchmark=bench,
-                    revision=baselinerev,
-                    environment=environment
-                ).value
-            except Result.DoesNotExist:
+            if bench.id not in baselinevalues:
                 timeline['baseline'] = "None"
             else:
+                baselinevalue = baselinevalues[bench.id]
                 # determine start and end revision (x axis) from longest data series
                 results = []
                 for exe in timeline['executables']:
@@ -400,97 +608,382 @@ def timeline(request):
         'environments': environments
     })
 
+def changepointsscope(data):
+    return [cache.ALL]
+
+@cache.cached(changepointsscope)
+def getchangepoints(request):
+    """Returns the latest change points found in the result series as JSON,
+    newest first. They can be filtered by executable id (exe), benchmark
+    name (ben) and environment name (env)
+    """
+    if request.method != 'GET': return HttpResponseNotAllowed('GET')
+    data = request.GET
+    
+    points = ChangePoint.objects.all()
+    try:
+        if data.get('exe'):
+            points = points.filter(result__executable=metadata.get(Executable, id=data['exe']))
+        if data.get('ben'):
+            points = points.filter(result__benchmark=metadata.get(Benchmark, name=data['ben']))
+        if data.get('env'):
+            points = points.filter(result__environment=metadata.get(Environment, name=data['env']))
+        limit = int(data.get('limit') or 50)
+    except (ValueError, Executable.DoesNotExist, Benchmark.DoesNotExist,
+            Environment.DoesNotExist):
+        return HttpResponseBadRequest("Invalid executable, benchmark, environment or limit")
+    
+    feed = []
+    for exe, bench, env, commitid, date, before, after, change in points.order_by(
+            '-result__revision_date', '-id'
+        ).values_list('result__executable', 'result__benchmark', 'result__environment',
+            'result__revision__commitid', 'result__revision_date', 'before', 'after',
+            'change')[:limit]:
+        exe = metadata.get(Executable, id=exe)
+        bench = metadata.get(Benchmark, id=bench)
+        if bench.lessisbetter: regression = after > before
+        else: regression = after < before
+        feed.append({
+            'executable': exe.name,
+            'executable_id': exe.id,
+            'benchmark': bench.name,
+            'environment': metadata.get(Environment, id=env).name,
+            'commitid': commitid,
+            'revision_date': str(date),
+            'before': before,
+            'after': after,
+            'change': change,
+            'regression': regression,
+        })
+    return HttpResponse(json.dumps({'error': 'None', 'changepoints': feed}))
+
+def getsamples(request):
+    """Returns the raw samples of a result, given by executable id (exe),
+    benchmark name (ben), environment name (env) and commitid (rev).
+    They are sent as stored: little-endian float64 values. With format=json,
+    their statistics are returned as JSON instead
+    """
+    if request.method != 'GET': return HttpResponseNotAllowed('GET')
+    data = request.GET
+
+    try:
+        exe = metadata.get(Executable, id=data['exe'])
+        bench = metadata.get(Benchmark, name=data['ben'])
+        env = metadata.get(Environment, name=data['env'])
+    except (KeyError, ValueError, Executable.DoesNotExist, Benchmark.DoesNotExist,
+            Environment.DoesNotExist):
+        return HttpResponseBadRequest("Invalid executable, benchmark or environment")
+    # Only the samples column is read
+    rows = Result.objects.filter(executable=exe, benchmark=bench, environment=env,
+        revision__project=exe.project_id, revision__commitid=data.get('rev')
+    ).values_list('samples', flat=True)[:1]
+    if not rows or rows[0] is None:
+        return HttpResponseNotFound("No samples found")
+    # The database adapter may return a buffer
+    packed = str(rows[0])
+
+    if data.get('format') == 'json':
+        values = samples.unpack(packed)
+        return HttpResponse(json.dumps({
+            'error': 'None',
+            'stats': samples.getstats(values),
+            'samples': [float(v) for v in values],
+        }))
+    response = HttpResponse(packed, mimetype='application/octet-stream')
+    response['Content-Length'] = len(packed)
+    response['X-Samples-Format'] = '<f8'
+    return response
+
+# Rows read from the database at a time when exporting results
+EXPORTCHUNK = 1000
+EXPORTCOLUMNS = ['project', 'executable', 'benchmark', 'environment',
+    'commitid', 'revision_date', 'value', 'std_dev', 'val_min', 'val_max', 'date']
+
+def getexportcursor():
+    """Returns a cursor that doesn't load the whole result of a query in
+    memory: a named (server-side) cursor on PostgreSQL and an unbuffered one
+    on MySQL. SQLite cursors already read the rows as they are fetched
+    """
+    cursor = connection.cursor()
+    engine = django_settings.DATABASE_ENGINE
+    if engine == 'postgresql_psycopg2':
+        return connection.connection.cursor('codespeed_export')
+    elif engine == 'mysql':
+        import MySQLdb.cursors
+        return connection.connection.cursor(MySQLdb.cursors.SSCursor)
+    return cursor
+
+def csvvalue(value):
+    '''Encodes a value for the csv module, which writes floats with str()
+    and so rounds them to 12 digits
+    '''
+    if isinstance(value, unicode): return value.encode('utf-8')
+    if isinstance(value, float): return repr(value)
+    return value
+
+def exportresults(sql, params, format):
+    """Generates the export of the results returned by the query, in chunks
+    of EXPORTCHUNK rows, so that only one chunk is in memory at a time
+    """
+    cursor = getexportcursor()
+    try:
+        cursor.execute(sql, params)
+        if format == 'csv':
+            yield ",".join(EXPORTCOLUMNS) + "\r\n"
+        while True:
+            rows = cursor.fetchmany(EXPORTCHUNK)
+            if not rows: break
+            output = StringIO()
+            writer = csv.writer(output)
+            for exe, bench, env, commitid, revdate, value, std_dev, val_min, val_max, date in rows:
+                exe = metadata.get(Executable, id=exe)
+                row = [exe.project.name, exe.name, metadata.get(Benchmark, id=bench).name,
+                    metadata.get(Environment, id=env).name, commitid,
+                    revdate and str(revdate), value, std_dev, val_min, val_max,
+                    date and str(date)]
+                if format == 'csv':
+                    writer.writerow([csvvalue(v) for v in row])
+                else:
+                    output.write(json.dumps(dict(zip(EXPORTCOLUMNS, row))) + "\n")
+            yield output.getvalue()
+    finally:
+        cursor.close()
+
+def getresultexport(request):
+    """Streams results as CSV (format=csv, the default) or as one JSON object
+    per line (format=ndjson). They can be filtered by project name (project),
+    executable ids (exe), benchmark names (ben) and environment names (env),
+    all comma separated, and by revision date (start and end)
+    """
+    if request.method != 'GET': return HttpResponseNotAllowed('GET')
+    data = request.GET
+    format = data.get('format', 'csv')
+    if format not in ('csv', 'ndjson'):
+        return HttpResponseBadRequest("Invalid format")
+    
+    qn = connection.ops.quote_name
+    conditions, params = [], []
+    try:
+        executables = None
+        if data.get('project'):
+            project = metadata.get(Project, name=data['project'])
+            executables = [exe.id for exe in metadata.getall(Executable)
+                if exe.project_id == project.id]
+        if data.get('exe'):
+            ids = [metadata.get(Executable, id=exe).id for exe in data['exe'].split(",")]
+            if executables is not None:
+                ids = [exe for exe in ids if exe in executables]
+            executables = ids
+        filters = [('executable_id', executables)]
+        if data.get('ben'):
+            filters.append(('benchmark_id', [metadata.get(Benchmark, name=name).id
+                for name in data['ben'].split(",")]))
+        if data.get('env'):
+            filters.append(('environment_id', [metadata.get(Environment, name=name).id
+                for name in data['env'].split(",")]))
+        for column, ids in filters:
+            if ids is None: continue
+            # An empty list matches nothing
+            ids = ids or [0]
+            conditions.append("r.%s IN (%s)" % (qn(column), ", ".join(["%s"] * len(ids))))
+            params += ids
+        datefield = Result._meta.get_field('revision_date')
+        for key, operator in [('start', '>='), ('end', '<=')]:
+            if data.get(key):
+                conditions.append("r.%s %s %%s" % (qn('revision_date'), operator))
+                params.append(datefield.get_db_prep_value(datefield.to_python(data[key])))
+    except (ValueError, ValidationError, Project.DoesNotExist, Executable.DoesNotExist,
+            Benchmark.DoesNotExist, Environment.DoesNotExist):
+        return HttpResponseBadRequest(
+            "Invalid project, executable, benchmark, environment or date")
+    
+    # Ordered like the series index, so that no sort is needed
+    sql = ("SELECT r.%s, r.%s, r.%s, rev.%s, r.%s, r.%s, r.%s, r.%s, r.%s, r.%s"
+        " FROM %s r INNER JOIN %s rev ON rev.%s = r.%s" % (
+        qn('executable_id'), qn('benchmark_id'), qn('environment_id'),
+        qn('commitid'), qn('revision_date'), qn('value'), qn('std_dev'),
+        qn('val_min'), qn('val_max'), qn('date'), qn(Result._meta.db_table),
+        qn(Revision._meta.db_table), qn('id'), qn('revision_id')))
+    if conditions: sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY r.%s, r.%s, r.%s, r.%s, r.%s" % (qn('benchmark_id'),
+        qn('environment_id'), qn('executable_id'), qn('revision_date'), qn('id'))
+    
+    if format == 'csv': mimetype = 'text/csv; charset=utf-8'
+    else: mimetype = 'application/x-ndjson'
+    response = HttpResponse(exportresults(sql, params, format), mimetype=mimetype)
+    response['Content-Disposition'] = 'attachment; filename=results.' + format
+    return response
+
+def getarchive(request):
+    """Returns the index of the columnar archive as JSON or, given executable
+    id (exe), benchmark name (ben), environment name (env) and column, the
+    .npy file of a column of a series
+    """
+    if request.method != 'GET': return HttpResponseNotAllowed('GET')
+    data = request.GET
+    if archive.getarchivedir() is None:
+        return HttpResponseNotFound("The archive is disabled")
+    if not data.get('column'):
+        return HttpResponse(json.dumps({'error': 'None', 'series': archive.getindex()}))
+    
+    try:
+        key = (metadata.get(Executable, id=data['exe']).id,
+            metadata.get(Benchmark, name=data['ben']).id,
+            metadata.get(Environment, name=data['env']).id)
+    except (KeyError, ValueError, Executable.DoesNotExist, Benchmark.DoesNotExist,
+            Environment.DoesNotExist):
+        return HttpResponseBadRequest("Invalid executable, benchmark or environment")
+    if data['column'] not in dict(archive.COLUMNS):
+        return HttpResponseBadRequest("Invalid column")
+    path = archive.getseriesdir(key)
+    filename = os.path.join(path, data['column'] + '.npy')
+    if not os.path.exists(filename):
+        return HttpResponseNotFound("Series not archived")
+    # Read while locked, so that no half appended file is sent
+    lock = archive.lock(path)
+    try:
+        f = open(filename, 'rb')
+        try:
+            content = f.read()
+        finally:
+            f.close()
+    finally:
+        archive.unlock(lock)
+    response = HttpResponse(content, mimetype='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename=' + data['column'] + '.npy'
+    return response
+
+def getprofiling(request):
+    """Lists the recent requests recorded by the profiling middleware,
+    slowest first, and the response cache statistics, as a table or, with
+    format=json, as JSON
+    """
+    requests = profiling.getslowest()
+    enabled = getattr(settings, 'profiling', False)
+    cachestats = cache.stats()
+    if request.GET.get('format') == 'json':
+        return HttpResponse(json.dumps({'error': 'None', 'enabled': enabled,
+            'requests': requests, 'cache': cachestats}))
+    return render_to_response('codespeed/profiling.html', {
+        'enabled': enabled, 'requests': requests, 'cache': cachestats})
+getprofiling = staff_member_required(getprofiling)
+
+def getchanges(lastrevision, executable, environment, trendconfig, results):
+    """Calculates the change and trend of the given results of lastrevision,
+    for when they have no precomputed summaries.
+    Returns a dict that maps each benchmark id to a (change, trend) tuple
+    """
+    # Same order as the precomputed summaries (see summaries.getrevisionwindow),
+    # so that both agree when revision dates are the same
+    lastrevisions = [lastrevision] + list(Revision.objects.filter(
+        project=executable.project
+    ).filter(
+        date__lte=lastrevision.date
+    ).exclude(id=lastrevision.id).order_by('-date', '-id')[:trendconfig])
+    if len(lastrevisions) < 2:
+        return dict([(bench, (None, None)) for bench in results])
+    changerevision = lastrevisions[1]
+    pastrevisions = lastrevisions[trendconfig-2:trendconfig+1]
+
+    # Fetch the results of the previous and the past revisions in one query
+    revisions = set([changerevision.id] + [rev.id for rev in pastrevisions])
+    pastresults = dict([((row[0], row[1]), row[2]) for row in Result.objects.filter(
+            revision__in=revisions
+        ).filter(
+            environment=environment
+        ).filter(
+            executable=executable
+        ).values_list('revision', 'benchmark', 'value')])
+
+    benchlist = results.keys()
+    changes, trends = summaries.calculatechanges(
+        [results[bench][0] for bench in benchlist],
+        [pastresults.get((changerevision.id, bench)) for bench in benchlist],
+        [[pastresults.get((rev.id, bench)) for rev in pastrevisions]
+            for bench in benchlist])
+    return dict(zip(benchlist, zip(changes, trends)))
+
+def changestablescope(data):
+    executable = metadata.get(Executable, id=data['exe'])
+    environment = metadata.get(Environment, name=data['env'])
+    return [(executable.project_id, environment.id)]
+
+@cache.cached(changestablescope)
 def getchangestable(request):
     data = request.GET
     
-    executable = Executable.objects.get(id=int(data['exe']))
-    environment = Environment.objects.get(name=data['env'])
+    executable = metadata.get(Executable, id=data['exe'])
+    environment = metadata.get(Environment, name=data['env'])
     trendconfig = int(data['tre'])
     selectedrev = Revision.objects.get(
         commitid=data['rev'], project=executable.project
     )
-    date = selectedrev.date
-    lastrevisions = Revision.objects.filter(
+    lastrevision = Revision.objects.filter(
         project=executable.project
     ).filter(
-        date__lte=date
-    ).order_by('-date')[:trendconfig+1]
-    lastrevision = lastrevisions[0]
-
-    change_list = []
-    pastrevisions = []
-    if len(lastrevisions) > 1:
-        changerevision = lastrevisions[1]
-        change_list = Result.objects.filter(
-            revision=changerevision
+        date__lte=selectedrev.date
+    ).order_by('-date', '-id')[0]
+
+    results = {}
+    for row in Result.objects.filter(
+            revision=lastrevision
         ).filter(
             environment=environment
         ).filter(
             executable=executable
-        )
-        pastrevisions = lastrevisions[trendconfig-2:trendconfig+1]
+        ).values_list('benchmark', 'value', 'std_dev', 'val_min', 'val_max'):
+        results[row[0]] = row[1:]
 
-    result_list = Result.objects.filter(
-        revision=lastrevision
-    ).filter(
-        environment=environment
-    ).filter(
-        executable=executable
-    )
+    # Use the precomputed changes and trends if all results have them
+    changes = {}
+    if trendconfig in summaries.TRENDS:
+        for bench, previous, change, average in ResultSummary.objects.filter(
+                result__revision=lastrevision,
+                result__environment=environment,
+                result__executable=executable
+            ).values_list('result__benchmark', 'previous', 'change',
+                'average%d' % trendconfig):
+            value = results[bench][0]
+            if change is not None: change = (change, value / previous)
+            trend = None
+            if average is not None: trend = ((value - average)*100/average, value / average)
+            changes[bench] = (change, trend)
+    if len(changes) < len(results):
+        changes = getchanges(lastrevision, executable, environment, trendconfig, results)
+
+    benchmarks = {}
+    unitslist = []
+    for bench in metadata.getall(Benchmark):
+        if bench.units not in benchmarks: unitslist.append({'units': bench.units})
+        benchmarks.setdefault(bench.units, []).append(bench)
 
     tablelist = []
-    for units in Benchmark.objects.all().values('units').distinct():
-        currentlist = []
+    for units in unitslist:
         units_title = ""
         hasmin = False
         hasmax = False
         smallest = 1000
         totals = {'change': [], 'trend': [],}
-        for bench in Benchmark.objects.filter(units=units['units']):
+        currentlist = []
+        for bench in benchmarks.get(units['units'], []):
             units_title = bench.units_title
             lessisbetter = bench.lessisbetter
-            resultquery = result_list.filter(benchmark=bench)
-            if not len(resultquery): continue
-            resobj = resultquery.filter(benchmark=bench)[0]
-            std_dev = resobj.std_dev
-            result = resobj.value
-            val_min = resobj.val_min
+            if bench.id not in results: continue
+            result, std_dev, val_min, val_max = results[bench.id]
+            change, trend = changes[bench.id]
             if val_min is not None: hasmin = True
             else: val_min = "-"
-            val_max = resobj.val_max
             if val_max is not None: hasmax = True
             else: val_max = "-"
             
-            # Calculate percentage change relative to previous result
-            change = "-"
-            if len(change_list):
-                c = change_list.filter(benchmark=bench)
-                if c.count() and c[0].value and result:
-                    change = (result - c[0].value)*100/c[0].value
-                    totals['change'].append(result / c[0].value)
-            
-            # Calculate trend:
-            # percentage change relative to average of 3 previous results
-            # Calculate past average
-            average = 0
-            averagecount = 0
-            if len(pastrevisions):
-                for rev in pastrevisions:
-                    past_rev = Result.objects.filter(
-                        revision=rev
-                    ).filter(
-                        environment=environment
-                    ).filter(
-                        executable=executable
-                    ).filter(benchmark=bench)
-                    if past_rev.count():
-                        average += past_rev[0].value
-                        averagecount += 1
-            trend = "-"
-            if average:
-                average = average / averagecount
-                trend =  (result - average)*100/average
-                totals['trend'].append(result / average)
+            if change is None: change = "-"
+            else:
+                change, ratio = change
+                totals['change'].append(ratio)
+            if trend is None: trend = "-"
+            else:
+                trend, ratio = trend
+                totals['trend'].append(ratio)
             
             # Retain lowest number different than 0
             # to be used later for calculating significant digits
@@ -558,7 +1051,7 @@ def changes(request):
     defaultchangethres = 3
     defaulttrendthres = 3
     defaulttrend = 10
-    trends = [5, 10, 20, 50, 100]
+    trends = summaries.TRENDS
     if 'tre' in data and int(data['tre']) in trends:
         defaulttrend = int(data['tre'])
     
@@ -641,62 +1134,173 @@ def changes(request):
 
 def displaylogs(request):
     rev = Revision.objects.get(id=request.GET['revisionid'])
-    logs = []
-    logs.append(rev)
     error = False
-    try:
-        startrev = Revision.objects.filter(
-            project=rev.project
-        ).filter(date__lt=rev.date).order_by('-date')[:1]
-        if not len(startrev): startrev = rev
-        else: startrev = startrev[0]
-        remotelogs = getcommitlogs(rev, startrev)
-        if len(remotelogs):
-            try:
-                if remotelogs[0]['error']:
-                    error = remotelogs[0]['message']
-            except KeyError:
-                pass#no errors
-            logs = remotelogs
-        else: error = 'no logs found'
-    except Exception, e:
-        error = str(e)
+    logs = getstoredlogs(rev)
+    if not len(logs) and not rev.pending and getvcs(rev.project) is not None:
+        # Revisions saved with their date are never pending, so their logs
+        # are fetched and stored the first time they are shown
+        try:
+            result = savecommitlogs(rev, getpreviousrevision(rev), True)
+        except Exception, e:
+            result = str(e)
+        if isinstance(result, basestring): error = result
+        else: logs = getstoredlogs(rev)
+    if not len(logs) and not error: error = 'no logs found'
     return render_to_response('codespeed/changes_logs.html', { 'error': error, 'logs': logs })
 
+def getpreviousrevision(rev):
+    """Returns the previous revision of the same project, or rev itself if
+    it is the first one
+    """
+    startrev = Revision.objects.filter(
+        project=rev.project
+    ).filter(date__lt=rev.date).order_by('-date')[:1]
+    if not len(startrev): return rev
+    return startrev[0]
+
+def getstoredlogs(rev):
+    """Returns the stored commit logs between the previous revision and the
+    given revision, newest first
+    """
+    logs = CommitLog.objects.filter(
+        project=rev.project, date__lte=rev.date
+    ).order_by('-date')
+    startrev = getpreviousrevision(rev)
+    if startrev == rev:
+        # Show only the log of the revision itself
+        return list(logs[:1])
+    return list(logs.filter(date__gt=startrev.date)[:200])
+
+def getvcs(project):
+    """Returns the module that implements the VCS integration of the
+    project, or None
+    """
+    if project.repo_type == 'N' or project.repo_path == "":
+        return None
+    elif project.repo_type == 'S':
+        import subversion as vcs
+    elif project.repo_type == 'M':
+        import mercurial as vcs
+    elif project.repo_type == 'G':
+        import git as vcs
+    else:
+        return None
+    return vcs
+
 def getcommitlogs(rev, startrev, update=False):
-    logs = []    
-    if rev.project.repo_type == 'N' or rev.project.repo_path == "":
+    vcs = getvcs(rev.project)
+    if vcs is None:
         #Don't fetch logs
-        pass
-    else:
-        if rev.project.repo_type == 'S':
-            from subversion import getlogs, updaterepo
-        elif rev.project.repo_type == 'M':
-            from mercurial import getlogs, updaterepo
-        
-        if update:
-            resp = updaterepo(rev.project.repo_path)
-            if resp.get('error'):
-                return resp
-        logs = getlogs(rev, startrev)
-    
-    return logs
-
-def saverevisioninfo(rev):
-    log = getcommitlogs(rev, rev, update=True)
-    if len(log):
-        log = log[0]
-        rev.author  = log['author']
-        rev.date    = log['date']
+        return []
+    if update:
+        resp = vcs.updaterepo(rev.project.repo_path)
+        if resp[0].get('error'):
+            return resp
+    return vcs.getlogs(rev, startrev)
+
+def savecommitlogs(rev, startrev, update=False):
+    """Fetches the commit logs between startrev and rev from the VCS and
+    stores the ones that are not stored yet.
+    Returns the number of stored logs, or the VCS error message
+    """
+    logs = getcommitlogs(rev, startrev, update)
+    if len(logs) and logs[0].get('error'):
+        return logs[0]['message']
+    commitlogs = {}
+    for log in logs:
+        commitid = unicode(log['commitid'])
+        commitlogs[commitid] = CommitLog(
+            project=rev.project, commitid=commitid, date=log['date'],
+            author=log['author'][:100], message=log['message'])
+    for commitid in CommitLog.objects.filter(
+            project=rev.project, commitid__in=commitlogs.keys()
+        ).values_list('commitid', flat=True):
+        del commitlogs[commitid]
+    bulkinsert(CommitLog, commitlogs.values())
+    return len(commitlogs)
+
+def getrevisionsinfo(project, revisions):
+    """Fetches the commit logs of the given revisions of a project from its
+    VCS, after updating the repository.
+    Returns a dict that maps revision ids to their log, and a dict that
+    maps the ids of the revisions whose log could not be fetched to the error
+    """
+    vcs = getvcs(project)
+    logs, errors = {}, {}
+    try:
+        resp = vcs.updaterepo(project.repo_path)
+        if resp[0].get('error'):
+            raise Exception(resp[0]['message'])
+        if hasattr(vcs, 'getcommits'):
+            # All commits can be read in one pass
+            commits = vcs.getcommits(project.repo_path, [rev.commitid for rev in revisions])
+            for rev in revisions:
+                if rev.commitid in commits: logs[rev.id] = commits[rev.commitid]
+        else:
+            for rev in revisions:
+                log = vcs.getlogs(rev, rev)
+                if len(log) and log[0].get('error'):
+                    errors[rev.id] = log[0]['message']
+                elif len(log):
+                    logs[rev.id] = log[0]
+    except Exception, e:
+        for rev in revisions:
+            errors[rev.id] = str(e)
+    for rev in revisions:
+        if rev.id not in logs and rev.id not in errors:
+            errors[rev.id] = "Commit not found in the repository"
+    return logs, errors
+
+def saverevisioninfo(project, revisions):
+    """Saves the author, date and message of the given pending revisions of
+    a project, fetched from its VCS, together with the commit logs since the
+    previous revision.
+    Revisions whose info could not be fetched stay pending, and their error
+    and number of attempts are saved.
+    Returns the number of updated revisions
+    """
+    if getvcs(project) is None:
+        # The VCS integration was disabled, don't try anymore
+        Revision.objects.filter(id__in=[rev.id for rev in revisions]).update(pending=False)
+        return 0
+    logs, errors = getrevisionsinfo(project, revisions)
+    for rev in revisions:
+        if rev.id in errors:
+            Revision.objects.filter(id=rev.id).update(
+                attempts=rev.attempts + 1, error=errors[rev.id])
+            continue
+        log = logs[rev.id]
+        olddate = rev.date
+        # The revision that followed it before the date changed
+        following = Revision.objects.filter(
+            project=project, date__gt=rev.date
+        ).order_by('date', 'id')[:1]
+        rev.author  = log['author'][:30]
+        rev.date    = Revision._meta.get_field('date').to_python(log['date'])
         rev.message = log['message']
-    else:
-        rev.date = datetime.now()
+        rev.pending = False
+        rev.error   = ""
+        # Also updates the revision date of its results
+        rev.save()
+        # The revision may have moved, so update the summaries of the results
+        # around its new and old positions
+        summaries.updaterevisionsummaries(rev, True)
+        if len(following):
+            summaries.updaterevisionsummaries(following[0], True)
+        # and reorder its results in the archive
+        if rev.date != olddate:
+            archive.updaterevision(rev)
+        # Store the commits since the previous revision for the changes view
+        try:
+            savecommitlogs(rev, getpreviousrevision(rev))
+        except Exception:
+            pass
+    return len(logs)
 
-def addresult(request):
-    if request.method != 'POST':
-        return HttpResponseNotAllowed('POST')
-    data = request.POST
-    
+def validate_result(data):
+    """Returns an error message if the given result data is not valid,
+    None otherwise
+    """
     mandatory_data = [
         'commitid',
         'project',
@@ -708,43 +1312,107 @@ def addresult(request):
     
     for key in mandatory_data:
         if not key in data:
-            return HttpResponseBadRequest('Key "' + key + '" missing from request')
+            return 'Key "' + key + '" missing from request'
         elif key in data and data[key] == "":
-            return HttpResponseBadRequest('Key "' + key + '" empty in request')
+            return 'Key "' + key + '" empty in request'
+    return None
 
-    # Check that Environment exists
-    try:
-        e = get_object_or_404(Environment, name=data['environment'])
-    except Http404:
-        return HttpResponseNotFound("Environment " + data["environment"] + " not found")
-    
-    p, created = Project.objects.get_or_create(name=data["project"])
-    b, created = Benchmark.objects.get_or_create(name=data["benchmark"])
-    
+def getrevision(data, project):
+    """Gets or creates the revision for the given result data.
+    New revisions get their date from the request, or the current date until
+    their VCS info is fetched
+    """
     rev, created = Revision.objects.get_or_create(
         commitid=data['commitid'],
-        project=p,
+        project=project,
     )
     if created:
         if 'revision_date' in data: rev.date = data["revision_date"]
         else:
-            try:
-                saverevisioninfo(rev)
-            except:
-                pass
+            # The VCS info is fetched later by the fetchrevisioninfo command,
+            # so that saving results never waits for the repository
+            rev.pending = getvcs(project) is not None
         if not rev.date:
+            # Provisional date
             temp = datetime.today()
             rev.date = datetime(temp.year, temp.month, temp.day, temp.hour, temp.minute, temp.second)
 
         rev.save()
+        summaries.updaterevisionsummaries(rev)
+    return rev
+
+def setsamples(result, data, values):
+    """Stores the raw samples of the result data, parsed with samples.parse,
+    in the result, and derives the statistics that were not given from them
+    """
+    result.samples = samples.pack(values)
+    stats = samples.getstats(values)
+    for name, field in [('std_dev', 'std_dev'), ('min', 'val_min'), ('max', 'val_max')]:
+        if data.get(name) in (None, ""):
+            setattr(result, field, stats[name])
+
+# Number of times saving results is tried when it conflicts with a
+# concurrent transaction
+SAVEATTEMPTS = 3
+
+def retryconflicts(func, *args):
+    """Calls func in a transaction, which is committed when it returns and
+    rolled back when it raises an exception. It is retried when it fails
+    because a concurrent transaction inserted the same rows, like the
+    summaries of results of the same series
+    """
+    for attempt in range(SAVEATTEMPTS):
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            try:
+                value = func(*args)
+            except Exception, e:
+                if transaction.is_dirty():
+                    transaction.rollback()
+                    # Metadata created in the rolled back transaction may
+                    # have been cached
+                    metadata.invalidate()
+                if not isinstance(e, IntegrityError) or attempt == SAVEATTEMPTS - 1:
+                    raise
+            else:
+                if transaction.is_dirty():
+                    transaction.commit()
+                return value
+        finally:
+            transaction.leave_transaction_management()
+
+def storeresult(data):
+    """Stores the data of a single result.
+    Returns the saved Result, or an error response
+    """
+    # Check that Environment exists
+    try:
+        e = metadata.get(Environment, name=data['environment'])
+    except Environment.DoesNotExist:
+        return HttpResponseNotFound("Environment " + data["environment"] + " not found")
+    # Validated before any row is created
+    values = None
+    if data.get('samples'):
+        try:
+            values = samples.parse(data['samples'])
+        except ValueError, error:
+            return HttpResponseBadRequest("Invalid samples: " + str(error))
+    
+    p, created = metadata.get_or_create(Project, name=data["project"])
+    b, created = metadata.get_or_create(Benchmark, name=data["benchmark"])
+    
+    rev = getrevision(data, p)
     
-    exe, created = Executable.objects.get_or_create(
+    exe, created = metadata.get_or_create(Executable,
         name=data['executable'],
         project=p
     )
     
     try:
         r = Result.objects.get(revision=rev,executable=exe,benchmark=b,environment=e)
+        # Reuse the cached executable instead of querying it again
+        r.executable = exe
     except Result.DoesNotExist:
         r = Result(revision=rev,executable=exe,benchmark=b,environment=e)
     r.value = data["result_value"]    
@@ -753,6 +1421,162 @@ def addresult(request):
     if 'std_dev' in data: r.std_dev = data['std_dev']
     if 'min' in data: r.val_min = data['min']
     if 'max' in data: r.val_max = data['max']
+    if values is not None: setsamples(r, data, values)
     r.save()
+    summaries.updatesummaries([r])
+    changepoints.updatechangepoints([r])
+    return r
+
+def addresult(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed('POST')
+    data = request.POST
+    
+    error = validate_result(data)
+    if error:
+        return HttpResponseBadRequest(error)
+    
+    r = retryconflicts(storeresult, data)
+    if isinstance(r, HttpResponse):
+        return r
+    # Only invalidate once the transaction has been commited, so that
+    # no response is cached with the old data
+    cache.invalidate(r.executable.project_id, r.environment_id)
+    archive.updatearchive([r])
     
     return HttpResponse("Result data saved succesfully")
+
+def storeresults(items):
+    """Stores a list of result data dicts.
+    Projects, benchmarks, executables and revisions are resolved once per
+    distinct name, and Result rows are written in bulk.
+    Returns a status dict for each item, in the same order, and the list of
+    saved Result objects
+    """
+    statuses = [{'status': 'saved'} for item in items]
+    valid = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            error = 'Result data must be an object'
+        else:
+            error = validate_result(item)
+        if error:
+            statuses[i] = {'status': 'error', 'message': error}
+        else:
+            valid.append((i, item))
+    
+    revisions = {}
+    results = {}
+    for i, item in valid:
+        try:
+            e = metadata.get(Environment, name=item['environment'])
+        except Environment.DoesNotExist:
+            statuses[i] = {'status': 'error',
+                'message': "Environment " + item["environment"] + " not found"}
+            continue
+        values = None
+        if item.get('samples'):
+            try:
+                values = samples.parse(item['samples'])
+            except ValueError, error:
+                statuses[i] = {'status': 'error', 'message': "Invalid samples: " + str(error)}
+                continue
+        p, created = metadata.get_or_create(Project, name=item["project"])
+        b, created = metadata.get_or_create(Benchmark, name=item["benchmark"])
+        key = (p.id, item['commitid'])
+        if key not in revisions:
+            revisions[key] = getrevision(item, p)
+        rev = revisions[key]
+        exe, created = metadata.get_or_create(Executable,
+            name=item['executable'],
+            project=p
+        )
+        
+        r = Result(revision=rev,executable=exe,benchmark=b,environment=e)
+        r.revision_date = rev.date
+        try:
+            r.value = float(item["result_value"])
+            for name, field in [('std_dev', 'std_dev'), ('min', 'val_min'), ('max', 'val_max')]:
+                if item.get(name) not in (None, ""):
+                    setattr(r, field, float(item[name]))
+        except (TypeError, ValueError):
+            statuses[i] = {'status': 'error', 'message': "Invalid numeric value"}
+            continue
+        if values is not None: setsamples(r, item, values)
+        if 'result_date' in item:
+            try:
+                r.date = Result._meta.get_field('date').to_python(item["result_date"])
+            except ValidationError:
+                statuses[i] = {'status': 'error', 'message': "Invalid result date"}
+                continue
+        else: r.date = rev.date
+        # A later item for the same result overrides an earlier one
+        results[(rev.id, exe.id, b.id, e.id)] = r
+    
+    if not results:
+        return statuses, []
+    
+    def getids():
+        ids = Result.objects.filter(
+            revision__in=set([key[0] for key in results]),
+            executable__in=set([key[1] for key in results]),
+            benchmark__in=set([key[2] for key in results]),
+            environment__in=set([key[3] for key in results]),
+        ).values_list('id', 'revision', 'executable', 'benchmark', 'environment')
+        return dict([(tuple(row[1:]), row[0]) for row in ids])
+    existing = getids()
+    new_results, changed_results = [], []
+    for key, r in results.items():
+        if key in existing:
+            r.id = existing[key]
+            changed_results.append(r)
+        else:
+            new_results.append(r)
+    bulkupdate(Result, changed_results)
+    if new_results:
+        bulkinsert(Result, new_results)
+        ids = getids()
+        for key, r in results.items():
+            r.id = ids[key]
+    summaries.updatesummaries(results.values())
+    changepoints.updatechangepoints(results.values())
+    return statuses, results.values()
+
+def saveresults(items):
+    """Saves a list of result data dicts in a single transaction.
+    Returns a status dict for each item, in the same order
+    """
+    statuses, results = retryconflicts(storeresults, items)
+    # Only invalidate once the transaction has been commited, so that
+    # no response is cached with the old data
+    for project, environment in set([(r.executable.project_id, r.environment_id)
+            for r in results]):
+        cache.invalidate(project, environment)
+    archive.updatearchive(results)
+    return statuses
+
+def addresults(request):
+    """Saves a JSON array of results, given either as the "json" POST field
+    or as the request body. Returns a JSON status for every result so that
+    clients can resend only the failed ones
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed('POST')
+    if 'json' in request.POST:
+        items = request.POST['json']
+    else:
+        items = request.raw_post_data
+    try:
+        items = json.loads(items)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid JSON data")
+    if not isinstance(items, list):
+        return HttpResponseBadRequest("JSON data must be a list of results")
+    
+    statuses = saveresults(items)
+    saved = len([s for s in statuses if s['status'] == 'saved'])
+    return HttpResponse(json.dumps({
+        'saved': saved,
+        'failed': len(statuses) - saved,
+        'results': statuses,
+    }))
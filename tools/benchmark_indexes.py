@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Measures the query plans and timings of the Result and Revision hot paths  #
+# on a synthetic dataset, before and after creating the composite indexes    #
+# defined in speedcenter/codespeed/sql/                                      #
+#                                                                            #
+# Usage:                                                                     #
+#   python benchmark_indexes.py --rows 10000000                              #
+#   python benchmark_indexes.py --postgresql "dbname=bench user=bench"       #
+###############################################################################
+import os, sys, time, random
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+EXECUTABLES = 4
+BENCHMARKS = 50
+ENVIRONMENTS = 2
+REPETITIONS = 20
+
+TABLES = [
+    """CREATE TABLE codespeed_revision (
+        id integer NOT NULL PRIMARY KEY,
+        commitid varchar(42) NOT NULL,
+        project_id integer NOT NULL,
+        tag varchar(20) NOT NULL,
+        date %(datetime)s NULL,
+        UNIQUE (commitid, project_id))""",
+    """CREATE TABLE codespeed_result (
+        id integer NOT NULL PRIMARY KEY,
+        value %(float)s NOT NULL,
+        std_dev %(float)s NULL,
+        revision_id integer NOT NULL,
+        revision_date %(datetime)s NULL,
+        executable_id integer NOT NULL,
+        benchmark_id integer NOT NULL,
+        environment_id integer NOT NULL,
+        UNIQUE (revision_id, executable_id, benchmark_id, environment_id))""",
+    "CREATE INDEX codespeed_result_revision_id ON codespeed_result (revision_id)",
+]
+
+SQLDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'speedcenter', 'codespeed', 'sql')
+
+QUERIES = [
+    ('timeline (join on revision date)',
+        """SELECT rev.date, r.value, r.std_dev, rev.commitid
+        FROM codespeed_result r INNER JOIN codespeed_revision rev ON r.revision_id = rev.id
+        WHERE r.benchmark_id = %(p)s AND r.environment_id = %(p)s AND r.executable_id = %(p)s
+        ORDER BY rev.date DESC LIMIT 200""",
+        lambda options: [random.randint(1, BENCHMARKS), 1, 1]),
+    ('timeline (denormalized revision date)',
+        """SELECT r.revision_date, r.value, r.std_dev, rev.commitid
+        FROM codespeed_result r INNER JOIN codespeed_revision rev ON r.revision_id = rev.id
+        WHERE r.benchmark_id = %(p)s AND r.environment_id = %(p)s AND r.executable_id = %(p)s
+        ORDER BY r.revision_date DESC LIMIT 200""",
+        lambda options: [random.randint(1, BENCHMARKS), 1, 1]),
+    ('latest revisions of a project',
+        """SELECT id, commitid, date FROM codespeed_revision
+        WHERE project_id = %(p)s ORDER BY date DESC LIMIT 20""",
+        lambda options: [1]),
+    ('changes table',
+        """SELECT revision_id, benchmark_id, value FROM codespeed_result
+        WHERE revision_id IN (%(p)s, %(p)s, %(p)s) AND environment_id = %(p)s
+        AND executable_id = %(p)s""",
+        lambda options: [random.randint(1, options.revisions) for i in range(3)] + [1, 1]),
+]
+
+
+def connect_sqlite(options):
+    import sqlite3
+    if os.path.exists(options.sqlite):
+        os.remove(options.sqlite)
+    conn = sqlite3.connect(options.sqlite)
+    types = {'datetime': 'datetime', 'float': 'real', 'p': '?'}
+    explain = 'EXPLAIN QUERY PLAN '
+    return conn, types, explain
+
+def connect_postgresql(options):
+    import psycopg2
+    conn = psycopg2.connect(options.postgresql)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS codespeed_result, codespeed_revision")
+    conn.commit()
+    types = {'datetime': 'timestamp with time zone', 'float': 'double precision', 'p': '%s'}
+    explain = 'EXPLAIN ANALYZE '
+    return conn, types, explain
+
+def populate(conn, types, options):
+    cursor = conn.cursor()
+    for sql in TABLES:
+        cursor.execute(sql % types)
+    start = datetime(2010, 1, 1)
+    insert = "INSERT INTO codespeed_revision VALUES (%(p)s, %(p)s, %(p)s, '', %(p)s)" % types
+    cursor.executemany(insert, [
+        (i, str(i), 1 + i % 2, start + timedelta(hours=i))
+        for i in range(1, options.revisions + 1)])
+
+    insert = "INSERT INTO codespeed_result VALUES (%s)" % ", ".join([types['p']] * 8)
+    def rows():
+        i = 0
+        for rev in range(1, options.revisions + 1):
+            date = start + timedelta(hours=rev)
+            for exe in range(1, EXECUTABLES + 1):
+                for bench in range(1, BENCHMARKS + 1):
+                    for env in range(1, ENVIRONMENTS + 1):
+                        i += 1
+                        if i > options.rows: return
+                        yield (i, random.random(), random.random() / 10,
+                            rev, date, exe, bench, env)
+    t0 = time.time()
+    batch = []
+    for row in rows():
+        batch.append(row)
+        if len(batch) == 10000:
+            cursor.executemany(insert, batch)
+            batch = []
+    if batch:
+        cursor.executemany(insert, batch)
+    conn.commit()
+    print "Inserted %d results in %.1fs" % (options.rows, time.time() - t0)
+
+def create_indexes(conn):
+    cursor = conn.cursor()
+    for filename in ['result.sql', 'revision.sql']:
+        for statement in open(os.path.join(SQLDIR, filename)).read().split(';'):
+            statement = "\n".join([line for line in statement.splitlines()
+                if not line.startswith('--')]).strip()
+            if statement:
+                t0 = time.time()
+                cursor.execute(statement)
+                print "%s (%.1fs)" % (statement, time.time() - t0)
+    conn.commit()
+    try:
+        cursor.execute("ANALYZE")
+    except Exception:
+        pass
+    conn.commit()
+
+def run_queries(conn, types, explain, options):
+    cursor = conn.cursor()
+    results = {}
+    for name, sql, params in QUERIES:
+        sql = sql % types
+        cursor.execute(explain + sql, params(options))
+        print "\n== %s ==" % name
+        for row in cursor.fetchall():
+            print "   ", " ".join([str(col) for col in row])
+        timings = []
+        for i in range(REPETITIONS):
+            t0 = time.time()
+            cursor.execute(sql, params(options))
+            cursor.fetchall()
+            timings.append(time.time() - t0)
+        results[name] = timings
+        print "    min: %.2fms  avg: %.2fms" % (
+            min(timings) * 1000, sum(timings) / len(timings) * 1000)
+    return results
+
+def benchmark(connect, options):
+    conn, types, explain = connect(options)
+    populate(conn, types, options)
+    print "\n######## Without composite indexes ########"
+    before = run_queries(conn, types, explain, options)
+    print "\n######## Creating composite indexes ########"
+    create_indexes(conn)
+    print "\n######## With composite indexes ########"
+    after = run_queries(conn, types, explain, options)
+    print "\n######## Summary (average) ########"
+    for name, sql, params in QUERIES:
+        b = sum(before[name]) / len(before[name]) * 1000
+        a = sum(after[name]) / len(after[name]) * 1000
+        print "%-40s %10.2fms -> %8.2fms" % (name, b, a)
+    conn.close()
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--rows", type="int", default=10000000,
+        help="number of results to generate (default 10M)")
+    parser.add_option("--sqlite", default="benchmark_indexes.db",
+        help="SQLite database file to create")
+    parser.add_option("--postgresql", default=None,
+        help="psycopg2 connection string. If given, PostgreSQL is benchmarked too")
+    options, args = parser.parse_args()
+    per_revision = EXECUTABLES * BENCHMARKS * ENVIRONMENTS
+    options.revisions = (options.rows + per_revision - 1) // per_revision
+
+    random.seed(0)
+    print "######## SQLite ########"
+    benchmark(connect_sqlite, options)
+    if options.postgresql:
+        print "\n######## PostgreSQL ########"
+        benchmark(connect_postgresql, options)
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Load and latency benchmark of the Codespeed web endpoints                  #
+#                                                                             #
+# Generates a synthetic dataset of the given size in an SQLite database,     #
+# counts the SQL queries of every endpoint and then drives each of them with #
+# concurrent requests, calling Django's WSGI handler in-process (default) or #
+# through a local threaded WSGI server. Reports latency percentiles and      #
+# throughput, and saves them as JSON to compare runs.                         #
+#                                                                             #
+# Usage:                                                                      #
+#   python benchmark_views.py --revisions 1000 --benchmarks 50               #
+#   python benchmark_views.py --concurrency 8 --wsgi --output new.json       #
+#   python benchmark_views.py --reuse --compare old.json                     #
+###############################################################################
+import os, sys, json, time, random, urllib, urllib2, threading
+from datetime import datetime, timedelta
+from optparse import OptionParser
+from cStringIO import StringIO
+from wsgiref.util import setup_testing_defaults
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'speedcenter'))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'speedcenter.settings'
+
+PERCENTILES = [50, 95, 99]
+
+
+def setup(options):
+    '''Points Django to the benchmark database and configures the cache'''
+    from django.conf import settings
+    settings.DATABASE_ENGINE = 'sqlite3'
+    settings.DATABASE_NAME = os.path.abspath(options.sqlite)
+    settings.DEBUG = False
+    from codespeed import settings as codespeed_settings
+    if options.nocache: codespeed_settings.responsecache = None
+
+def populate(options):
+    """Creates the synthetic dataset: every project has its executables,
+    and every revision results for all executables, benchmarks and
+    environments of its project
+    """
+    from django.core.management import call_command
+    from codespeed.models import Project, Revision, Result, Executable, \
+        Benchmark, Environment, bulkinsert
+    if os.path.exists(options.sqlite): os.remove(options.sqlite)
+    call_command('syncdb', interactive=False, verbosity=0)
+    t0 = time.time()
+    environments = []
+    for i in range(options.environments):
+        env = Environment(name='env%d' % i)
+        env.save()
+        environments.append(env)
+    benchmarks = []
+    for i in range(options.benchmarks):
+        bench = Benchmark(name='bench%03d' % i)
+        bench.save()
+        benchmarks.append(bench)
+    start = datetime(2010, 1, 1)
+    results = 0
+    for p in range(options.projects):
+        project = Project(name='project%d' % p, track=True)
+        project.save()
+        executables = []
+        for e in range(options.executables):
+            exe = Executable(name='exe%d-%d' % (p, e), project=project)
+            exe.save()
+            executables.append(exe)
+        bulkinsert(Revision, [Revision(commitid=str(i), project=project,
+            date=start + timedelta(hours=i)) for i in range(options.revisions)])
+        for rev in Revision.objects.filter(project=project).order_by('date'):
+            batch = []
+            for exe in executables:
+                for bench in benchmarks:
+                    for env in environments:
+                        batch.append(Result(revision=rev, revision_date=rev.date,
+                            date=rev.date, executable=exe, benchmark=bench,
+                            environment=env, value=random.uniform(1, 2),
+                            std_dev=random.uniform(0, 0.1)))
+            bulkinsert(Result, batch)
+            results += len(batch)
+    call_command('backfillsummaries', verbosity=0)
+    call_command('detectchangepoints', verbosity=0)
+    print "Generated %d results in %.1fs" % (results, time.time() - t0)
+
+def getendpoints(options):
+    """Returns the benchmarked endpoints as (name, method, path, params)
+    tuples, where params is a function returning random request data
+    """
+    from codespeed.models import Executable, Benchmark, Environment
+    executables = list(Executable.objects.select_related('project'))
+    benchmarks = [bench.name for bench in Benchmark.objects.all()]
+    environments = [env.name for env in Environment.objects.all()]
+    def revision():
+        # Mostly recent revisions, like real users
+        return str(max(0, options.revisions - 1 - int(random.expovariate(0.1))))
+    def exe():
+        return str(random.choice(executables).id)
+    counter = [0]
+    def newresult():
+        counter[0] += 1
+        exe = random.choice(executables)
+        return {
+            'commitid': 'bench%d-%d' % (os.getpid(), counter[0]),
+            'project': exe.project.name,
+            'executable': exe.name,
+            'benchmark': random.choice(benchmarks),
+            'environment': random.choice(environments),
+            'result_value': random.uniform(1, 2),
+        }
+    return [
+        ('changes', 'GET', 'changes/', lambda: {'rev': revision(), 'exe': exe(),
+            'env': random.choice(environments)}),
+        ('changes/table', 'GET', 'changes/table/', lambda: {'rev': revision(),
+            'exe': exe(), 'env': random.choice(environments), 'tre': 10}),
+        ('timeline/json', 'GET', 'timeline/json/', lambda: {'exe': exe(),
+            'ben': random.choice(benchmarks), 'env': random.choice(environments),
+            'revs': 200, 'base': 'none'}),
+        ('timeline/json grid', 'GET', 'timeline/json/', lambda: {'exe': exe(),
+            'ben': 'grid', 'env': random.choice(environments), 'revs': 15,
+            'base': 'none'}),
+        ('comparison/json', 'GET', 'comparison/json/', lambda: {}),
+        ('result/add', 'POST', 'result/add/', newresult),
+    ]
+
+def countqueries(endpoints):
+    '''Returns the number of SQL queries of each endpoint, without cache'''
+    from django.conf import settings
+    from django.db import connection
+    from django.core.handlers.wsgi import WSGIHandler
+    from codespeed import cache
+    handler = WSGIHandler()
+    counts = {}
+    settings.DEBUG = True
+    try:
+        for name, method, path, params in endpoints:
+            cache.invalidate_all()
+            connection.queries = []
+            request(handler, None, method, path, params())
+            counts[name] = len(connection.queries)
+    finally:
+        settings.DEBUG = False
+    return counts
+
+def request(handler, url, method, path, data):
+    """Sends a request, to the given WSGI handler or, if url is given, over
+    HTTP. Raises an exception if it doesn't succeed
+    """
+    data = urllib.urlencode(data)
+    if url is None:
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': '/' + path,
+            'QUERY_STRING': '', 'wsgi.input': StringIO(''), 'CONTENT_LENGTH': '0'}
+        if method == 'GET':
+            environ['QUERY_STRING'] = data
+        else:
+            environ['wsgi.input'] = StringIO(data)
+            environ['CONTENT_LENGTH'] = str(len(data))
+            environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        setup_testing_defaults(environ)
+        status = []
+        def start_response(code, headers):
+            status.append(code)
+        response = handler(environ, start_response)
+        try:
+            "".join(response)
+        finally:
+            if hasattr(response, 'close'): response.close()
+        if not status[0].startswith('200'):
+            raise IOError("error " + status[0])
+        return
+    if method == 'GET': f = urllib2.urlopen(url + path + '?' + data)
+    else: f = urllib2.urlopen(url + path, data)
+    f.read()
+    f.close()
+
+def startserver():
+    '''Starts a threaded WSGI server on a free port. Returns its URL'''
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+    from SocketServer import ThreadingMixIn
+    from django.core.handlers.wsgi import WSGIHandler
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args): pass
+    server = make_server('127.0.0.1', 0, WSGIHandler(), Server, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return 'http://127.0.0.1:%d/' % server.server_port
+
+def percentile(ordered, p):
+    '''Nearest rank percentile of an ordered list'''
+    if not ordered: return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+def run(endpoint, options, url):
+    """Sends options.requests requests to an endpoint from
+    options.concurrency threads. Returns the latency and throughput stats
+    """
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+    name, method, path, params = endpoint
+    latencies, errors = [], []
+    lock = threading.Lock()
+    remaining = [options.requests]
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not remaining[0]: return
+                remaining[0] -= 1
+                data = params()
+            finally:
+                lock.release()
+            t0 = time.time()
+            try:
+                request(handler, url, method, path, data)
+            except Exception, e:
+                lock.acquire()
+                errors.append(str(e))
+                lock.release()
+                continue
+            latency = time.time() - t0
+            lock.acquire()
+            latencies.append(latency)
+            lock.release()
+    threads = [threading.Thread(target=worker) for i in range(options.concurrency)]
+    t0 = time.time()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.time() - t0
+    latencies.sort()
+    stats = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+        'mean': latencies and sum(latencies) / len(latencies) * 1000 or None,
+        'max': latencies and latencies[-1] * 1000 or None,
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        stats['p%d' % p] = value is not None and value * 1000 or None
+    if errors: stats['first_error'] = errors[0]
+    return stats
+
+def report(results, previous=None):
+    print "\n%-20s %8s %8s %8s %8s %9s %7s %6s" % ('endpoint', 'p50 ms',
+        'p95 ms', 'p99 ms', 'mean ms', 'req/s', 'queries', 'errors')
+    for name, stats in results['endpoints']:
+        print "%-20s %8.1f %8.1f %8.1f %8.1f %9.1f %7s %6d" % (name,
+            stats['p50'] or 0, stats['p95'] or 0, stats['p99'] or 0,
+            stats['mean'] or 0, stats['throughput'], stats['queries'],
+            stats['errors'])
+        if previous and name in previous and previous[name]['p50'] and stats['p50']:
+            old = previous[name]
+            print "%-20s %7.2fx %7.2fx %7.2fx %18.2fx %7s" % ('  vs previous',
+                stats['p50'] / old['p50'], stats['p95'] / old['p95'],
+                stats['p99'] / old['p99'], stats['throughput'] / old['throughput'],
+                "%+d" % (stats['queries'] - old['queries']))
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--sqlite", default="benchmark_views.db",
+        help="SQLite database file to create (default benchmark_views.db)")
+    parser.add_option("--reuse", action="store_true", default=False,
+        help="use the existing database instead of generating a new one")
+    parser.add_option("--projects", type="int", default=2)
+    parser.add_option("--executables", type="int", default=2,
+        help="number of executables per project (default 2)")
+    parser.add_option("--revisions", type="int", default=500,
+        help="number of revisions per project (default 500)")
+    parser.add_option("--benchmarks", type="int", default=20)
+    parser.add_option("--environments", type="int", default=2)
+    parser.add_option("--requests", type="int", default=200,
+        help="number of requests per endpoint (default 200)")
+    parser.add_option("--concurrency", type="int", default=4,
+        help="number of concurrent clients (default 4)")
+    parser.add_option("--endpoints", default=None,
+        help="comma separated names of the endpoints to benchmark (default all)")
+    parser.add_option("--wsgi", action="store_true", default=False,
+        help="send HTTP requests to a local WSGI server instead of calling the WSGI handler")
+    parser.add_option("--nocache", action="store_true", default=False,
+        help="disable the response cache")
+    parser.add_option("--output", default=None, help="JSON file to save the results in")
+    parser.add_option("--compare", default=None,
+        help="JSON file with the results of a previous run to compare with")
+    options, args = parser.parse_args()
+
+    random.seed(0)
+    setup(options)
+    if not options.reuse or not os.path.exists(options.sqlite):
+        populate(options)
+    endpoints = getendpoints(options)
+    if options.endpoints:
+        names = options.endpoints.split(",")
+        endpoints = [endpoint for endpoint in endpoints if endpoint[0] in names]
+    queries = countqueries(endpoints)
+    url = options.wsgi and startserver() or None
+
+    results = {
+        'date': str(datetime.today()),
+        'options': dict([(key, getattr(options, key)) for key in ['projects',
+            'executables', 'revisions', 'benchmarks', 'environments', 'requests',
+            'concurrency', 'wsgi', 'nocache']]),
+        'endpoints': [],
+    }
+    for endpoint in endpoints:
+        stats = run(endpoint, options, url)
+        stats['queries'] = queries[endpoint[0]]
+        results['endpoints'].append((endpoint[0], stats))
+        print "%s: %d requests, %.1f req/s" % (endpoint[0], stats['requests'],
+            stats['throughput'])
+
+    previous = None
+    if options.compare:
+        previous = dict(json.load(open(options.compare))['endpoints'])
+    report(results, previous)
+    if options.output:
+        f = open(options.output, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
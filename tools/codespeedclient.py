@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+# Client library for saving result data to a Codespeed server               #
+#                                                                             #
+# Results are sent in batches to result/add/json/ over a persistent HTTP      #
+# connection, retrying with exponential backoff. With a spool directory,      #
+# full batches are only written to disk, and they are sent by flush() or      #
+# close(). A batch is removed once the server has accepted it, so no results  #
+# are lost when the server is down: they are sent by the next flush, or with  #
+#   python codespeedclient.py --spool DIR http://localhost:8000/              #
+# Batches the server rejects as invalid are renamed to .rejected, so that     #
+# they don't hold back the following ones.                                    #
+#                                                                             #
+# Usage:                                                                      #
+#   client = Client('http://localhost:8000/', spool='/var/spool/codespeed')  #
+#   client.add({'commitid': '1', 'project': 'MyProject', ...})               #
+#   client.close()                                                            #
+###############################################################################
+import os, sys, time, json, socket, urllib, httplib, urlparse
+from datetime import datetime
+from optparse import OptionParser
+
+
+class ServerError(Exception):
+    '''The server could not be reached or did not accept the request'''
+
+
+class RejectedError(ServerError):
+    '''The server rejected the request as invalid, sending it again would fail
+    again
+    '''
+
+
+class Client(object):
+    def __init__(self, url, batchsize=100, spool=None, timeout=30, retries=3,
+            backoff=1.0, maxbackoff=60.0, verbose=True):
+        if not url.endswith('/'): url += '/'
+        self.url = url
+        parts = urlparse.urlsplit(url)
+        self.scheme, self.host, self.path = parts[0], parts[1], parts[2]
+        self.batchsize = batchsize
+        self.spool = spool
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.verbose = verbose
+        self.connection = None
+        # Older servers only have result/add/
+        self.batching = True
+        # Results added but not sent or spooled yet
+        self.pending = []
+        # Results the server rejected, with the error messages
+        self.rejected = []
+        self.counter = 0
+        if spool and not os.path.exists(spool): os.makedirs(spool)
+
+    def log(self, message):
+        if self.verbose: print "%s: %s" % (datetime.today(), message)
+
+    def add(self, data):
+        """Adds a result. It is sent when the batch is full or, with a spool,
+        the full batch is spooled to be sent by flush() or close()
+        """
+        self.pending.append(data)
+        if len(self.pending) >= self.batchsize:
+            if self.spool:
+                self.writespool(self.pending)
+                self.pending = []
+                return True
+            return self.flush()
+        return True
+
+    def flush(self):
+        """Sends the pending results and the spooled ones.
+        Returns False if some of them could not be sent, which are then kept
+        in the spool (or in memory without a spool) to be sent later
+        """
+        if self.spool:
+            if self.pending:
+                self.writespool(self.pending)
+                self.pending = []
+            for name in self.spooled():
+                f = open(name)
+                try:
+                    items = json.load(f)
+                except ValueError:
+                    # Interrupted while being written
+                    items = None
+                f.close()
+                if items:
+                    try:
+                        self.send(items)
+                    except RejectedError, e:
+                        # Kept aside, so that the following batches are sent
+                        self.rejectbatch(items, e)
+                        try:
+                            os.rename(name, name[:-len('.json')] + '.rejected')
+                        except OSError:
+                            pass
+                        continue
+                    except ServerError, e:
+                        self.log("%d results spooled in %s: %s" % (
+                            len(items), self.spool, e))
+                        return False
+                try:
+                    os.remove(name)
+                except OSError:
+                    # Sent by another client sharing the spool
+                    pass
+            return True
+        while self.pending:
+            batch = self.pending[:self.batchsize]
+            try:
+                self.send(batch)
+            except RejectedError, e:
+                self.rejectbatch(batch, e)
+            except ServerError, e:
+                self.log("%d results not sent: %s" % (len(self.pending), e))
+                return False
+            self.pending = self.pending[len(batch):]
+        return True
+
+    def close(self):
+        '''Flushes the results and closes the connection'''
+        try:
+            return self.flush()
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def spooled(self):
+        '''Returns the spool files, oldest first'''
+        return [os.path.join(self.spool, name) for name in sorted(os.listdir(self.spool))
+            if name.endswith('.json')]
+
+    def writespool(self, items):
+        self.counter += 1
+        name = "%s-%d-%06d.json" % (datetime.today().strftime("%Y%m%d%H%M%S%f"),
+            os.getpid(), self.counter)
+        path = os.path.join(self.spool, name)
+        # Written under another name and renamed, so a partial file is never sent
+        f = open(path + ".tmp", 'w')
+        try:
+            json.dump(items, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(path + ".tmp", path)
+
+    def send(self, items):
+        """Sends results, retrying with exponential backoff.
+        Raises ServerError if the server can't be reached
+        """
+        if not self.batching:
+            for item in items:
+                status, response = self.request('result/add/',
+                    urllib.urlencode(item), 'application/x-www-form-urlencoded')
+                if status != 200: self.reject(item, response)
+            self.log("%d results sent" % len(items))
+            return
+        status, response = self.request('result/add/json/',
+            json.dumps(items, default=str), 'application/json')
+        if status == 404:
+            self.log("The server doesn't accept batches, sending results one by one")
+            self.batching = False
+            return self.send(items)
+        elif 400 <= status < 500:
+            raise RejectedError("error %d %s" % (status, response[:200]))
+        elif status != 200:
+            raise ServerError("error %d %s" % (status, response[:200]))
+        results = json.loads(response)['results']
+        for item, result in zip(items, results):
+            if result['status'] != 'saved': self.reject(item, result['message'])
+        self.log("%d results saved" % len(
+            [result for result in results if result['status'] == 'saved']))
+
+    def reject(self, item, message):
+        """Records a result the server didn't accept because of invalid data.
+        Sending it again would fail again
+        """
+        self.rejected.append((item, message))
+        self.log("Result for %s, revision %s, benchmark %s rejected: %s" % (
+            item.get('executable'), item.get('commitid'), item.get('benchmark'),
+            message))
+
+    def rejectbatch(self, items, error):
+        '''Records a batch the server didn't accept as a whole'''
+        self.rejected.extend([(item, str(error)) for item in items])
+        self.log("%d results rejected: %s" % (len(items), error))
+
+    def request(self, path, body, contenttype):
+        """POSTs a request over the persistent connection.
+        Returns the status and the response. Server errors are retried, and
+        ServerError is raised when the retries are exhausted
+        """
+        delay = self.backoff
+        attempt = 0
+        while True:
+            reused = self.connection is not None
+            try:
+                return self.post(path, body, contenttype)
+            except (socket.error, httplib.HTTPException, ServerError), e:
+                error = e
+                if self.connection is not None:
+                    self.connection.close()
+                    self.connection = None
+            if reused and not isinstance(error, ServerError):
+                # The server closed the idle connection: reconnect right away
+                continue
+            if attempt >= self.retries: break
+            attempt += 1
+            time.sleep(delay)
+            delay = min(delay * 2, self.maxbackoff)
+        raise ServerError("%s%s: %s" % (self.url, path, error))
+
+    def post(self, path, body, contenttype):
+        if self.connection is None:
+            if self.scheme == 'https': cls = httplib.HTTPSConnection
+            else: cls = httplib.HTTPConnection
+            self.connection = cls(self.host, timeout=self.timeout)
+        self.connection.request('POST', self.path + path, body, {
+            'Content-Type': contenttype,
+            'Connection': 'keep-alive',
+        })
+        response = self.connection.getresponse()
+        content = response.read()
+        if response.getheader('connection', '').lower() == 'close' or \
+                response.version < 11:
+            # The server doesn't keep the connection open
+            self.connection.close()
+            self.connection = None
+        if response.status >= 500:
+            raise ServerError("error %d %s" % (response.status, content[:200]))
+        return response.status, content
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog --spool DIR URL",
+        description="Sends the results spooled in DIR to the Codespeed server at URL")
+    parser.add_option('--spool', help='Spool directory')
+    options, args = parser.parse_args()
+    if not options.spool or len(args) != 1:
+        parser.error("Enter the spool directory and the server URL")
+    if not Client(args[0], spool=options.spool).close():
+        sys.exit(1)
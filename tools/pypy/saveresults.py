@@ -3,14 +3,19 @@
 # This script saves result data                       #
 # It expects the format of unladen swallow's perf.py  #
 #######################################################
-import urllib, urllib2
+import os, sys
 from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from codespeedclient import Client
 
 #SPEEDURL = 'http://127.0.0.1:8000/'
 SPEEDURL = 'http://speed.pypy.org/'
+# Results that can't be sent are kept here and sent on the next run
+SPOOLDIR = os.path.expanduser('~/.codespeed/spool')
 
 def save(project, revision, results, options, executable, environment, testing=False):
     testparams = []
+    if not testing: client = Client(SPEEDURL, spool=SPOOLDIR)
     #Parse data
     data = {}
     current_date = datetime.today()
@@ -23,8 +28,12 @@ def save(project, revision, results, options, executable, environment, testing=F
             value = results['changed_time']
         elif res_type == "ComparisonResult":
             value = results['avg_changed']
+        elif res_type == "RawResult":
+            times = results['changed_times']
+            value = sum(times) / len(times)
         else:
             print("ERROR: result type unknown " + b[1])
+            if not testing: client.close()
             return 1
         data = {
             'commitid': revision,
@@ -36,31 +45,18 @@ def save(project, revision, results, options, executable, environment, testing=F
         }
         if res_type == "ComparisonResult":
             data['std_dev'] = results['std_changed']
+        if results.get('changed_times'):
+            # Raw timings of every iteration
+            data['samples'] = ",".join([repr(t) for t in results['changed_times']])
         if testing: testparams.append(data)
-        else: send(data)
+        else: client.add(data)
     if testing: return testparams
-    else: return 0
+    elif client.close(): return 0
+    else: return 1
     
 def send(data):
-    #save results
-    params = urllib.urlencode(data)
-    f = None
-    response = "None"
-    info = str(datetime.today()) + ": Saving result for " + data['executable']
-    info += " revision " + " " + str(data['commitid']) + ", benchmark "
-    info += data['benchmark']
-    print(info)
-    try:
-        f = urllib2.urlopen(SPEEDURL + 'result/add/', params)
-        response = f.read()
-        f.close()
-    except urllib2.URLError, e:
-        if hasattr(e, 'reason'):
-            response = '\n  We failed to reach a server\n'
-            response += '  Reason: ' + str(e.reason)
-        elif hasattr(e, 'code'):
-            response = '\n  The server couldn\'t fulfill the request\n'
-            response += '  Error code: ' + str(e)
-        print("Server (%s) response: %s\n" % (SPEEDURL, response))
-        return 1
-    return 0
+    #save a single result
+    client = Client(SPEEDURL, spool=SPOOLDIR)
+    client.add(data)
+    if client.close(): return 0
+    return 1
@@ -3,7 +3,7 @@
 # Sample script that shows how to save result data #
 ####################################################
 from datetime import datetime
-import urllib, urllib2
+from codespeedclient import Client
 
 # You need to enter the real URL and have the server running
 CODESPEED_URL = 'http://localhost:8000/'
@@ -26,13 +26,14 @@ data = {
 }
 
 def add(data):
-    params = urllib.urlencode(data)
-    response = "None"
     print "Executable %s, revision %s, benchmark %s" % (data['executable'], data['commitid'], data['benchmark'])
-    f = urllib2.urlopen(CODESPEED_URL + 'result/add/', params)
-    response = f.read()
-    f.close()
-    print "Server (%s) response: %s\n" % (CODESPEED_URL, response)
+    # Many results can be added to the same client before closing it, and
+    # they are sent in batches. Give it a spool directory so that results
+    # are kept on disk when the server can't be reached
+    client = Client(CODESPEED_URL)
+    client.add(data)
+    if client.close() and not client.rejected:
+        print "Result saved in %s\n" % CODESPEED_URL
 
 if __name__ == "__main__":
     add(data)
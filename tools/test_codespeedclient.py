@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import os, json, socket, shutil, tempfile, threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import codespeedclient
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''Answers result/add/json/ with the next status of the server'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        items = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.server.statuses: status = self.server.statuses.pop(0)
+        else: status = 200
+        if status == 200:
+            self.server.received.extend(items)
+            body = json.dumps({'results': [{'status': 'saved'} for item in items]})
+        else:
+            body = "Error"
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class testClient(unittest.TestCase):
+    '''Tests the client library against a stub Codespeed server'''
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.received = []
+        self.server.statuses = []
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.spool = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.spool)
+
+    def getclient(self, url=None, **kwargs):
+        return codespeedclient.Client(url or self.url, batchsize=2, retries=2,
+            backoff=0.01, verbose=False, **kwargs)
+
+    def getresults(self, count, start=0):
+        return [{'commitid': str(start + i), 'project': 'MyProject',
+            'executable': 'myexe', 'benchmark': 'float',
+            'environment': 'Dual Core', 'result_value': 1.0 + i}
+            for i in range(count)]
+
+    def getdownurl(self):
+        '''Returns the URL of a port nobody listens on'''
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+        s.close()
+        return 'http://127.0.0.1:%d/' % port
+
+    def testSend(self):
+        '''Results are sent in batches, the last one by close()'''
+        client = self.getclient()
+        results = self.getresults(5)
+        for result in results:
+            self.assertTrue(client.add(result))
+        self.assertEqual(len(self.server.received), 4)
+        self.assertTrue(client.close())
+        self.assertEqual(self.server.received, results)
+
+    def testRetry(self):
+        '''Server errors are retried'''
+        self.server.statuses = [503, 500]
+        client = self.getclient()
+        results = self.getresults(2)
+        for result in results:
+            client.add(result)
+        self.assertTrue(client.close())
+        self.assertEqual(self.server.received, results)
+
+        self.server.statuses = [503, 503, 503]
+        client = self.getclient()
+        client.add(results[0])
+        self.assertFalse(client.close())
+        self.assertEqual(client.pending, results[:1])
+
+    def testSpool(self):
+        """Spooled results are only sent by close(), and they stay in the
+        spool while the server is down until they are resent
+        """
+        client = self.getclient(spool=self.spool)
+        for result in self.getresults(4):
+            self.assertTrue(client.add(result))
+        self.assertEqual(self.server.received, [])
+        self.assertEqual(len(client.spooled()), 2)
+
+        client = self.getclient(self.getdownurl(), spool=self.spool)
+        results = self.getresults(5)
+        for result in results:
+            client.add(result)
+        self.assertFalse(client.close())
+        self.assertEqual(len(client.spooled()), 5)
+
+        # Resent by the next client
+        self.assertTrue(self.getclient(spool=self.spool).close())
+        self.assertEqual(self.server.received, self.getresults(4) + results)
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def testRejected(self):
+        '''A rejected spooled batch is set aside, and the next ones are sent'''
+        client = self.getclient(spool=self.spool)
+        results = self.getresults(4)
+        for result in results:
+            client.add(result)
+        self.server.statuses = [400]
+        self.assertTrue(client.close())
+        self.assertEqual(self.server.received, results[2:])
+        self.assertEqual([item for item, message in client.rejected], results[:2])
+        self.assertEqual(client.spooled(), [])
+        rejected = os.listdir(self.spool)
+        self.assertEqual(len(rejected), 1)
+        self.assertTrue(rejected[0].endswith('.rejected'))
+
+if __name__ == "__main__":
+    unittest.main()